@@ -0,0 +1,106 @@
+"""Checks that the simulation core imports quickly, without the visualization
+stack and without the dependencies it only loads lazily, so that starting
+worker processes stays cheap.
+
+    python -m benchmarks.import_time
+
+Exits with status 1 if the import takes longer than the budget or loads any
+of the lazily loaded modules.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+CORE_MODULES = (
+    "data_classes.distribution",
+    "data_classes.epoch_table",
+    "data_classes.replication_result",
+    "data_classes.simulation_config",
+    "simulation.adaptive",
+    "simulation.background_run",
+    "simulation.checkpoint",
+    "simulation.instrumentation",
+    "simulation.premium_surface",
+    "simulation.replication",
+    "simulation.simulation",
+    "simulation.sweep",
+    "simulation.vectorized_actors",
+    "utils.csv_processor",
+    "utils.market_data_cache",
+    "utils.shared_market_data"
+)
+
+# Modules the core must not import: the visualization stack, and
+# dependencies it imports on first use
+LAZY_MODULES = ("altair", "streamlit", "pandas", "scipy")
+
+# Seconds to import the core in a fresh interpreter, most of which is numpy
+IMPORT_TIME_BUDGET = 0.3
+
+MEASURE_IMPORT = """
+import json
+import sys
+from time import perf_counter
+
+start = perf_counter()
+for module in %r:
+    __import__(module)
+seconds = perf_counter() - start
+print(json.dumps({
+    "seconds": seconds,
+    "loaded": [module for module in %r if module in sys.modules]
+}))
+"""
+
+
+def measure_import(repeat: int) -> Dict[str, Any]:
+    """Returns the best time to import the core modules in a fresh
+    interpreter, and the lazily loaded modules that were imported.
+    """
+    measurements = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                MEASURE_IMPORT % (CORE_MODULES, LAZY_MODULES)
+            ],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout
+        measurements.append(json.loads(output))
+    return min(measurements, key=lambda measurement: measurement["seconds"])
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Check the import time of the simulation core")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=IMPORT_TIME_BUDGET,
+        help="maximum import time in seconds (default: %g)" %
+        IMPORT_TIME_BUDGET
+    )
+    args = parser.parse_args(argv)
+
+    measurement = measure_import(args.repeat)
+    print("Imported the simulation core in %.3f s (budget %.3f s)" % (
+        measurement["seconds"], args.budget))
+    is_ok = True
+    if measurement["seconds"] > args.budget:
+        print("Import time is over budget")
+        is_ok = False
+    if measurement["loaded"]:
+        print("Imported modules that must be loaded lazily: " +
+              ", ".join(measurement["loaded"]))
+        is_ok = False
+    return 0 if is_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,431 @@
+"""Benchmarks of the simulation hot paths, in isolation and end to end.
+
+Run the suite and write the results to a JSON file:
+
+    python -m benchmarks.suite run --output results.json
+
+Compare against the baseline stored in the repo and flag regressions (exits
+with status 1 if any benchmark is slower than the baseline by more than the
+threshold):
+
+    python -m benchmarks.suite compare benchmarks/baselines/baseline.json
+
+Update the baseline after an intended performance change:
+
+    python -m benchmarks.suite run --output benchmarks/baselines/baseline.json
+"""
+import argparse
+import json
+import platform
+import sys
+import timeit
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from data_classes.distribution import (Distribution, LPDistribution,
+                                       PurchaserDistribution)
+from data_classes.simulation_engine import SimulationEngine
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.option_pool import OptionPool
+from simulation.premium_surface import PremiumSurfaceCache
+from simulation.simulation import Simulation, create_epoch_dates
+from simulation.vectorized_actors import calculate_fills
+from utils.csv_processor import CSVProcessor
+
+BASELINE_VERSION = 1
+DATA_FILES = {
+    UnderlyingAsset.ETH: "data/eth.csv",
+    UnderlyingAsset.TSLA: "data/tsla.csv"
+}
+BATCH_SIZE = 100000
+PREMIUM_GRID_SIZE = 1025
+
+# Default end-to-end parameters, each varied in turn for the scaling curves
+NUM_LIQUIDITY_PROVIDERS = 10
+NUM_PURCHASERS = 100
+NUM_EPOCHS = 4
+SCALING_NUM_PURCHASERS = (10, 100, 1000)
+SCALING_NUM_LIQUIDITY_PROVIDERS = (1, 10, 100)
+SCALING_NUM_EPOCHS = (4, 16, 64)
+VECTORIZED_SCALING_NUM_PURCHASERS = (1000, 10000, 100000)
+
+# A benchmark's setup returns the function that is timed
+BENCHMARKS: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str) -> Callable:
+    def register(setup: Callable[[], Callable[[], Any]]) -> Callable:
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def load_csv_processor(asset: UnderlyingAsset) -> CSVProcessor:
+    return CSVProcessor(DATA_FILES[asset])
+
+
+def get_trading_date(csv_processor: CSVProcessor) -> datetime:
+    """Returns a date in the middle of the market data."""
+    return csv_processor.dates[len(csv_processor.dates) // 2].astype(
+        'datetime64[us]').item()
+
+
+def register_hot_path_benchmarks(asset: UnderlyingAsset) -> None:
+    prefix = asset.name.lower() + "/"
+
+    for suffix, use_cache in (("/csv", False), ("/cache", True)):
+
+        @benchmark(prefix + "csv_processor.load" + suffix)
+        def load(use_cache: bool = use_cache) -> Callable[[], Any]:
+            # Builds the cache, so that the timed loads read it
+            CSVProcessor(DATA_FILES[asset])
+            return lambda: CSVProcessor(DATA_FILES[asset], use_cache)
+
+    @benchmark(prefix + "csv_processor.get_underlying_price")
+    def get_underlying_price() -> Callable[[], Any]:
+        csv_processor = load_csv_processor(asset)
+        date = get_trading_date(csv_processor)
+        return lambda: csv_processor.get_underlying_price(date)
+
+    @benchmark(prefix + "csv_processor.get_underlying_price/as_of")
+    def get_underlying_price_as_of() -> Callable[[], Any]:
+        csv_processor = load_csv_processor(asset)
+        date = get_trading_date(csv_processor) + timedelta(hours=12)
+        return lambda: csv_processor.get_underlying_price(date)
+
+    @benchmark(prefix + "csv_processor.get_underlying_price_many")
+    def get_underlying_price_many() -> Callable[[], Any]:
+        csv_processor = load_csv_processor(asset)
+        dates = np.random.default_rng(0).choice(
+            csv_processor.dates, BATCH_SIZE)
+        return lambda: csv_processor.get_underlying_price_many(dates)
+
+    @benchmark(prefix + "option_pool.calculate_premium")
+    def calculate_premium() -> Callable[[], Any]:
+        csv_processor = load_csv_processor(asset)
+        option_pool = OptionPool(
+            csv_processor, Distribution(PurchaserDistribution.UNIFORM))
+        date = get_trading_date(csv_processor)
+        strike = csv_processor.get_underlying_price(date)
+        return lambda: option_pool.calculate_premium(date, strike)
+
+    @benchmark(prefix + "option_pool.calculate_premiums")
+    def calculate_premiums() -> Callable[[], Any]:
+        csv_processor = load_csv_processor(asset)
+        option_pool = OptionPool(
+            csv_processor, Distribution(PurchaserDistribution.UNIFORM))
+        date = get_trading_date(csv_processor)
+        strikes = option_pool.calculate_strike_prices(
+            np.random.default_rng(0).uniform(size=BATCH_SIZE), date)
+        return lambda: option_pool.calculate_premiums(date, strikes)
+
+    for suffix, grid_size in (("", None), ("/grid", PREMIUM_GRID_SIZE)):
+
+        @benchmark(prefix + "premium_surface_cache.calculate_premium" + suffix)
+        def cached_premium(grid_size: int = grid_size) -> Callable[[], Any]:
+            csv_processor = load_csv_processor(asset)
+            premium_cache = PremiumSurfaceCache(
+                csv_processor, grid_size=grid_size)
+            date = get_trading_date(csv_processor)
+            strike = csv_processor.get_underlying_price(date)
+            return lambda: premium_cache.calculate_premium(date, strike)
+
+        @benchmark(prefix + "premium_surface_cache.calculate_premiums" + suffix)
+        def cached_premiums(grid_size: int = grid_size) -> Callable[[], Any]:
+            csv_processor = load_csv_processor(asset)
+            premium_cache = PremiumSurfaceCache(
+                csv_processor, grid_size=grid_size)
+            option_pool = OptionPool(
+                csv_processor, Distribution(PurchaserDistribution.UNIFORM))
+            date = get_trading_date(csv_processor)
+            strikes = option_pool.calculate_strike_prices(
+                np.random.default_rng(0).uniform(size=BATCH_SIZE), date)
+            return lambda: premium_cache.calculate_premiums(date, strikes)
+
+
+def register_distribution_benchmarks() -> None:
+    for distribution in PurchaserDistribution:
+        suffix = "/" + distribution.name.lower()
+
+        @benchmark("distribution.generate_value" + suffix)
+        def generate_value(
+            distribution: PurchaserDistribution = distribution
+        ) -> Callable[[], Any]:
+            return Distribution(distribution).generate_value
+
+        @benchmark("distribution.generate_values" + suffix)
+        def generate_values(
+            distribution: PurchaserDistribution = distribution
+        ) -> Callable[[], Any]:
+            rng = np.random.default_rng(0)
+            return lambda: Distribution(distribution).generate_values(
+                BATCH_SIZE, rng)
+
+    for distribution in LPDistribution:
+        suffix = "/lp_" + distribution.name.lower()
+
+        @benchmark("distribution.generate_ranged_values" + suffix)
+        def generate_ranged_values(
+            distribution: LPDistribution = distribution
+        ) -> Callable[[], Any]:
+            rng = np.random.default_rng(0)
+            return lambda: Distribution(distribution).generate_ranged_values(
+                BATCH_SIZE, 1, 3, rng)
+
+    @benchmark("vectorized_actors.calculate_fills")
+    def calculate_fills_benchmark() -> Callable[[], Any]:
+        # Purchases that run out of liquidity halfway through the batch
+        unlocked = np.full(BATCH_SIZE, BATCH_SIZE / 2.0)
+        unlocked[::1000] += 10
+        return lambda: calculate_fills(unlocked)
+
+
+def register_simulation_benchmark(
+    asset: UnderlyingAsset,
+    name: str,
+    num_liquidity_providers: int = NUM_LIQUIDITY_PROVIDERS,
+    num_purchasers: int = NUM_PURCHASERS,
+    num_epochs: int = NUM_EPOCHS,
+    purchaser_distribution: PurchaserDistribution =
+        PurchaserDistribution.UNIFORM,
+    engine: SimulationEngine = SimulationEngine.OBJECT
+) -> None:
+    @benchmark(asset.name.lower() + "/simulation.run/" + name)
+    def run() -> Callable[[], Any]:
+        csv_processor = load_csv_processor(asset)
+        epoch_dates = create_epoch_dates(
+            csv_processor.get_first_date().date(), num_epochs)
+
+        def run_simulation() -> None:
+            Simulation(
+                csv_processor,
+                num_liquidity_providers,
+                num_purchasers,
+                epoch_dates,
+                Distribution(purchaser_distribution),
+                Distribution(LPDistribution.UNIFORM),
+                asset,
+                engine=engine,
+                seed=0
+            ).run()
+        return run_simulation
+
+
+def register_scaling_benchmarks(asset: UnderlyingAsset) -> None:
+    for num_purchasers in SCALING_NUM_PURCHASERS:
+        register_simulation_benchmark(
+            asset,
+            "purchasers=%d" % num_purchasers,
+            num_purchasers=num_purchasers
+        )
+    for num_liquidity_providers in SCALING_NUM_LIQUIDITY_PROVIDERS:
+        register_simulation_benchmark(
+            asset,
+            "liquidity_providers=%d" % num_liquidity_providers,
+            num_liquidity_providers=num_liquidity_providers
+        )
+    for num_epochs in SCALING_NUM_EPOCHS:
+        register_simulation_benchmark(
+            asset,
+            "epochs=%d" % num_epochs,
+            num_epochs=num_epochs
+        )
+    for distribution in PurchaserDistribution:
+        register_simulation_benchmark(
+            asset,
+            "distribution=%s" % distribution.name.lower(),
+            purchaser_distribution=distribution
+        )
+    for num_purchasers in VECTORIZED_SCALING_NUM_PURCHASERS:
+        register_simulation_benchmark(
+            asset,
+            "vectorized/purchasers=%d" % num_purchasers,
+            num_purchasers=num_purchasers,
+            engine=SimulationEngine.VECTORIZED
+        )
+
+
+register_distribution_benchmarks()
+for asset in DATA_FILES:
+    register_hot_path_benchmarks(asset)
+    register_scaling_benchmarks(asset)
+
+
+def time_benchmark(
+    setup: Callable[[], Callable[[], Any]],
+    repeat: int,
+    min_time: float
+) -> Dict[str, float]:
+    """Returns the best and median time per call of the benchmark, in
+    seconds. Each of the repeats makes as many calls as needed to take at
+    least min_time.
+    """
+    function = setup()
+    function()  # warm up caches before timing
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    times = [elapsed] + timer.repeat(repeat - 1, number)
+    times = np.array(times) / number
+    return {
+        "best": float(times.min()),
+        "median": float(np.median(times)),
+        "number": number,
+        "repeat": repeat
+    }
+
+
+def run_benchmarks(
+    names: List[str],
+    repeat: int = 5,
+    min_time: float = 0.2,
+    verbose: bool = True
+) -> Dict[str, Any]:
+    results = {}
+    for name in names:
+        results[name] = time_benchmark(BENCHMARKS[name], repeat, min_time)
+        if verbose:
+            print("%-70s %s" % (name, format_time(results[name]["best"])))
+    return {
+        "version": BASELINE_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine()
+        },
+        "results": results
+    }
+
+
+def compare_results(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float
+) -> List[str]:
+    """Prints the ratio of the current to the baseline best time of every
+    benchmark and returns the names of those slower than the baseline by
+    more than the threshold (e.g. 0.25 for 25%).
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        baseline_result = baseline["results"].get(name)
+        if baseline_result is None:
+            print("%-70s %s  (new)" % (name, format_time(result["best"])))
+            continue
+        ratio = result["best"] / baseline_result["best"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("%-70s %s -> %s  %.2fx%s" % (
+            name,
+            format_time(baseline_result["best"]),
+            format_time(result["best"]),
+            ratio,
+            flag
+        ))
+    return regressions
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "%8.3f %-2s" % (seconds / scale, unit)
+    return "%8.3f ns" % (seconds / 1e-9)
+
+
+def select_benchmarks(patterns: List[str]) -> List[str]:
+    if not patterns:
+        return list(BENCHMARKS)
+    return [
+        name for name in BENCHMARKS
+        if any(pattern in name for pattern in patterns)
+    ]
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the option pool simulator hot paths")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="list the benchmarks")
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument(
+        "--output", help="JSON file to write the results to")
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline", help="baseline JSON file")
+    compare_parser.add_argument(
+        "current",
+        nargs="?",
+        help="results JSON file (runs the benchmarks if omitted)"
+    )
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="flag benchmarks slower than the baseline by more than this "
+        "fraction (default: 0.25)"
+    )
+    for subparser in (list_parser, run_parser, compare_parser):
+        subparser.add_argument(
+            "-k",
+            dest="patterns",
+            action="append",
+            default=[],
+            help="only benchmarks whose name contains the pattern "
+            "(repeatable)"
+        )
+    for subparser in (run_parser, compare_parser):
+        subparser.add_argument("--repeat", type=int, default=5)
+        subparser.add_argument("--min-time", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    names = select_benchmarks(args.patterns)
+    if args.command == "list":
+        print("\n".join(names))
+        return 0
+
+    if args.command == "run":
+        results = run_benchmarks(names, args.repeat, args.min_time)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(results, file, indent=2)
+                file.write("\n")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if args.current:
+        with open(args.current) as file:
+            current = json.load(file)
+        current["results"] = {
+            name: result for name, result in current["results"].items()
+            if name in names
+        }
+    else:
+        current = run_benchmarks(
+            [name for name in names if name in baseline["results"]],
+            args.repeat,
+            args.min_time,
+            verbose=False
+        )
+    regressions = compare_results(baseline, current, args.threshold)
+    if regressions:
+        print("\n%d regression(s) beyond %.0f%%:" % (
+            len(regressions), 100 * args.threshold))
+        print("\n".join("  " + name for name in regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Runs simulations headless from a JSON run or sweep config and writes the
+epoch statistics of every replication and their summary statistics, and the
+differences between the purchaser distributions if there are several.
+
+    python cli.py config.json --output-dir results --format parquet
+
+See simulation.batch.parse_batch_config for the config keys.
+"""
+import argparse
+import json
+import sys
+from time import perf_counter
+from typing import List
+
+from simulation.batch import (OUTPUT_FORMATS, compare_distributions,
+                              parse_batch_config, run_batch,
+                              write_batch_results)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Run option pool simulations without the Streamlit app")
+    parser.add_argument("config", help="JSON run or sweep config")
+    parser.add_argument(
+        "--output-dir",
+        default="results",
+        help="directory to write the results to (default: results)"
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="csv",
+        help="format of the epoch and summary tables (default: csv)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="number of worker processes (overrides the config)"
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.config) as file:
+        config = json.load(file)
+    if args.workers is not None:
+        config["workers"] = args.workers
+    batch_config = parse_batch_config(config)
+
+    start = perf_counter()
+    epoch_table, summary, root_seed = run_batch(batch_config)
+    write_batch_results(
+        config,
+        epoch_table,
+        summary,
+        root_seed,
+        args.output_dir,
+        args.format,
+        compare_distributions(batch_config, epoch_table)
+    )
+    if batch_config.target_half_width is not None:
+        runs = summary.drop_duplicates("purchaser_distribution")
+        for row in runs.itertuples():
+            print("%s: %d replications, half width %.2f%s" % (
+                row.purchaser_distribution,
+                row.num_replications,
+                row.stopping_half_width,
+                "" if row.is_converged else " (budget reached)"
+            ))
+    print("Wrote %d epoch rows to %s in %.1f s (root seed %d)" % (
+        len(epoch_table), args.output_dir, perf_counter() - start, root_seed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
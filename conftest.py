@@ -0,0 +1,2 @@
+# Makes pytest put the repository root on sys.path, so tests import the
+# simulation packages the way cli.py and streamlit_app.py do
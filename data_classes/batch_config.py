@@ -0,0 +1,20 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Sequence, Tuple
+
+from data_classes.distribution import PurchaserDistribution
+from data_classes.simulation_config import SimulationConfig
+
+
+@dataclass(frozen=True)
+class BatchConfig:
+    base_config: SimulationConfig
+    purchaser_distributions: Tuple[PurchaserDistribution, ...]
+    seed: int = None  # None draws fresh entropy, recorded in the metadata
+    num_replications: int = 1
+    num_workers: int = 1
+    grid: Dict[str, Sequence[Any]] = field(default_factory=dict)  # sweep
+    # Adaptive runs: replications run in batches of num_replications until
+    # the stopping statistic's confidence half width reaches the target
+    target_half_width: float = None
+    stopping_statistic: str = "total_lp_profit"
+    max_replications: int = 1000
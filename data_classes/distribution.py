@@ -1,7 +1,12 @@
 from enum import Enum, auto
+from functools import lru_cache
+from typing import Tuple
 
 import numpy as np
-from scipy.stats import skewnorm, norm
+
+# Points of the tabulated CDFs that the non-uniform purchaser distributions
+# are inverted from
+INVERSE_CDF_TABLE_SIZE = 2**14 + 1
 
 
 class PurchaserDistribution(Enum):
@@ -18,6 +23,43 @@ class LPDistribution(Enum):
     NORMAL = auto()
 
 
+@lru_cache(maxsize=None)
+def get_frozen_distribution(distribution: PurchaserDistribution):
+    """Return the cached frozen scipy distribution of a non-uniform purchaser
+    distribution, before it is fixed in the range [0, 1]. scipy.stats is
+    imported on first use, as it is slow to import.
+    """
+    from scipy.stats import norm, skewnorm
+
+    if distribution == PurchaserDistribution.NORMAL:
+        return norm(loc=0.5, scale=0.2)
+    elif distribution == PurchaserDistribution.SKEWIN:
+        return skewnorm(3, loc=0.2, scale=0.2)
+    elif distribution == PurchaserDistribution.SKEWOUT:
+        return skewnorm(-3, loc=0.8, scale=0.2)
+    elif distribution == PurchaserDistribution.EXTREMESKEWIN:
+        return skewnorm(9, loc=0.05, scale=0.2)
+    elif distribution == PurchaserDistribution.EXTREMESKEWOUT:
+        return skewnorm(-9, loc=0.95, scale=0.2)
+    raise NotImplementedError
+
+
+@lru_cache(maxsize=None)
+def get_inverse_cdf_table(
+    distribution: PurchaserDistribution
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the cached CDF of a non-uniform purchaser distribution on a
+    uniform grid of [0, 1], and the grid. Interpolating the grid at a
+    probability inverts the CDF to within about 1e-9, while scipy's exact
+    inverse is too slow for skew normal distributions.
+    """
+    values = np.linspace(0, 1, INVERSE_CDF_TABLE_SIZE)
+    cdf = get_frozen_distribution(distribution).cdf(values)
+    cdf.flags.writeable = False
+    values.flags.writeable = False
+    return cdf, values
+
+
 class Distribution:
     def __init__(self, distribution: PurchaserDistribution or LPDistribution) -> None:
         self.distribution = distribution
@@ -44,25 +86,81 @@ class Distribution:
 
     def generate_value(self) -> float:
         """Return a random value in [0, 1] based on the distribution."""
+        return self.generate_values(1)[0]
+
+    def generate_values(
+        self,
+        n: int,
+        rng: np.random.Generator = None
+    ) -> np.ndarray:
+        """Return n random values in [0, 1] based on the distribution. Values
+        are drawn from rng, or from NumPy's global random state if rng is None.
+        """
+        if self.distribution == PurchaserDistribution.UNIFORM:
+            random = np.random if rng is None else rng
+            return self.fix_ranges(random.uniform(low=0, high=1, size=n))
+        return self.fix_ranges(get_frozen_distribution(
+            self.distribution).rvs(size=n, random_state=rng))
+
+    def get_values(self, uniforms: np.ndarray) -> np.ndarray:
+        """Return the values in [0, 1] of the distribution at the given
+        probabilities in [0, 1], through its inverse CDF. Uniform random
+        probabilities give values with the same distribution as
+        generate_values.
+        """
         if self.distribution == PurchaserDistribution.UNIFORM:
-            return self.fix_range(np.random.uniform(low=0, high=1))
-        elif self.distribution == PurchaserDistribution.NORMAL:
-            return self.fix_range(norm(loc=0.5, scale=0.2).rvs())
-        elif self.distribution == PurchaserDistribution.SKEWIN:
-            return self.fix_range(skewnorm(3, loc=0.2, scale=0.2).rvs())
-        elif self.distribution == PurchaserDistribution.SKEWOUT:
-            return self.fix_range(skewnorm(-3, loc=0.8, scale=0.2).rvs())
-        elif self.distribution == PurchaserDistribution.EXTREMESKEWIN:
-            return self.fix_range(skewnorm(9, loc=0.05, scale=0.2).rvs())
-        elif self.distribution == PurchaserDistribution.EXTREMESKEWOUT:
-            return self.fix_range(skewnorm(-9, loc=0.95, scale=0.2).rvs())
+            return self.fix_ranges(uniforms)
+
+        # Probabilities outside the CDF of [0, 1] fall on the range's ends,
+        # as fix_ranges does for generate_values
+        cdf, values = get_inverse_cdf_table(self.distribution)
+        return np.interp(uniforms, cdf, values)
 
     def generate_ranged_value(self, low: float, high: float) -> float:
         """Return a random value in [low, high] based on the distribution."""
+        return self.generate_ranged_values(1, low, high)[0]
+
+    def generate_ranged_values(
+        self,
+        n: int,
+        low: float,
+        high: float,
+        rng: np.random.Generator = None
+    ) -> np.ndarray:
+        """Return n random values in [low, high] based on the distribution.
+        Values are drawn from rng, or from NumPy's global random state if rng
+        is None.
+        """
+        random = np.random if rng is None else rng
+        if self.distribution == LPDistribution.UNIFORM:
+            return random.uniform(low=low, high=high, size=n)
+        elif self.distribution == LPDistribution.NORMAL:
+            return random.normal(
+                loc=(high + low)/2.,
+                scale=(high - low)/4.,
+                size=n
+            )
+        raise NotImplementedError
+
+    def get_ranged_values(
+        self,
+        uniforms: np.ndarray,
+        low: float,
+        high: float
+    ) -> np.ndarray:
+        """Return the values in [low, high] of the distribution at the given
+        probabilities in [0, 1], through its inverse CDF (see
+        generate_ranged_values).
+        """
         if self.distribution == LPDistribution.UNIFORM:
-            return np.random.uniform(low=low, high=high)
+            return low + (high - low) * np.asarray(uniforms, dtype=float)
         elif self.distribution == LPDistribution.NORMAL:
-            return norm(loc=(high + low)/2., scale=(high - low)/4.).rvs()
+            from scipy.special import ndtri
+
+            eps = np.finfo(float).eps
+            return (high + low)/2. + (high - low)/4. * \
+                ndtri(np.clip(uniforms, eps, 1 - eps))
+        raise NotImplementedError
 
     def fix_range(self, value: float) -> float:
         """Return the value fixed in the range [0, 1]."""
@@ -71,3 +169,7 @@ class Distribution:
         elif value > 1:
             return 1
         return value
+
+    def fix_ranges(self, values: np.ndarray) -> np.ndarray:
+        """Return the values fixed in the range [0, 1]."""
+        return np.clip(values, 0, 1)
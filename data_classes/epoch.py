@@ -8,3 +8,9 @@ class Epoch:
     total_value_locked: float  # total value locked in the pool at the end of the epoch
     total_profit: float  # difference between the epoch's deposits and the epoch's withdrawls
     total_lp_profit: float  # difference between the epoch's premiums and exercises
+    # Greeks of the options open at the start of the epoch, held by purchasers
+    book_delta: float = 0.0
+    book_gamma: float = 0.0
+    book_vega: float = 0.0  # per unit of annualized vol
+    book_theta: float = 0.0  # per year
+    net_delta: float = 0.0  # underlying assets locked less book_delta
@@ -0,0 +1,7 @@
+from enum import Enum, auto
+
+
+class EpochLength(Enum):
+    DAILY = auto()
+    WEEKLY = auto()
+    MONTHLY = auto()  # calendar months, from the day of the first epoch
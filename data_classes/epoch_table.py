@@ -0,0 +1,119 @@
+from dataclasses import fields
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterator, List
+
+import numpy as np
+
+from data_classes.epoch import Epoch
+from utils.column import Column
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class EpochView(Epoch):
+    """An epoch of an EpochTable that reads and writes the table's columns,
+    so code written against a list of Epochs keeps working, e.g.
+    table[-1].total_value_locked = x updates the table.
+    """
+
+    def __init__(self, table: 'EpochTable', index: int) -> None:
+        self.table = table
+        self.index = index
+
+    @property
+    def start_date(self) -> str:
+        return str(self.table.start_date[self.index].astype('datetime64[D]'))
+
+    @start_date.setter
+    def start_date(self, value: str or datetime) -> None:
+        self.table.start_date[self.index] = np.datetime64(value, 's')
+
+
+def create_column_property(field: str) -> property:
+    def get_value(view: EpochView) -> float:
+        return getattr(view.table, field)[view.index]
+
+    def set_value(view: EpochView, value: float) -> None:
+        getattr(view.table, field)[view.index] = value
+
+    return property(get_value, set_value)
+
+
+for field in fields(Epoch):
+    if field.name != "start_date":
+        setattr(EpochView, field.name, create_column_property(field.name))
+
+
+class EpochTable:
+    """The statistics of every epoch of an option pool, stored as one
+    growable NumPy column per Epoch field. Indexing and iterating return
+    EpochViews of the rows, so code written against a list of Epochs keeps
+    working for reading and writing. Batch code writes through the columns,
+    e.g. table.total_lp_profit[-1] += x.
+    """
+
+    def __init__(self) -> None:
+        self.start_date = Column(dtype='datetime64[s]')
+        self.end_underlying_price = Column()
+        self.total_value_locked = Column()
+        self.total_profit = Column()
+        self.total_lp_profit = Column()
+        self.book_delta = Column()
+        self.book_gamma = Column()
+        self.book_vega = Column()
+        self.book_theta = Column()
+        self.net_delta = Column()
+
+    def append(self, start_date: datetime, end_underlying_price: float) -> None:
+        """Adds an epoch with zeroed statistics."""
+        self.start_date.append(np.datetime64(start_date, 's'))
+        self.end_underlying_price.append(end_underlying_price)
+        self.total_value_locked.append(0.0)
+        self.total_profit.append(0.0)
+        self.total_lp_profit.append(0.0)
+        self.book_delta.append(0.0)
+        self.book_gamma.append(0.0)
+        self.book_vega.append(0.0)
+        self.book_theta.append(0.0)
+        self.net_delta.append(0.0)
+
+    def extend(self, columns: Dict[str, np.ndarray]) -> None:
+        """Adds the epochs of the columns, keyed by Epoch field name."""
+        for field, values in columns.items():
+            getattr(self, field).extend(values)
+
+    def get_columns(self) -> Dict[str, np.ndarray]:
+        """Returns views of the columns by Epoch field name."""
+        return {
+            "start_date": self.start_date.values,
+            "end_underlying_price": self.end_underlying_price.values,
+            "total_value_locked": self.total_value_locked.values,
+            "total_profit": self.total_profit.values,
+            "total_lp_profit": self.total_lp_profit.values,
+            "book_delta": self.book_delta.values,
+            "book_gamma": self.book_gamma.values,
+            "book_vega": self.book_vega.values,
+            "book_theta": self.book_theta.values,
+            "net_delta": self.net_delta.values
+        }
+
+    def to_frame(self) -> 'pd.DataFrame':
+        import pandas as pd
+        return pd.DataFrame(self.get_columns())
+
+    def __len__(self) -> int:
+        return len(self.start_date)
+
+    def __getitem__(self, key: int or slice) -> EpochView or List[EpochView]:
+        if isinstance(key, slice):
+            return [EpochView(self, i) for i in range(len(self))[key]]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("epoch index out of range")
+        return EpochView(self, key)
+
+    def __iter__(self) -> Iterator[EpochView]:
+        for i in range(len(self)):
+            yield EpochView(self, i)
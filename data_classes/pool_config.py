@@ -0,0 +1,14 @@
+from dataclasses import dataclass
+
+from data_classes.distribution import PurchaserDistribution
+from data_classes.option import OptionType
+from data_classes.underlying_asset import UnderlyingAsset
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    asset: UnderlyingAsset
+    option_type: OptionType
+    purchaser_distribution: PurchaserDistribution
+    num_purchasers: int
+    strike_band: float = 0.5  # permitted strikes are spot +/- band
@@ -0,0 +1,24 @@
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+
+from data_classes.distribution import Distribution
+
+
+@dataclass
+class PoolResult:
+    """The statistics of a simulated option pool that its charts and tables
+    read, without the market data, premium cache and open options the pool
+    holds, so that it is cheap to send between processes.
+    """
+    purchaser_distribution: Distribution
+    epoch_columns: Dict[str, np.ndarray]  # by Epoch field name
+    strike_values: np.ndarray
+
+    @property
+    def num_epochs(self) -> int:
+        return len(self.epoch_columns["start_date"])
+
+    def get_epoch_columns(self) -> Dict[str, np.ndarray]:
+        return self.epoch_columns
@@ -0,0 +1,9 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class PoolSnapshot:
+    total_underlying_asset_unlocked: float
+    total_underlying_asset_locked: float
+    total_usdt: float
+    num_open_options: int
@@ -0,0 +1,25 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from data_classes.simulation_config import SimulationConfig
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@dataclass
+class ReplicationResult:
+    config: SimulationConfig
+    root_seed: int  # entropy of the root SeedSequence, to reproduce the run
+    values: np.ndarray  # replication x epoch x metric
+    summary: 'pd.DataFrame'  # per-epoch statistics of every metric
+    # Confidence half width of the statistic an adaptive run stopped on, and
+    # whether it reached the target before the replication budget
+    half_width: float = None
+    is_converged: bool = None
+
+    @property
+    def num_replications(self) -> int:
+        return self.values.shape[0]
@@ -0,0 +1,8 @@
+from enum import Enum, auto
+
+
+class SamplingMethod(Enum):
+    RANDOM = auto()  # each distribution draws its values from the generator
+    INVERSE_CDF = auto()  # one uniform per value through the inverse CDF
+    ANTITHETIC = auto()  # INVERSE_CDF, with replications in mirrored pairs
+    SOBOL = auto()  # INVERSE_CDF of scrambled Sobol points
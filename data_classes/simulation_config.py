@@ -0,0 +1,32 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Tuple
+
+from data_classes.distribution import LPDistribution, PurchaserDistribution
+from data_classes.epoch_length import EpochLength
+from data_classes.sampling_method import SamplingMethod
+from data_classes.simulation_engine import SimulationEngine
+from data_classes.underlying_asset import UnderlyingAsset
+
+
+@dataclass(frozen=True)
+class SimulationConfig:
+    data_file: str  # path to the market data CSV of the underlying asset
+    num_liquidity_providers: int
+    num_purchasers: int
+    epoch_dates: Tuple[datetime, ...]
+    purchaser_distribution: PurchaserDistribution
+    lp_distribution: LPDistribution
+    asset: UnderlyingAsset
+    engine: SimulationEngine = SimulationEngine.OBJECT
+    strike_band: float = 0.5  # permitted strikes are spot +/- band
+    # Strikes in the grid of the premium surfaces (see PremiumSurface), or
+    # None to price every option exactly
+    premium_grid_size: int = None
+    sampling: SamplingMethod = SamplingMethod.RANDOM
+    # Length of the epochs, which epoch_dates must be created with, and the
+    # tenor of the options
+    epoch_length: EpochLength = EpochLength.WEEKLY
+    # Rows per chunk to stream the data file in, keeping only the rows of
+    # the epoch dates, or None to load the whole file
+    market_data_chunk_size: int = None
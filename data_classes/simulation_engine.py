@@ -0,0 +1,7 @@
+from enum import Enum, auto
+
+
+class SimulationEngine(Enum):
+    OBJECT = auto()  # one Python object per actor
+    VECTORIZED = auto()  # all actors held in NumPy arrays
+    EXPECTED_VALUE = auto()  # expected statistics by quadrature, no actors
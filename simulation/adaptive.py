@@ -0,0 +1,254 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Sequence
+
+import numpy as np
+
+from data_classes.replication_result import ReplicationResult
+from data_classes.sampling_method import SamplingMethod
+from data_classes.simulation_config import SimulationConfig
+from data_classes.simulation_engine import SimulationEngine
+from simulation.replication import (EPOCH_METRICS, SharedPremiumCaches,
+                                    get_independent_samples,
+                                    preload_dependencies, run_replication,
+                                    set_shared_premium_surfaces,
+                                    spawn_replication_seeds, spawn_seeds,
+                                    summarize_replications)
+
+# Statistics of a replication that adaptive runs can stop on: the total value
+# locked in the last epoch, and the liquidity providers' profit summed over
+# all epochs
+STOPPING_STATISTICS = ("final_total_value_locked", "total_lp_profit")
+
+
+def get_stopping_statistic(values: np.ndarray, statistic: str) -> np.ndarray:
+    """Returns the statistic of every replication of replication x epoch x
+    metric values.
+    """
+    if statistic == "final_total_value_locked":
+        return values[:, -1, EPOCH_METRICS.index("total_value_locked")]
+    if statistic == "total_lp_profit":
+        return values[:, :, EPOCH_METRICS.index("total_lp_profit")].sum(axis=1)
+    raise ValueError("Unknown stopping statistic: " + statistic)
+
+
+class RunningStatistics:
+    """Count, mean and sum of squared deviations of a sample that grows a
+    batch at a time. Batches are merged with the pairwise form of Welford's
+    update, which stays accurate for large means without keeping the
+    samples.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, samples: np.ndarray) -> None:
+        count = len(samples)
+        if count == 0:
+            return
+        mean = float(samples.mean())
+        m2 = float(((samples - mean)**2).sum())
+        delta = mean - self.mean
+        total = self.count + count
+        self.mean += delta * count / total
+        self.m2 += m2 + delta**2 * self.count * count / total
+        self.count = total
+
+    @property
+    def variance(self) -> float:
+        if self.count < 2:
+            return np.nan
+        return self.m2 / (self.count - 1)
+
+    def calculate_half_width(self, confidence: float = 0.95) -> float:
+        """Returns the half width of the confidence interval of the mean, or
+        infinity with fewer than 2 samples.
+        """
+        from scipy.stats import t
+
+        if self.count < 2:
+            return np.inf
+        return float(t.ppf((1 + confidence) / 2, self.count - 1) *
+                     np.sqrt(self.variance / self.count))
+
+
+class AdaptiveRun:
+    """The replications of one configuration of an adaptive run so far."""
+
+    def __init__(
+        self,
+        config: SimulationConfig,
+        seed: np.random.SeedSequence
+    ) -> None:
+        self.config = config
+        self.seed = seed
+        # The expected value engine runs once, whatever the sampling method
+        self.is_antithetic = \
+            config.sampling == SamplingMethod.ANTITHETIC and \
+            config.engine != SimulationEngine.EXPECTED_VALUE
+        self.values = []
+        self.statistics = RunningStatistics()
+        self.half_width = np.inf
+        self.is_done = False
+        self.is_converged = False
+
+    @property
+    def num_replications(self) -> int:
+        return sum(len(values) for values in self.values)
+
+
+def submit_batch(
+    executor: ProcessPoolExecutor or None,
+    config: SimulationConfig,
+    seeds: List[np.random.SeedSequence],
+    is_antithetic: List[bool],
+    num_workers: int
+) -> Iterable[np.ndarray]:
+    """Returns the epoch x metric values of a replication per seed, run on
+    the executor if given, as an iterator that yields them as they are
+    collected.
+    """
+    if executor is None:
+        return [
+            run_replication(config, seed, is_mirrored)
+            for seed, is_mirrored in zip(seeds, is_antithetic)
+        ]
+    return executor.map(
+        run_replication,
+        [config] * len(seeds),
+        seeds,
+        is_antithetic,
+        chunksize=max(1, len(seeds) // (2 * num_workers))
+    )
+
+
+def update_run(
+    run: AdaptiveRun,
+    values: np.ndarray,
+    target_half_width: float,
+    statistic: str,
+    max_replications: int,
+    confidence: float
+) -> None:
+    """Adds a batch of replications to the run and checks whether it has
+    reached the target or its budget.
+    """
+    run.values.append(values)
+    if run.config.engine == SimulationEngine.EXPECTED_VALUE:
+        run.half_width = 0.0
+        run.is_done = run.is_converged = True
+        return
+    run.statistics.update(get_independent_samples(
+        get_stopping_statistic(values, statistic), run.is_antithetic))
+    run.half_width = run.statistics.calculate_half_width(confidence)
+    run.is_converged = run.half_width <= target_half_width
+    run.is_done = run.is_converged or \
+        run.num_replications >= max_replications
+
+
+def run_adaptive_replications(
+    configs: Sequence[SimulationConfig],
+    target_half_width: float,
+    statistic: str = "total_lp_profit",
+    seed: int or np.random.SeedSequence = None,
+    num_workers: int = 1,
+    batch_size: int = 8,
+    max_replications: int = 1000,
+    confidence: float = 0.95,
+    quantiles: Sequence[float] = (0.05, 0.5, 0.95)
+) -> List[ReplicationResult]:
+    """Runs replications of every configuration in batches until the
+    confidence interval of the mean of the statistic (one of
+    STOPPING_STATISTICS) has a half width of at most target_half_width, in
+    USDT, or the configuration has run max_replications, and returns each
+    configuration's replications with the number it needed.
+
+    Every round runs a batch of each unfinished configuration across the
+    process pool and folds the batch's statistics into running statistics.
+    Every configuration draws from streams spawned from the same root seed,
+    so the replications of different configurations are paired as in
+    run_replications, and replication i of a configuration is the same as
+    in run_replications with the same seed for any batch size or number of
+    workers. Antithetic pairs count as one sample of the statistic, so the
+    batch size and budget must be even. The expected value engine is
+    deterministic, so its configurations run once.
+    """
+    if target_half_width <= 0:
+        raise ValueError("The target half width must be positive")
+    if statistic not in STOPPING_STATISTICS:
+        raise ValueError("Unknown stopping statistic: " + statistic)
+    if batch_size < 2 or max_replications < 2:
+        raise ValueError("Batches and the budget need at least 2 replications")
+
+    root_seed, _ = spawn_seeds(seed, 0)
+    runs = [
+        AdaptiveRun(config, np.random.SeedSequence(root_seed.entropy))
+        for config in configs
+    ]
+    for run in runs:
+        if run.is_antithetic and (batch_size % 2 or max_replications % 2):
+            raise ValueError(
+                "Antithetic sampling needs an even batch size and budget")
+
+    executor = None
+    shared_premium_caches = None
+    try:
+        if num_workers > 1:
+            preload_dependencies(configs)
+            shared_premium_caches = SharedPremiumCaches(configs)
+            executor = ProcessPoolExecutor(
+                max_workers=num_workers,
+                initializer=set_shared_premium_surfaces,
+                initargs=(shared_premium_caches.handles,)
+            )
+        while not all(run.is_done for run in runs):
+            batches = []
+            for run in runs:
+                if run.is_done:
+                    continue
+                sampling = run.config.sampling
+                if run.config.engine == SimulationEngine.EXPECTED_VALUE:
+                    num_replications, sampling = 1, SamplingMethod.RANDOM
+                else:
+                    num_replications = min(
+                        batch_size, max_replications - run.num_replications)
+                _, seeds, is_antithetic = spawn_replication_seeds(
+                    run.seed, num_replications, sampling)
+                batches.append((run, submit_batch(
+                    executor, run.config, seeds, is_antithetic, num_workers)))
+            for run, values in batches:
+                update_run(
+                    run,
+                    np.stack(list(values)),
+                    target_half_width,
+                    statistic,
+                    max_replications,
+                    confidence
+                )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if shared_premium_caches is not None:
+            shared_premium_caches.close()
+
+    results = []
+    for run in runs:
+        values = np.concatenate(run.values)
+        results.append(ReplicationResult(
+            run.config,
+            root_seed.entropy,
+            values,
+            summarize_replications(
+                values,
+                [str(date.date()) for date in run.config.epoch_dates[:-1]],
+                confidence,
+                quantiles,
+                run.is_antithetic,
+                None if run.config.sampling == SamplingMethod.SOBOL
+                else values
+            ),
+            half_width=run.half_width,
+            is_converged=run.is_converged
+        ))
+    return results
@@ -0,0 +1,227 @@
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from dataclasses import fields
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from data_classes.distribution import Distribution
+from data_classes.epoch import Epoch
+from data_classes.pool_result import PoolResult
+from data_classes.simulation_config import SimulationConfig
+from simulation.instrumentation import Instrumentation
+from simulation.premium_surface import SharedPremiumSurfacesHandle
+from simulation.replication import (SharedPremiumCaches, create_simulation,
+                                    load_market_data, preload_dependencies,
+                                    set_shared_premium_surfaces)
+from utils.shared_market_data import attach_shared_memory
+
+# The statistics of a simulation's option pool, and its instrumentation
+# report if it was instrumented
+SimulationResult = Tuple[PoolResult, Optional[Dict[str, Any]]]
+
+# The dtypes of the epoch columns, all 8 bytes wide, in the order a
+# simulation's columns are stored in the run's shared state
+EPOCH_COLUMN_DTYPES = {
+    field.name: 'datetime64[s]' if field.name == "start_date" else np.float64
+    for field in fields(Epoch)
+}
+
+
+def get_shared_epoch_columns(
+    buffer: memoryview,
+    offset: int,
+    num_epochs: int
+) -> Dict[str, np.ndarray]:
+    """Returns the epoch columns of a simulation stored back to back in the
+    buffer from the offset, by Epoch field name.
+    """
+    return {
+        name: np.ndarray(
+            (num_epochs,),
+            dtype=dtype,
+            buffer=buffer,
+            offset=offset + 8 * num_epochs * i
+        ) for i, (name, dtype) in enumerate(EPOCH_COLUMN_DTYPES.items())
+    }
+
+
+def run_simulation(
+    config: SimulationConfig,
+    seed: int,
+    is_instrumented: bool,
+    state_name: str,
+    num_simulations: int,
+    index: int,
+    epoch_columns_offset: int,
+    premium_surface_handles: Dict[tuple, SharedPremiumSurfacesHandle]
+) -> Optional[SimulationResult]:
+    """Runs simulation index of a BackgroundRun in a worker process, copying
+    each finished epoch's statistics to the run's state before counting it
+    there, and stopping after the current epoch once the run is cancelled.
+    Returns None if the run was cancelled before the simulation started.
+    """
+    try:
+        shared_memory = attach_shared_memory(state_name)
+    except FileNotFoundError:
+        return None
+    state = np.ndarray(
+        (num_simulations + 1,), dtype=np.int64, buffer=shared_memory.buf)
+    shared_epoch_columns = get_shared_epoch_columns(
+        shared_memory.buf, epoch_columns_offset, len(config.epoch_dates) - 1)
+    try:
+        if state[0]:
+            return None
+        set_shared_premium_surfaces(premium_surface_handles)
+        instrumentation = Instrumentation() if is_instrumented else None
+        simulation = create_simulation(
+            config,
+            load_market_data(config),
+            seed,
+            instrumentation
+        )
+        for _ in simulation.iter_epochs():
+            num_epochs_run = state[index + 1]
+            for name, values in \
+                    simulation.option_pool.get_epoch_columns().items():
+                shared_epoch_columns[name][num_epochs_run] = values[-1]
+            state[index + 1] += 1
+            if state[0]:
+                break
+        return (
+            simulation.option_pool.get_result(),
+            instrumentation.get_report() if is_instrumented else None
+        )
+    finally:
+        del state, shared_epoch_columns
+        shared_memory.close()
+
+
+class BackgroundRun:
+    """Simulations of several configurations with the same seed, running
+    concurrently on an executor's worker processes.
+
+    The run and its workers share a shared memory block: a cancellation
+    flag, the number of epochs each simulation has finished and the
+    statistics of those epochs, so the run can be followed, charted and
+    cancelled while the simulations run. The premium surfaces of the
+    configurations are built once by the creating process and shared with
+    the workers as well. The creating process owns the blocks and must close
+    the run once it is done (or cancelled).
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        configs: Sequence[SimulationConfig],
+        seed: int,
+        is_instrumented: bool = False
+    ) -> None:
+        self.configs = tuple(configs)
+        self.num_epochs = np.array([
+            len(config.epoch_dates) - 1 for config in self.configs
+        ], dtype=np.int64)
+        preload_dependencies(self.configs)
+        self.shared_premium_caches = SharedPremiumCaches(self.configs)
+        # Each simulation's epoch columns follow the flag and the counts
+        self.epoch_columns_offsets = 8 * (len(self.configs) + 1) + \
+            8 * len(EPOCH_COLUMN_DTYPES) * np.concatenate(
+                ([0], np.cumsum(self.num_epochs)))
+        try:
+            self.shared_memory = SharedMemory(
+                create=True, size=int(self.epoch_columns_offsets[-1]))
+        except BaseException:
+            self.shared_premium_caches.close()
+            raise
+        self.state = np.ndarray(
+            (len(self.configs) + 1,),
+            dtype=np.int64,
+            buffer=self.shared_memory.buf
+        )
+        self.state[:] = 0
+        self.epoch_columns = [
+            get_shared_epoch_columns(
+                self.shared_memory.buf, int(offset), int(num_epochs))
+            for offset, num_epochs in zip(
+                self.epoch_columns_offsets, self.num_epochs)
+        ]
+        self.futures = [
+            executor.submit(
+                run_simulation,
+                config,
+                seed,
+                is_instrumented,
+                self.shared_memory.name,
+                len(self.configs),
+                i,
+                int(self.epoch_columns_offsets[i]),
+                self.shared_premium_caches.handles
+            ) for i, config in enumerate(self.configs)
+        ]
+
+    @property
+    def epochs_run(self) -> np.ndarray:
+        """Returns the number of epochs each simulation has finished."""
+        return self.state[1:].copy()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return bool(self.state[0])
+
+    def is_done(self) -> bool:
+        return all(future.done() for future in self.futures)
+
+    def wait(self, timeout: float = None) -> None:
+        """Waits until a simulation finishes or the timeout passes."""
+        wait(
+            [future for future in self.futures if not future.done()],
+            timeout,
+            return_when=FIRST_COMPLETED
+        )
+
+    def get_partial_results(self) -> List[PoolResult]:
+        """Returns the statistics of the epochs each simulation has finished
+        so far, in the order of the configurations, without the strike range
+        values, which are only sent back with the results.
+        """
+        return [
+            PoolResult(
+                Distribution(config.purchaser_distribution),
+                {
+                    name: values[:num_epochs_run].copy()
+                    for name, values in epoch_columns.items()
+                },
+                np.empty(0)
+            ) for config, epoch_columns, num_epochs_run in zip(
+                self.configs, self.epoch_columns, self.epochs_run)
+        ]
+
+    def get_results(self) -> List[Optional[SimulationResult]]:
+        """Returns the result of every finished simulation, in the order of
+        the configurations, and None for the others. A cancelled simulation's
+        result has the epochs it finished.
+        """
+        return [
+            future.result()
+            if future.done() and not future.cancelled() else None
+            for future in self.futures
+        ]
+
+    def cancel(self) -> None:
+        """Cancels the simulations that have not started, and stops the
+        running ones after their current epoch.
+        """
+        self.state[0] = 1
+        for future in self.futures:
+            future.cancel()
+
+    def close(self) -> None:
+        """Releases the shared state and premium surfaces, after which the
+        run's progress and partial results can no longer be read. Simulations that are still
+        running keep their mappings of them until they stop, and those that
+        start later build their own surfaces.
+        """
+        del self.state, self.epoch_columns
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+        self.shared_premium_caches.close()
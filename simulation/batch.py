@@ -0,0 +1,364 @@
+import json
+import os
+import platform
+from dataclasses import replace
+from datetime import date, datetime
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_classes.batch_config import BatchConfig
+from data_classes.distribution import LPDistribution, PurchaserDistribution
+from data_classes.epoch_length import EpochLength
+from data_classes.sampling_method import SamplingMethod
+from data_classes.simulation_config import SimulationConfig
+from data_classes.simulation_engine import SimulationEngine
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.adaptive import run_adaptive_replications
+from simulation.replication import (EPOCH_METRICS, run_replications,
+                                    spawn_replication_seeds, spawn_seeds,
+                                    summarize_differences)
+from simulation.simulation import create_epoch_dates
+from simulation.sweep import run_sweep
+from utils.column import write_parquet
+
+OUTPUT_FORMATS = ("csv", "parquet", "json")
+
+# Enum types of the config values given by name
+ENUM_FIELDS = {
+    "purchaser_distribution": PurchaserDistribution,
+    "lp_distribution": LPDistribution,
+    "asset": UnderlyingAsset,
+    "engine": SimulationEngine,
+    "sampling": SamplingMethod,
+    "epoch_length": EpochLength
+}
+
+
+def parse_value(key: str, value: Any) -> Any:
+    if key in ENUM_FIELDS:
+        return ENUM_FIELDS[key][value.upper()]
+    if key in ("start_date", "first_epoch_date"):
+        return date.fromisoformat(value)
+    return value
+
+
+def parse_batch_config(config: Dict[str, Any]) -> BatchConfig:
+    """Returns the batch configuration of a run or sweep config, as read from
+    JSON. Enums are given by name and dates in ISO format, e.g.
+
+        {
+            "data_file": "data/eth.csv",
+            "asset": "ETH",
+            "start_date": "2020-05-01",
+            "num_epochs": 52,
+            "epoch_length": "WEEKLY",
+            "num_liquidity_providers": 10,
+            "num_purchasers": 1000,
+            "purchaser_distributions": ["UNIFORM", "NORMAL"],
+            "lp_distribution": "UNIFORM",
+            "engine": "VECTORIZED",
+            "sampling": "INVERSE_CDF",
+            "seed": 0,
+            "replications": 100,
+            "workers": 4,
+            "sweep": {"num_purchasers": [100, 1000, 10000]}
+        }
+
+    epoch_length (DAILY, WEEKLY or MONTHLY, WEEKLY by default), engine,
+    strike_band, premium_grid_size, sampling, market_data_chunk_size, seed,
+    replications, workers and sweep are optional. Antithetic sampling needs
+    an even number of replications. The expected value engine runs once,
+    whatever the number of replications.
+    The keys of sweep are those of run_sweep's grid.
+
+    With target_half_width (in USDT), replications run in batches of
+    replications until the confidence interval of stopping_statistic
+    ("total_lp_profit" by default, or "final_total_value_locked") is that
+    narrow for every distribution, or max_replications (default 1000) have
+    run; see run_adaptive_replications. Adaptive runs cannot sweep.
+    """
+    config = dict(config)
+    unknown_keys = set(config) - {
+        "data_file",
+        "asset",
+        "start_date",
+        "num_epochs",
+        "epoch_length",
+        "num_liquidity_providers",
+        "num_purchasers",
+        "purchaser_distributions",
+        "lp_distribution",
+        "engine",
+        "strike_band",
+        "premium_grid_size",
+        "sampling",
+        "market_data_chunk_size",
+        "seed",
+        "replications",
+        "workers",
+        "sweep",
+        "target_half_width",
+        "stopping_statistic",
+        "max_replications"
+    }
+    if unknown_keys:
+        raise ValueError("Unknown config keys: " + ", ".join(
+            sorted(unknown_keys)))
+    if "target_half_width" in config and "sweep" in config:
+        raise ValueError("Adaptive runs cannot sweep")
+
+    purchaser_distributions = tuple(
+        parse_value("purchaser_distribution", distribution)
+        for distribution in config.pop("purchaser_distributions")
+    )
+    epoch_length = parse_value(
+        "epoch_length", config.get("epoch_length", "WEEKLY"))
+    base_config = SimulationConfig(
+        config["data_file"],
+        config["num_liquidity_providers"],
+        config["num_purchasers"],
+        tuple(create_epoch_dates(
+            parse_value("start_date", config["start_date"]),
+            config["num_epochs"],
+            epoch_length
+        )),
+        purchaser_distributions[0],
+        parse_value("lp_distribution", config["lp_distribution"]),
+        parse_value("asset", config["asset"]),
+        **{
+            key: parse_value(key, config[key])
+            for key in (
+                "engine",
+                "strike_band",
+                "premium_grid_size",
+                "sampling",
+                "market_data_chunk_size"
+            )
+            if key in config
+        },
+        epoch_length=epoch_length
+    )
+    return BatchConfig(
+        base_config,
+        purchaser_distributions,
+        seed=config.get("seed"),
+        num_replications=config.get("replications", 1),
+        num_workers=config.get("workers", 1),
+        grid={
+            key: [parse_value(key, value) for value in values]
+            for key, values in config.get("sweep", {}).items()
+        },
+        **{
+            key: config[key]
+            for key in (
+                "target_half_width", "stopping_statistic", "max_replications")
+            if key in config
+        }
+    )
+
+
+def run_batch(
+    batch_config: BatchConfig
+) -> Tuple[pd.DataFrame, pd.DataFrame, int]:
+    """Runs the replications of the batch (of every cell of its sweep, if it
+    has one) and returns the epoch statistics of every replication, their
+    summary statistics and the entropy of the root seed.
+    """
+    if batch_config.grid:
+        return run_batch_sweep(batch_config)
+
+    root_seed, _ = spawn_seeds(batch_config.seed, 0)
+    configs = [
+        replace(
+            batch_config.base_config,
+            purchaser_distribution=purchaser_distribution
+        )
+        for purchaser_distribution in batch_config.purchaser_distributions
+    ]
+    # Every distribution uses the same streams, as in the app
+    if batch_config.target_half_width is not None:
+        results = run_adaptive_replications(
+            configs,
+            batch_config.target_half_width,
+            batch_config.stopping_statistic,
+            seed=root_seed,
+            num_workers=batch_config.num_workers,
+            batch_size=batch_config.num_replications,
+            max_replications=batch_config.max_replications
+        )
+    else:
+        results = [
+            run_replications(
+                config,
+                batch_config.num_replications,
+                seed=np.random.SeedSequence(root_seed.entropy),
+                num_workers=batch_config.num_workers
+            )
+            for config in configs
+        ]
+
+    epoch_tables = []
+    summaries = []
+    for config, result in zip(configs, results):
+        purchaser_distribution = config.purchaser_distribution
+        num_replications, num_epochs, _ = result.values.shape
+        epoch_table = pd.DataFrame(
+            result.values.reshape(-1, len(EPOCH_METRICS)),
+            columns=EPOCH_METRICS
+        )
+        epoch_table.insert(0, "start_date", np.tile([
+            str(date.date()) for date in config.epoch_dates[:num_epochs]
+        ], num_replications))
+        epoch_table.insert(
+            0, "replication", np.repeat(np.arange(num_replications), num_epochs))
+        epoch_table.insert(
+            0, "purchaser_distribution", purchaser_distribution.name)
+        epoch_tables.append(epoch_table)
+
+        summary = result.summary
+        summary.insert(0, "purchaser_distribution", purchaser_distribution.name)
+        if result.is_converged is not None:
+            summary["num_replications"] = num_replications
+            summary["stopping_half_width"] = result.half_width
+            summary["is_converged"] = result.is_converged
+        summaries.append(summary)
+    return (
+        pd.concat(epoch_tables, ignore_index=True),
+        pd.concat(summaries, ignore_index=True),
+        root_seed.entropy
+    )
+
+
+def run_batch_sweep(
+    batch_config: BatchConfig
+) -> Tuple[pd.DataFrame, pd.DataFrame, int]:
+    grid = dict(batch_config.grid)
+    if "purchaser_distribution" not in grid:
+        grid["purchaser_distribution"] = batch_config.purchaser_distributions
+
+    # Replication i runs the whole sweep on the i-th spawned stream, or on
+    # that of its antithetic pair. The cells of every replication share one
+    # process pool and one copy of the market data.
+    root_seed, seeds, is_antithetic = spawn_replication_seeds(
+        batch_config.seed,
+        batch_config.num_replications,
+        batch_config.base_config.sampling
+    )
+    epoch_table = run_sweep(
+        batch_config.base_config,
+        grid,
+        num_workers=batch_config.num_workers,
+        replications=list(zip(seeds, is_antithetic))
+    )
+
+    keys = [
+        column for column in epoch_table.columns
+        if column not in EPOCH_METRICS and column != "replication"
+    ]
+    summary = epoch_table.groupby(keys, sort=False)[list(EPOCH_METRICS)].agg(
+        ["mean", "std"])
+    summary.columns = [
+        metric + "_" + statistic for metric, statistic in summary.columns
+    ]
+    return epoch_table, summary.reset_index(), root_seed.entropy
+
+
+def compare_distributions(
+    batch_config: BatchConfig,
+    epoch_table: pd.DataFrame
+) -> pd.DataFrame or None:
+    """Returns the per-epoch mean difference of every metric between each
+    purchaser distribution of a batch without a sweep and the first one, and
+    its variance reduction from the distributions sharing their streams (see
+    summarize_differences), or None if the batch has a sweep or a single
+    distribution. Adaptive runs are compared over the replications that
+    both distributions ran.
+    """
+    distributions = batch_config.purchaser_distributions
+    if batch_config.grid or len(distributions) < 2:
+        return None
+
+    num_epochs = len(batch_config.base_config.epoch_dates) - 1
+    start_dates = list(epoch_table["start_date"].iloc[:num_epochs])
+    values = {
+        distribution: epoch_table.loc[
+            epoch_table["purchaser_distribution"] == distribution.name,
+            list(EPOCH_METRICS)
+        ].to_numpy().reshape(-1, num_epochs, len(EPOCH_METRICS))
+        for distribution in distributions
+    }
+    comparisons = []
+    for distribution in distributions[1:]:
+        num_replications = min(
+            len(values[distribution]), len(values[distributions[0]]))
+        comparison = summarize_differences(
+            values[distribution][:num_replications],
+            values[distributions[0]][:num_replications],
+            start_dates,
+            is_antithetic=batch_config.base_config.sampling ==
+            SamplingMethod.ANTITHETIC
+        )
+        comparison.insert(0, "baseline_distribution", distributions[0].name)
+        comparison.insert(0, "purchaser_distribution", distribution.name)
+        comparisons.append(comparison)
+    return pd.concat(comparisons, ignore_index=True)
+
+
+def write_table(table: pd.DataFrame, file_name: str, output_format: str) -> None:
+    if output_format == "csv":
+        table.to_csv(file_name, index=False)
+    elif output_format == "parquet":
+        write_parquet({
+            column: table[column].to_numpy() for column in table.columns
+        }, file_name)
+    elif output_format == "json":
+        table.to_json(file_name, orient="records", indent=2)
+    else:
+        raise ValueError("Unknown output format: " + output_format)
+
+
+def write_batch_results(
+    config: Dict[str, Any],
+    epoch_table: pd.DataFrame,
+    summary: pd.DataFrame,
+    root_seed: int,
+    output_dir: str,
+    output_format: str,
+    comparison: pd.DataFrame = None
+) -> None:
+    """Writes the epoch table and summary (and comparison, if given) in the
+    output format, and the config with the root seed and environment to
+    metadata.json, so the batch can be reproduced and compared against later
+    runs.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    write_table(
+        epoch_table,
+        os.path.join(output_dir, "epochs." + output_format),
+        output_format
+    )
+    write_table(
+        summary,
+        os.path.join(output_dir, "summary." + output_format),
+        output_format
+    )
+    if comparison is not None:
+        write_table(
+            comparison,
+            os.path.join(output_dir, "comparison." + output_format),
+            output_format
+        )
+    with open(os.path.join(output_dir, "metadata.json"), "w") as file:
+        json.dump({
+            "config": config,
+            "root_seed": root_seed,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "environment": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__
+            }
+        }, file, indent=2)
+        file.write("\n")
@@ -0,0 +1,216 @@
+import json
+from datetime import datetime
+from typing import BinaryIO, Dict
+
+import numpy as np
+
+from data_classes.distribution import (Distribution, LPDistribution,
+                                       PurchaserDistribution)
+from data_classes.epoch_length import EpochLength
+from data_classes.option import Option, OptionType
+from data_classes.sampling_method import SamplingMethod
+from data_classes.simulation_engine import SimulationEngine
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.option_pool import EPOCH_TENORS
+from simulation.premium_surface import PremiumSurfaceCache
+from simulation.simulation import Simulation
+from utils.csv_processor import CSVProcessor
+
+CHECKPOINT_VERSION = 5
+
+
+def get_actor_arrays(simulation: Simulation) -> Dict[str, np.ndarray]:
+    """Returns the per-actor state of the simulation as arrays, for either
+    engine.
+    """
+    if simulation.engine == SimulationEngine.VECTORIZED:
+        vectorized_actors = simulation.vectorized_actors
+        return {
+            "lp_num_underlying_in_pool":
+                vectorized_actors.lp_num_underlying_in_pool,
+            "lp_profit": vectorized_actors.lp_profit,
+            "lp_num_underlying_deposited":
+                vectorized_actors.lp_num_underlying_deposited,
+            "lp_num_underlying_withdrawn":
+                vectorized_actors.lp_num_underlying_withdrawn,
+            "purchaser_profit": vectorized_actors.purchaser_profit
+        }
+
+    liquidity_providers = simulation.actors[
+        :simulation.num_liquidity_providers]
+    purchasers = simulation.actors[simulation.num_liquidity_providers:]
+    return {
+        "lp_num_underlying_in_pool": np.array([
+            lp.num_underlying_in_pool for lp in liquidity_providers
+        ], dtype=float),
+        "lp_profit": np.array([
+            lp.profit for lp in liquidity_providers
+        ], dtype=float),
+        "lp_num_underlying_deposited": np.array([
+            lp.num_underlying_deposited for lp in liquidity_providers
+        ], dtype=float),
+        "lp_num_underlying_withdrawn": np.array([
+            lp.num_underlying_withdrawn for lp in liquidity_providers
+        ], dtype=float),
+        "purchaser_profit": np.array([
+            purchaser.profit for purchaser in purchasers
+        ], dtype=float)
+    }
+
+
+def set_actor_arrays(
+    simulation: Simulation,
+    arrays: Dict[str, np.ndarray]
+) -> None:
+    if simulation.engine == SimulationEngine.VECTORIZED:
+        for name, values in arrays.items():
+            setattr(simulation.vectorized_actors, name, values.copy())
+        return
+
+    liquidity_providers = simulation.actors[
+        :simulation.num_liquidity_providers]
+    purchasers = simulation.actors[simulation.num_liquidity_providers:]
+    for i, lp in enumerate(liquidity_providers):
+        lp.num_underlying_in_pool = arrays["lp_num_underlying_in_pool"][i]
+        lp.profit = arrays["lp_profit"][i]
+        lp.num_underlying_deposited = arrays["lp_num_underlying_deposited"][i]
+        lp.num_underlying_withdrawn = arrays["lp_num_underlying_withdrawn"][i]
+    for i, purchaser in enumerate(purchasers):
+        purchaser.profit = arrays["purchaser_profit"][i]
+
+
+def save_checkpoint(simulation: Simulation, file: str or BinaryIO) -> None:
+    """Saves the complete state of the simulation (option pool balances,
+    open options, per-actor state, random number generator state and
+    statistics) to a compressed binary checkpoint.
+    """
+    option_pool = simulation.option_pool
+    metadata = {
+        "version": CHECKPOINT_VERSION,
+        "num_liquidity_providers": simulation.num_liquidity_providers,
+        "num_purchasers": simulation.num_purchasers,
+        "epoch_dates": [date.isoformat() for date in simulation.epoch_dates],
+        "purchaser_distribution":
+            simulation.purchaser_distribution.distribution.name,
+        "lp_distribution": simulation.lp_distribution.distribution.name,
+        "asset": simulation.asset.name,
+        "engine": simulation.engine.name,
+        "sampling": simulation.sampler.method.name,
+        "is_antithetic": simulation.sampler.is_antithetic,
+        "epoch_length": simulation.epoch_length.name,
+        "strike_band": option_pool.strike_band,
+        "premium_grid_size": option_pool.premium_cache.grid_size
+        if option_pool.premium_cache is not None else None,
+        "num_epochs_run": simulation.num_epochs_run,
+        "rng_state": simulation.rng.bit_generator.state
+    }
+    arrays = {
+        "pool_balances": np.array([
+            option_pool.total_underlying_asset_unlocked,
+            option_pool.total_underlying_asset_locked,
+            option_pool.total_usdt
+        ], dtype=float),
+        "option_purchaser_ids": np.array(
+            list(option_pool.options.keys()), dtype=np.int64),
+        "option_types": np.array([
+            option.type.value for option in option_pool.options.values()
+        ], dtype=np.int64),
+        "option_strikes": np.array([
+            option.strike for option in option_pool.options.values()
+        ], dtype=float),
+        "option_premiums": np.array([
+            option.premium for option in option_pool.options.values()
+        ], dtype=float),
+        "option_book_purchaser_ids": option_pool.option_book_purchaser_ids,
+        "option_book_strikes": option_pool.option_book_strikes,
+        "option_book_premiums": option_pool.option_book_premiums,
+        "strike_values": option_pool.strike_value_column.values,
+        "strikes": option_pool.strike_column.values,
+        "premiums": option_pool.premium_column.values
+    }
+    for field, values in option_pool.get_epoch_columns().items():
+        arrays["epoch_" + field] = values
+    arrays.update(get_actor_arrays(simulation))
+
+    np.savez_compressed(
+        file,
+        metadata=np.array(json.dumps(metadata)),
+        **arrays
+    )
+
+
+def load_checkpoint(
+    file: str or BinaryIO,
+    csv_processor: CSVProcessor
+) -> Simulation:
+    """Returns the simulation saved in the checkpoint. Running it (after
+    extending its epoch dates, if needed) gives exactly the results of an
+    uninterrupted run.
+    """
+    with np.load(file) as checkpoint:
+        arrays = {name: checkpoint[name] for name in checkpoint.files}
+    metadata = json.loads(str(arrays.pop("metadata")))
+    if metadata["version"] != CHECKPOINT_VERSION:
+        raise ValueError(
+            "Unsupported checkpoint version: %s" % metadata["version"])
+
+    # Premiums interpolated from a strike grid must come from the same grid
+    epoch_length = EpochLength[metadata["epoch_length"]]
+    premium_cache = None
+    if metadata["premium_grid_size"] is not None:
+        premium_cache = PremiumSurfaceCache(
+            csv_processor,
+            metadata["strike_band"],
+            metadata["premium_grid_size"],
+            tenor=EPOCH_TENORS[epoch_length]
+        )
+
+    simulation = Simulation(
+        csv_processor,
+        metadata["num_liquidity_providers"],
+        metadata["num_purchasers"],
+        [datetime.fromisoformat(date) for date in metadata["epoch_dates"]],
+        Distribution(PurchaserDistribution[
+            metadata["purchaser_distribution"]]),
+        Distribution(LPDistribution[metadata["lp_distribution"]]),
+        UnderlyingAsset[metadata["asset"]],
+        engine=SimulationEngine[metadata["engine"]],
+        strike_band=metadata["strike_band"],
+        premium_cache=premium_cache,
+        sampling=SamplingMethod[metadata["sampling"]],
+        is_antithetic=metadata["is_antithetic"],
+        epoch_length=epoch_length
+    )
+    simulation.num_epochs_run = metadata["num_epochs_run"]
+    simulation.rng.bit_generator.state = metadata["rng_state"]
+
+    option_pool = simulation.option_pool
+    (
+        option_pool.total_underlying_asset_unlocked,
+        option_pool.total_underlying_asset_locked,
+        option_pool.total_usdt
+    ) = arrays["pool_balances"]
+    option_pool.options = {
+        purchaser_id: Option(OptionType(option_type), strike, premium)
+        for purchaser_id, option_type, strike, premium in zip(
+            arrays["option_purchaser_ids"].tolist(),
+            arrays["option_types"].tolist(),
+            arrays["option_strikes"],
+            arrays["option_premiums"]
+        )
+    }
+    option_pool.option_book_purchaser_ids = \
+        arrays["option_book_purchaser_ids"]
+    option_pool.option_book_strikes = arrays["option_book_strikes"]
+    option_pool.option_book_premiums = arrays["option_book_premiums"]
+    option_pool.strike_value_column.extend(arrays["strike_values"])
+    option_pool.strike_column.extend(arrays["strikes"])
+    option_pool.premium_column.extend(arrays["premiums"])
+    option_pool.epochs.extend({
+        field[len("epoch_"):]: values for field, values in arrays.items()
+        if field.startswith("epoch_")
+    })
+    set_actor_arrays(simulation, {
+        name: arrays[name] for name in get_actor_arrays(simulation)
+    })
+    return simulation
@@ -0,0 +1,325 @@
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from data_classes.distribution import (Distribution, LPDistribution,
+                                       PurchaserDistribution,
+                                       get_frozen_distribution)
+from data_classes.epoch import Epoch
+from data_classes.epoch_length import EpochLength
+from data_classes.pool_snapshot import PoolSnapshot
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.liquidity_provider import DEPOSIT_RANGE, WITHDRAW_RANGE
+from simulation.option_pool import (EPOCH_TENORS, GREEKS, OptionPool,
+                                    calculate_black_scholes_greeks,
+                                    calculate_black_scholes_premiums)
+from utils.csv_processor import CSVProcessor
+
+# Nodes of the Gauss quadrature rules over the strike range values and the
+# liquidity providers' withdraw values
+NUM_QUADRATURE_NODES = 128
+
+
+@lru_cache(maxsize=None)
+def get_gauss_legendre_rule(num_nodes: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the cached nodes and weights of the Gauss-Legendre rule on
+    [0, 1].
+    """
+    nodes, weights = np.polynomial.legendre.leggauss(num_nodes)
+    nodes, weights = (nodes + 1) / 2, weights / 2
+    nodes.flags.writeable = False
+    weights.flags.writeable = False
+    return nodes, weights
+
+
+@lru_cache(maxsize=None)
+def get_strike_value_atoms(
+    distribution: PurchaserDistribution
+) -> Tuple[float, float]:
+    """Returns the probabilities of the strike range values 0 and 1, i.e.
+    of the distribution falling below 0 or above 1 before it is fixed in the
+    range [0, 1].
+    """
+    if distribution == PurchaserDistribution.UNIFORM:
+        return 0.0, 0.0
+    frozen_distribution = get_frozen_distribution(distribution)
+    return float(frozen_distribution.cdf(0)), float(frozen_distribution.sf(1))
+
+
+def get_strike_value_quadrature(
+    distribution: Distribution,
+    upper: float = 1.0,
+    num_nodes: int = NUM_QUADRATURE_NODES
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns nodes and weights such that sum(weights * g(nodes)) is the
+    expectation of g(V) over the strike range values V <= upper that the
+    purchaser distribution generates. V is the distribution fixed in the
+    range [0, 1], so it has atoms at 0 and 1 with the probability of the
+    distribution falling outside the range; the density in between is
+    integrated with Gauss-Legendre quadrature.
+    """
+    if upper < 0:
+        return np.empty(0), np.empty(0)
+    upper = min(upper, 1.0)
+    nodes, weights = get_gauss_legendre_rule(num_nodes)
+    nodes = upper * nodes
+    weights = upper * weights
+    if distribution.distribution != PurchaserDistribution.UNIFORM:
+        weights = weights * get_frozen_distribution(
+            distribution.distribution).pdf(nodes)
+
+    lowest_atom, highest_atom = get_strike_value_atoms(
+        distribution.distribution)
+    return (
+        np.concatenate(([0.0], nodes, [1.0])),
+        np.concatenate((
+            [lowest_atom],
+            weights,
+            [highest_atom if upper == 1.0 else 0.0]
+        ))
+    )
+
+
+def get_ranged_value_quadrature(
+    distribution: Distribution,
+    low: float,
+    high: float,
+    num_nodes: int = NUM_QUADRATURE_NODES
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns nodes and weights of the values in [low, high] that the
+    liquidity provider distribution generates (see
+    Distribution.generate_ranged_values).
+    """
+    if distribution.distribution == LPDistribution.UNIFORM:
+        nodes, weights = get_gauss_legendre_rule(num_nodes)
+        return low + (high - low) * nodes, weights
+    elif distribution.distribution == LPDistribution.NORMAL:
+        nodes, weights = np.polynomial.hermite_e.hermegauss(num_nodes)
+        return (high + low)/2. + (high - low)/4. * nodes, \
+            weights / np.sqrt(2*np.pi)
+    raise NotImplementedError
+
+
+def get_ranged_value_moments(
+    distribution: Distribution,
+    low: float,
+    high: float
+) -> Tuple[float, float]:
+    """Returns the mean and variance of the values in [low, high] that the
+    liquidity provider distribution generates.
+    """
+    if distribution.distribution == LPDistribution.UNIFORM:
+        return (high + low)/2., (high - low)**2/12.
+    elif distribution.distribution == LPDistribution.NORMAL:
+        return (high + low)/2., ((high - low)/4.)**2
+    raise NotImplementedError
+
+
+def calculate_expected_minimum(
+    n: float,
+    mean: float,
+    variance: float
+) -> float:
+    """Returns E[min(n, X)] for X normally distributed with the mean and
+    variance.
+    """
+    from scipy.special import ndtr as N
+
+    if variance <= 0:
+        return min(n, mean)
+    std = np.sqrt(variance)
+    z = (n - mean) / std
+    density = np.exp(-z**2/2) / np.sqrt(2*np.pi)
+    return n - ((n - mean) * N(z) + std * density)
+
+
+class ExpectedValueSimulation:
+    """Computes the expected statistics of every epoch of a Simulation with
+    the same parameters, by numerical integration instead of sampling actors,
+    and records them in an option pool's epochs like Simulation does.
+
+    Purchasers' strike range values are independent of the order of the
+    actors, so the expected premiums, exercises and Greeks of the filled
+    options are the expected number of fills times expectations over the
+    purchaser distribution, computed by Gauss quadrature over its density
+    (split at the strike that the end price makes at the money, where the
+    exercise payoff has a kink).
+
+    The rest of the pool is propagated through its expected state, which
+    makes the following approximations:
+
+    - Fills. A purchase fills while the unlocked underlying assets are > 0
+      and locks 1, so with C = unlocked + the epoch's deposits, the number
+      of fills F of a pool that runs out is in [C - D, C + 1), where D is
+      the deposits made after the last rejected purchase. F is approximated
+      by min(N, C + 1/2), and its expectation over the deposits by their
+      normal approximation. The error is below 1 option per epoch when
+      purchasers arrive between deposits (num_purchasers much greater than
+      num_liquidity_providers), and at most the deposits of the liquidity
+      providers that come after every purchaser otherwise.
+    - Pool state. The unlocked underlying assets carried to the next epoch
+      are replaced by their expectation, which ignores their variance when
+      taking the minimum above. This only matters in epochs where the
+      expected capacity is within about one standard deviation of the
+      deposits (sqrt(num_liquidity_providers) * the deposits' std) of
+      num_purchasers.
+    - Withdrawals. Liquidity providers attempt to withdraw with the
+      probability that their withdraw value is >= the underlying assets
+      they hold in the pool (approximated as normal), and the pool pays the
+      attempts until its unlocked underlying assets run out. The greedy
+      order leaves less than one withdraw value (< 2 of the underlying
+      asset) unpaid per epoch.
+
+    The quadrature itself is exact to within about 1e-10 relative error.
+    """
+
+    def __init__(
+        self,
+        csv_processor: CSVProcessor,
+        num_liquidity_providers: int,
+        num_purchasers: int,
+        epoch_dates: List[datetime],
+        purchaser_distribution: Distribution,
+        lp_distribution: Distribution,
+        asset: UnderlyingAsset,
+        strike_band: float = 0.5,
+        epoch_length: EpochLength = EpochLength.WEEKLY
+    ) -> None:
+        self.csv_processor = csv_processor
+        self.num_liquidity_providers = num_liquidity_providers
+        self.num_purchasers = num_purchasers
+        self.epoch_dates = epoch_dates
+        self.purchaser_distribution = purchaser_distribution
+        self.lp_distribution = lp_distribution
+        self.asset = asset
+        self.epoch_length = epoch_length
+        self.option_pool = OptionPool(
+            csv_processor,
+            purchaser_distribution,
+            strike_band,
+            tenor=EPOCH_TENORS[epoch_length]
+        )
+        self.num_epochs_run = 0
+
+        self.strike_values, self.strike_value_weights = \
+            get_strike_value_quadrature(purchaser_distribution)
+        self.withdraw_values, self.withdraw_value_weights = \
+            get_ranged_value_quadrature(lp_distribution, *WITHDRAW_RANGE)
+        self.deposit_mean, self.deposit_variance = \
+            get_ranged_value_moments(lp_distribution, *DEPOSIT_RANGE)
+
+        # Expected underlying assets each liquidity provider holds in the
+        # pool, and their variance
+        self.lp_num_underlying_in_pool = 0.0
+        self.lp_num_underlying_in_pool_variance = 0.0
+
+    def run(self) -> OptionPool:
+        for _ in self.iter_epochs():
+            pass
+        return self.option_pool
+
+    def iter_epochs(self) -> Iterator[Tuple[Epoch, PoolSnapshot]]:
+        """Computes the remaining epochs one at a time, yielding each epoch's
+        expected statistics and the pool's expected balances.
+        """
+        while self.num_epochs_run < len(self.epoch_dates) - 1:
+            self.run_epoch(
+                self.epoch_dates[self.num_epochs_run],
+                self.epoch_dates[self.num_epochs_run + 1]
+            )
+            self.num_epochs_run += 1
+            yield self.option_pool.epochs[-1], self.option_pool.get_snapshot()
+
+    def run_epoch(self, start_date: datetime, end_date: datetime) -> None:
+        option_pool = self.option_pool
+        epochs = option_pool.epochs
+        option_pool.initialize_epoch_statistics(start_date)
+
+        # Deposits and fills
+        num_deposited = self.num_liquidity_providers * self.deposit_mean
+        capacity = option_pool.total_underlying_asset_unlocked + \
+            num_deposited
+        num_filled = max(calculate_expected_minimum(
+            self.num_purchasers,
+            capacity + 0.5,
+            self.num_liquidity_providers * self.deposit_variance
+        ), 0.0)
+        self.lp_num_underlying_in_pool += self.deposit_mean
+        self.lp_num_underlying_in_pool_variance += self.deposit_variance
+
+        # Premiums and Greeks of the filled options
+        S = self.csv_processor.get_underlying_price(start_date)
+        T = option_pool.tenor
+        r = self.csv_processor.get_r(start_date)
+        sigma = self.csv_processor.get_vol(start_date)
+        strikes = option_pool.calculate_strike_prices(
+            self.strike_values, start_date)
+        premium = self.strike_value_weights @ \
+            calculate_black_scholes_premiums(S, strikes, T, r, sigma)
+        greeks = calculate_black_scholes_greeks(S, strikes, T, r, sigma)
+
+        option_pool.total_underlying_asset_unlocked = capacity - num_filled
+        option_pool.total_underlying_asset_locked = num_filled
+        option_pool.total_usdt = num_filled * premium
+        epochs.total_lp_profit[-1] = num_filled * premium
+        for greek in GREEKS:
+            getattr(epochs, "book_" + greek)[-1] = \
+                num_filled * (self.strike_value_weights @ greeks[greek])
+        epochs.net_delta[-1] = num_filled - epochs.book_delta[-1]
+
+        # Exercises: options whose strike is <= the end price
+        end_price = self.csv_processor.get_underlying_price(end_date)
+        lowest = option_pool.calculate_lowest_strike(start_date)
+        highest = option_pool.calculate_highest_strike(start_date)
+        values, weights = get_strike_value_quadrature(
+            self.purchaser_distribution,
+            (end_price - lowest) / (highest - lowest)
+        )
+        strikes = lowest + (highest - lowest) * values
+        num_exercised = num_filled * weights.sum()
+        exercised_strikes = num_filled * (weights @ strikes)
+        option_pool.total_usdt += exercised_strikes
+        option_pool.total_underlying_asset_locked -= num_exercised
+        epochs.total_lp_profit[-1] += exercised_strikes - \
+            end_price * num_exercised
+
+        self.withdraw(end_date)
+        option_pool.unlock_underlying_assets()
+        option_pool.convert_usdt_to_underlying_asset(end_date)
+        option_pool.calculate_epoch_statistics()
+
+    def withdraw(self, date: datetime) -> None:
+        """Liquidity providers attempt to withdraw if their withdraw value is
+        >= the underlying assets they hold in the pool, and the pool pays the
+        attempts while it has enough unlocked underlying assets.
+        """
+        from scipy.special import ndtr as N
+
+        option_pool = self.option_pool
+        std = np.sqrt(self.lp_num_underlying_in_pool_variance)
+        attempt_probabilities = N(
+            (self.withdraw_values - self.lp_num_underlying_in_pool) / std)
+        attempt_probability = self.withdraw_value_weights @ \
+            attempt_probabilities
+        if attempt_probability <= 0:
+            return
+
+        attempted = self.num_liquidity_providers * \
+            (self.withdraw_value_weights @
+             (self.withdraw_values * attempt_probabilities))
+        if attempted <= 0:
+            return
+        withdrawn = min(
+            attempted,
+            max(option_pool.total_underlying_asset_unlocked, 0.0)
+        )
+        success_probability = attempt_probability * withdrawn / attempted
+        option_pool.total_underlying_asset_unlocked -= withdrawn
+
+        # Each successful withdrawal reduces the liquidity provider's
+        # underlying assets in the pool by 1
+        self.lp_num_underlying_in_pool -= success_probability
+        self.lp_num_underlying_in_pool_variance += \
+            success_probability * (1 - success_probability)
@@ -0,0 +1,277 @@
+import json
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, ContextManager, Dict, List, Tuple
+
+import numpy as np
+
+from data_classes.distribution import Distribution
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.option_pool import EPOCH_TENOR, OptionPool
+from utils.csv_processor import CSVProcessor
+
+if TYPE_CHECKING:
+    from simulation.premium_surface import PremiumSurfaceCache
+
+# Phases of an epoch, in the order they run. premium_pricing and exercise run
+# inside start_epoch and end_epoch respectively.
+PHASES = (
+    "statistics",
+    "sampling",
+    "start_epoch",
+    "premium_pricing",
+    "risk",
+    "end_epoch",
+    "exercise",
+    "unlock_underlying_assets",
+    "convert_usdt_to_underlying_asset"
+)
+COUNTERS = (
+    "purchases_attempted",
+    "purchases_filled",
+    "purchases_rejected",
+    "exercises",
+    "lp_withdraw_attempts",
+    "lp_withdraw_failures",
+    "market_data_lookups",
+    "premium_cache_hits",
+    "premium_cache_misses"
+)
+
+
+class Instrumentation:
+    """Per-phase timers and counters of a simulation, collected per epoch.
+
+    A simulation only collects them if it is given an Instrumentation; without
+    one, it runs the plain option pool and market data with no timing or
+    counting at all.
+    """
+
+    def __init__(self) -> None:
+        self.epochs = []
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.epoch_start_time = None
+
+    def start_epoch(self) -> None:
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.epoch_start_time = perf_counter()
+
+    def end_epoch(self, start_date: datetime) -> None:
+        self.counters["purchases_rejected"] = \
+            self.counters["purchases_attempted"] - \
+            self.counters["purchases_filled"]
+        self.epochs.append({
+            "start_date": start_date.isoformat(),
+            "total_time": perf_counter() - self.epoch_start_time,
+            "timers": {phase: self.timers[phase] for phase in PHASES},
+            "counters": {
+                counter: self.counters[counter] for counter in COUNTERS
+            }
+        })
+
+    @contextmanager
+    def phase(self, name: str) -> ContextManager[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += perf_counter() - start
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.timers[name] += seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += int(n)
+
+    def get_report(self) -> Dict[str, Any]:
+        """Returns the timers and counters of every epoch and their totals
+        over the run.
+        """
+        return {
+            "epochs": self.epochs,
+            "run": {
+                "num_epochs": len(self.epochs),
+                "total_time": sum(
+                    epoch["total_time"] for epoch in self.epochs),
+                "timers": {
+                    phase: sum(epoch["timers"][phase] for epoch in self.epochs)
+                    for phase in PHASES
+                },
+                "counters": {
+                    counter: sum(
+                        epoch["counters"][counter] for epoch in self.epochs)
+                    for counter in COUNTERS
+                }
+            }
+        }
+
+    def to_json(self, indent: int = 2) -> str:
+        return json.dumps(self.get_report(), indent=indent)
+
+    def write_json(self, file_name: str) -> None:
+        with open(file_name, "w") as file:
+            file.write(self.to_json())
+
+
+def null_phase(name: str) -> ContextManager[None]:
+    return nullcontext()
+
+
+class InstrumentedCSVProcessor(CSVProcessor):
+    """Market data that counts its lookups. Shares the arrays of the market
+    data it is created from.
+    """
+
+    def __init__(
+        self,
+        csv_processor: CSVProcessor,
+        instrumentation: Instrumentation
+    ) -> None:
+        self.__dict__.update(csv_processor.__dict__)
+        self.instrumentation = instrumentation
+
+    def get_underlying_price(self, date: datetime) -> float:
+        self.instrumentation.count("market_data_lookups")
+        return super().get_underlying_price(date)
+
+    def get_vol(self, date: datetime) -> float:
+        self.instrumentation.count("market_data_lookups")
+        return super().get_vol(date)
+
+    def get_r(self, date: datetime) -> float:
+        self.instrumentation.count("market_data_lookups")
+        return super().get_r(date)
+
+    def get_underlying_price_many(self, dates: List[datetime]) -> np.ndarray:
+        self.instrumentation.count("market_data_lookups", len(dates))
+        return super().get_underlying_price_many(dates)
+
+    def get_vol_many(self, dates: List[datetime]) -> np.ndarray:
+        self.instrumentation.count("market_data_lookups", len(dates))
+        return super().get_vol_many(dates)
+
+    def get_r_many(self, dates: List[datetime]) -> np.ndarray:
+        self.instrumentation.count("market_data_lookups", len(dates))
+        return super().get_r_many(dates)
+
+
+class InstrumentedOptionPool(OptionPool):
+    """An option pool that times premium pricing and exercises, and counts
+    purchases, exercises, liquidity provider withdrawals and premium cache
+    lookups.
+    """
+
+    def __init__(
+        self,
+        csv_processor: CSVProcessor,
+        purchaser_distribution: Distribution,
+        strike_band: float,
+        instrumentation: Instrumentation,
+        premium_cache: 'PremiumSurfaceCache' = None,
+        tenor: float = EPOCH_TENOR
+    ) -> None:
+        super().__init__(
+            csv_processor,
+            purchaser_distribution,
+            strike_band,
+            premium_cache,
+            tenor
+        )
+        self.instrumentation = instrumentation
+
+    def withdraw(self, value: float, asset: UnderlyingAsset) -> bool:
+        is_success = super().withdraw(value, asset)
+        self.instrumentation.count("lp_withdraw_attempts")
+        if not is_success:
+            self.instrumentation.count("lp_withdraw_failures")
+        return is_success
+
+    def withdraw_many(
+        self,
+        values: np.ndarray,
+        asset: UnderlyingAsset
+    ) -> np.ndarray:
+        # Withdrawals after the first failure go through withdraw and are
+        # counted there
+        counters = self.instrumentation.counters
+        num_attempts = counters["lp_withdraw_attempts"]
+        is_success = super().withdraw_many(values, asset)
+        num_counted = counters["lp_withdraw_attempts"] - num_attempts
+        self.instrumentation.count(
+            "lp_withdraw_attempts", len(values) - num_counted)
+        return is_success
+
+    def purchase_call_option(
+        self,
+        date: datetime,
+        purchaser_id: int,
+        value: float
+    ) -> float:
+        premium = super().purchase_call_option(date, purchaser_id, value)
+        self.instrumentation.count("purchases_filled", premium != -1)
+        return premium
+
+    def purchase_call_options(
+        self,
+        date: datetime,
+        purchaser_ids: np.ndarray,
+        values: np.ndarray
+    ) -> np.ndarray:
+        self.instrumentation.count("purchases_filled", len(purchaser_ids))
+        return super().purchase_call_options(date, purchaser_ids, values)
+
+    def exercise_call_option(self, date: datetime, purchaser_id: int) -> float:
+        start = perf_counter()
+        strike = super().exercise_call_option(date, purchaser_id)
+        self.instrumentation.add_time("exercise", perf_counter() - start)
+        self.instrumentation.count("exercises", strike != -1)
+        return strike
+
+    def exercise_call_options(
+        self,
+        date: datetime
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        start = perf_counter()
+        purchaser_ids, strikes = super().exercise_call_options(date)
+        self.instrumentation.add_time("exercise", perf_counter() - start)
+        self.instrumentation.count("exercises", len(purchaser_ids))
+        return purchaser_ids, strikes
+
+    def calculate_premium(self, date: datetime, strike: float) -> float:
+        with self.record_premium_pricing():
+            return super().calculate_premium(date, strike)
+
+    def calculate_premiums(
+        self,
+        date: datetime,
+        strikes: np.ndarray,
+        T: float or np.ndarray = None,
+        r: float or np.ndarray = None,
+        sigma: float or np.ndarray = None
+    ) -> np.ndarray:
+        with self.record_premium_pricing():
+            return super().calculate_premiums(date, strikes, T, r, sigma)
+
+    @contextmanager
+    def record_premium_pricing(self) -> ContextManager[None]:
+        """Times the premiums priced within it and counts their premium cache
+        lookups.
+        """
+        premium_cache = self.premium_cache
+        if premium_cache is not None:
+            hits, misses = premium_cache.hits, premium_cache.misses
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.instrumentation.add_time(
+                "premium_pricing", perf_counter() - start)
+            if premium_cache is not None:
+                self.instrumentation.count(
+                    "premium_cache_hits", premium_cache.hits - hits)
+                self.instrumentation.count(
+                    "premium_cache_misses", premium_cache.misses - misses)
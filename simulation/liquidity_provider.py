@@ -5,6 +5,11 @@ from data_classes.underlying_asset import UnderlyingAsset
 from simulation.option_pool import OptionPool
 from utils.csv_processor import CSVProcessor
 
+# Ranges of the amounts of the underlying asset that a liquidity provider
+# deposits at the start and withdraws at the end of each epoch
+DEPOSIT_RANGE = (1, 3)
+WITHDRAW_RANGE = (0, 2)
+
 
 class LiquidityProvider:
     def __init__(
@@ -25,11 +30,13 @@ class LiquidityProvider:
         self.num_underlying_deposited = 0
         self.num_underlying_withdrawn = 0
 
-    def start_epoch(self, date: datetime) -> None:
+    def start_epoch(self, date: datetime, value: float = None) -> None:
         """Deposits a random amount of the underlying asset into the option
-        pool.
+        pool. The amount is drawn from the distribution unless a pre-drawn
+        value is given.
         """
-        value = self.generate_random_deposit_value()
+        if value is None:
+            value = self.generate_random_deposit_value()
         self.option_pool.deposit(
             value,
             self.asset
@@ -40,11 +47,13 @@ class LiquidityProvider:
         self.num_underlying_in_pool += value
         self.num_underlying_deposited += value
 
-    def end_epoch(self, date: datetime) -> None:
+    def end_epoch(self, date: datetime, value: float = None) -> None:
         """Attempts to withdraw a random amount of the underlying asset from the
-        option pool. It cannot withdraw more than it has deposited.
+        option pool. It cannot withdraw more than it has deposited. The amount
+        is drawn from the distribution unless a pre-drawn value is given.
         """
-        value = self.generate_random_withdraw_value()
+        if value is None:
+            value = self.generate_random_withdraw_value()
         if value >= self.num_underlying_in_pool:
             is_success = self.option_pool.withdraw(
                 value,
@@ -59,7 +68,7 @@ class LiquidityProvider:
                 self.num_underlying_withdrawn += 1
 
     def generate_random_deposit_value(self) -> float:
-        return self.distribution.generate_ranged_value(1, 3)
+        return self.distribution.generate_ranged_value(*DEPOSIT_RANGE)
 
     def generate_random_withdraw_value(self) -> float:
-        return self.distribution.generate_ranged_value(0, 2)
+        return self.distribution.generate_ranged_value(*WITHDRAW_RANGE)
@@ -1,33 +1,232 @@
+import math
 from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, Tuple
 
 import numpy as np
-from scipy.stats import norm
 
 from data_classes.distribution import Distribution
-from data_classes.epoch import Epoch
+from data_classes.epoch_length import EpochLength
+from data_classes.epoch_table import EpochTable
 from data_classes.option import Option, OptionType
+from data_classes.pool_result import PoolResult
+from data_classes.pool_snapshot import PoolSnapshot
 from data_classes.underlying_asset import UnderlyingAsset
+from utils.column import Column
 from utils.csv_processor import CSVProcessor
 
+if TYPE_CHECKING:
+    from simulation.premium_surface import PremiumSurfaceCache
+
+# Time to expiry in years of the options purchased at the start of an epoch,
+# by epoch length. Monthly options are priced with the average month.
+EPOCH_TENORS = {
+    EpochLength.DAILY: 1.0 / 365.0,
+    EpochLength.WEEKLY: 7.0 / 365.0,
+    EpochLength.MONTHLY: 1.0 / 12.0
+}
+EPOCH_TENOR = EPOCH_TENORS[EpochLength.WEEKLY]
+
+# Greeks of the open options, totalled in the epoch statistics
+GREEKS = ("delta", "gamma", "vega", "theta")
+
+SQRT_2 = math.sqrt(2)
+
+
+def calculate_d1_d2(
+    S: float or np.ndarray,
+    K: float or np.ndarray,
+    T: float or np.ndarray,
+    r: float or np.ndarray,
+    sigma: float or np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the Black-Scholes d1 and d2 terms (see
+    calculate_black_scholes_premiums for the arguments).
+    """
+    K = np.asarray(K, dtype=float)
+    sqrt_T = np.sqrt(T)
+    d1 = (np.log(S/K) + (r + sigma**2/2)*T) / (sigma*sqrt_T)
+    d2 = d1 - sigma * sqrt_T
+    return d1, d2
+
+
+def calculate_black_scholes_premiums(
+    S: float or np.ndarray,
+    K: float or np.ndarray,
+    T: float or np.ndarray,
+    r: float or np.ndarray,
+    sigma: float or np.ndarray,
+    is_put: bool or np.ndarray = False
+) -> np.ndarray:
+    """Returns the Black-Scholes premiums of European options. All arguments
+    may be scalars or arrays that broadcast against each other, so options on
+    different underlying assets and of both types can be priced in one pass.
+
+    S = spot price of asset
+    K = strike price of option
+    T = time in years
+    r = risk free interest rate
+    sigma = annualized vol
+    is_put = whether each option is a put (otherwise a call)
+    """
+    from scipy.special import ndtr as N
+
+    d1, d2 = calculate_d1_d2(S, K, T, r, sigma)
+    premiums = S * N(d1) - K * np.exp(-r*T) * N(d2)
+    if np.any(is_put):
+        premiums = np.where(
+            is_put,
+            K * np.exp(-r*T) * N(-d2) - S * N(-d1),
+            premiums
+        )
+    return premiums
+
+
+def calculate_black_scholes_premium(
+    S: float,
+    K: float,
+    T: float,
+    r: float,
+    sigma: float
+) -> float:
+    """Scalar form of calculate_black_scholes_premiums for a call option, on
+    Python floats, which avoids NumPy's per-call overhead when options are
+    priced one at a time. N(x) = erfc(-x/sqrt(2))/2 is accurate in both
+    tails, like scipy's ndtr.
+    """
+    sigma_sqrt_T = sigma * math.sqrt(T)
+    d1 = (math.log(S/K) + (r + sigma**2/2)*T) / sigma_sqrt_T
+    d2 = d1 - sigma_sqrt_T
+    return S * 0.5*math.erfc(-d1/SQRT_2) - \
+        K * math.exp(-r*T) * 0.5*math.erfc(-d2/SQRT_2)
+
+
+def calculate_black_scholes_greeks(
+    S: float or np.ndarray,
+    K: float or np.ndarray,
+    T: float or np.ndarray,
+    r: float or np.ndarray,
+    sigma: float or np.ndarray,
+    is_put: bool or np.ndarray = False
+) -> Dict[str, np.ndarray]:
+    """Returns the Black-Scholes delta, gamma, vega and theta of European
+    options, keyed by name, from the same inputs as
+    calculate_black_scholes_premiums. Vega is per unit of annualized vol and
+    theta is per year.
+    """
+    from scipy.special import ndtr as N
+
+    is_put = np.asarray(is_put, dtype=float)
+
+    d1, d2 = calculate_d1_d2(S, K, T, r, sigma)
+    sqrt_T = np.sqrt(T)
+    density = np.exp(-d1**2/2) / np.sqrt(2*np.pi)
+    discounted_K = K * np.exp(-r*T)
+
+    # Put-call parity: a put's delta is the call's less 1, and its theta is
+    # the call's plus r*K*exp(-rT)
+    return {
+        "delta": N(d1) - is_put,
+        "gamma": density / (S*sigma*sqrt_T),
+        "vega": S * density * sqrt_T,
+        "theta": -S * density * sigma / (2*sqrt_T) -
+        r * discounted_K * (N(d2) - is_put)
+    }
+
 
 class OptionPool:
     def __init__(
         self,
         csv_processor: CSVProcessor,
-        purchaser_distribution: Distribution
+        purchaser_distribution: Distribution,
+        strike_band: float = 0.5,
+        premium_cache: 'PremiumSurfaceCache' = None,
+        tenor: float = EPOCH_TENOR
     ) -> None:
+        if premium_cache is not None and premium_cache.tenor != tenor:
+            raise ValueError("The premium cache prices a different tenor")
         self.csv_processor = csv_processor
         self.purchaser_distribution = purchaser_distribution
+        self.strike_band = strike_band  # permitted strikes are spot +/- band
+        self.premium_cache = premium_cache
+        self.tenor = tenor  # time to expiry in years of purchased options
         self.total_underlying_asset_unlocked = 0.0
         self.total_underlying_asset_locked = 0.0
         self.total_usdt = 0.0
         self.options = dict()
 
+        # Options purchased in batches (see purchase_call_options)
+        self.option_book_purchaser_ids = np.empty(0, dtype=np.int64)
+        self.option_book_strikes = np.empty(0)
+        self.option_book_premiums = np.empty(0)
+
         # Statistics
-        self.epochs = []
-        self.strike_values = []
-        self.strikes = []
-        self.premiums = []
+        self.epochs = EpochTable()
+        self.strike_value_column = Column()
+        self.strike_column = Column()
+        self.premium_column = Column()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Pickles the pool without its premium cache, which holds the
+        surfaces of every date it priced and is shared with other pools. An
+        unpickled pool prices premiums with the Black-Scholes formula.
+        """
+        state = self.__dict__.copy()
+        state["premium_cache"] = None
+        return state
+
+    @property
+    def strike_values(self) -> Column:
+        """Returns the strike range values of the purchased options in order
+        of purchase, as a column that reads like an array and appends like a
+        list, as do strikes and premiums.
+        """
+        return self.strike_value_column
+
+    @property
+    def strikes(self) -> Column:
+        return self.strike_column
+
+    @property
+    def premiums(self) -> Column:
+        return self.premium_column
+
+    @property
+    def open_strikes(self) -> np.ndarray:
+        """Returns the strike prices of every open option."""
+        return np.concatenate((
+            np.fromiter(
+                (option.strike for option in self.options.values()),
+                dtype=float,
+                count=len(self.options)
+            ),
+            self.option_book_strikes
+        ))
+
+    def get_epoch_columns(self) -> Dict[str, np.ndarray]:
+        return self.epochs.get_columns()
+
+    def get_result(self) -> PoolResult:
+        """Returns copies of the epoch statistics and strike range values of
+        the pool.
+        """
+        return PoolResult(
+            self.purchaser_distribution,
+            {
+                field: values.copy()
+                for field, values in self.get_epoch_columns().items()
+            },
+            self.strike_value_column.values.copy()
+        )
+
+    def get_purchase_columns(self) -> Dict[str, np.ndarray]:
+        """Returns the strike range value, strike and premium of every
+        purchased option, in order of purchase.
+        """
+        return {
+            "strike_value": self.strike_value_column.values,
+            "strike": self.strike_column.values,
+            "premium": self.premium_column.values
+        }
 
     def deposit(self, value: float, asset: UnderlyingAsset) -> None:
         if asset == UnderlyingAsset.USDT:
@@ -46,6 +245,34 @@ class OptionPool:
                 return True
         return False
 
+    def withdraw_many(
+        self,
+        values: np.ndarray,
+        asset: UnderlyingAsset
+    ) -> np.ndarray:
+        """Batch form of withdraw. Attempts the withdrawals in the given order
+        and returns which of them succeeded.
+        """
+        if asset == UnderlyingAsset.USDT:
+            total = self.total_usdt
+        else:
+            total = self.total_underlying_asset_unlocked
+
+        # Every withdrawal before the first failure succeeds
+        previous_values = np.concatenate(([0.0], np.cumsum(values)[:-1]))
+        is_success = total - previous_values >= values
+        num_successes = len(values) if is_success.all() else \
+            np.argmin(is_success)
+        if asset == UnderlyingAsset.USDT:
+            self.total_usdt -= values[:num_successes].sum()
+        else:
+            self.total_underlying_asset_unlocked -= values[:num_successes].sum()
+
+        # Later withdrawals depend on which of the earlier ones failed
+        for i in range(num_successes, len(values)):
+            is_success[i] = self.withdraw(values[i], asset)
+        return is_success
+
     def purchase_call_option(
         self,
         date: datetime,
@@ -76,10 +303,10 @@ class OptionPool:
             )
 
             # Epoch statistics
-            self.epochs[-1].total_lp_profit += premium
-            self.strike_values.append(value)
-            self.strikes.append(strike)
-            self.premiums.append(premium)
+            self.epochs.total_lp_profit[-1] += premium
+            self.strike_value_column.append(value)
+            self.strike_column.append(strike)
+            self.premium_column.append(premium)
 
             return premium
         return -1
@@ -97,12 +324,74 @@ class OptionPool:
                 # Option is exercised
                 self.total_usdt += strike
                 self.total_underlying_asset_locked -= 1
-                self.epochs[-1].total_lp_profit += strike
-                self.epochs[-1].total_lp_profit -= end_underlying_price
+                self.epochs.total_lp_profit[-1] += strike
+                self.epochs.total_lp_profit[-1] -= end_underlying_price
 
                 return strike
         return -1
 
+    def purchase_call_options(
+        self,
+        date: datetime,
+        purchaser_ids: np.ndarray,
+        values: np.ndarray
+    ) -> np.ndarray:
+        """Batch form of purchase_call_option for purchasers that the caller
+        has already matched with unlocked underlying assets. Locks 1 of the
+        underlying assets per option, stores the options in the option book
+        arrays in the given order, and returns the premiums.
+        """
+        strikes = self.calculate_strike_prices(values, date)
+        premiums = self.calculate_premiums(date, strikes)
+
+        # Lock the underlying assets
+        self.total_underlying_asset_unlocked -= len(purchaser_ids)
+        self.total_underlying_asset_locked += len(purchaser_ids)
+
+        # Increment the pool's USDT by the premiums
+        self.total_usdt += premiums.sum()
+
+        # Store the option details
+        self.option_book_purchaser_ids = np.concatenate(
+            (self.option_book_purchaser_ids, purchaser_ids))
+        self.option_book_strikes = np.concatenate(
+            (self.option_book_strikes, strikes))
+        self.option_book_premiums = np.concatenate(
+            (self.option_book_premiums, premiums))
+
+        # Epoch statistics
+        self.epochs.total_lp_profit[-1] += premiums.sum()
+        self.strike_value_column.extend(values)
+        self.strike_column.extend(strikes)
+        self.premium_column.extend(premiums)
+
+        return premiums
+
+    def exercise_call_options(
+        self,
+        date: datetime
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Batch form of exercise_call_option for every option in the option
+        book arrays. Empties the option book and returns the purchaser ids and
+        strike prices of the options that were exercised.
+        """
+        end_underlying_price = self.csv_processor.get_underlying_price(date)
+        is_exercised = self.option_book_strikes <= end_underlying_price
+        purchaser_ids = self.option_book_purchaser_ids[is_exercised]
+        strikes = self.option_book_strikes[is_exercised]
+
+        # Options are exercised
+        self.total_usdt += strikes.sum()
+        self.total_underlying_asset_locked -= len(strikes)
+        self.epochs.total_lp_profit[-1] += strikes.sum()
+        self.epochs.total_lp_profit[-1] -= end_underlying_price * len(strikes)
+
+        self.option_book_purchaser_ids = np.empty(0, dtype=np.int64)
+        self.option_book_strikes = np.empty(0)
+        self.option_book_premiums = np.empty(0)
+
+        return purchaser_ids, strikes
+
     def unlock_underlying_assets(self) -> None:
         self.total_underlying_asset_unlocked += self.total_underlying_asset_locked
         self.total_underlying_asset_locked = 0.0
@@ -114,12 +403,12 @@ class OptionPool:
 
     def calculate_lowest_strike(self, date: datetime) -> float:
         lowstrike = self.csv_processor.get_underlying_price(date)
-        lowstrike -= .5*lowstrike
+        lowstrike -= self.strike_band*lowstrike
         return lowstrike
 
     def calculate_highest_strike(self, date: datetime) -> float:
         highstrike = self.csv_processor.get_underlying_price(date)
-        highstrike += .5*highstrike
+        highstrike += self.strike_band*highstrike
         return highstrike
 
     def calculate_strike_price(
@@ -133,7 +422,19 @@ class OptionPool:
         """
         lowest = self.calculate_lowest_strike(date)
         highest = self.calculate_highest_strike(date)
-        return lowest + (highest - lowest) * value
+        return lowest + (highest - lowest) * float(value)
+
+    def calculate_strike_prices(
+        self,
+        values: np.ndarray,
+        date: datetime,
+    ) -> np.ndarray:
+        """Returns the strike prices for an array of values [0, 1]. See
+        calculate_strike_price.
+        """
+        lowest = self.calculate_lowest_strike(date)
+        highest = self.calculate_highest_strike(date)
+        return lowest + (highest - lowest) * np.asarray(values, dtype=float)
 
     def calculate_premium(
         self,
@@ -141,43 +442,104 @@ class OptionPool:
         strike: float,
     ) -> float:
         """Calculates the premium in USDT using Black-Scholes options premium
-        prediction based on the date and strike price.
+        prediction based on the date and strike price. Scalar form of
+        calculate_premiums with its defaults.
+        """
+        if self.premium_cache is not None:
+            return self.premium_cache.calculate_premium(date, strike)
+        return calculate_black_scholes_premium(
+            self.csv_processor.get_underlying_price(date),
+            float(strike),
+            self.tenor,
+            self.csv_processor.get_r(date),
+            self.csv_processor.get_vol(date)
+        )
+
+    def calculate_premiums(
+        self,
+        date: datetime,
+        strikes: np.ndarray,
+        T: float or np.ndarray = None,
+        r: float or np.ndarray = None,
+        sigma: float or np.ndarray = None
+    ) -> np.ndarray:
+        """Calculates the premiums in USDT of an array of strike prices in a
+        single pass using Black-Scholes options premium prediction. The market
+        data for the date is looked up once for the whole batch.
 
         S = spot price of asset
         K = strike price of option
-        T = time in years
-        r = risk free interest rate
-        sigma = annualized vol (vix as a percentage)
+        T = time in years (defaults to the pool's tenor)
+        r = risk free interest rate (defaults to the rate on the date)
+        sigma = annualized vol (defaults to the vol on the date)
+
+        T, r and sigma may be scalars or arrays broadcastable against strikes.
+        Premiums with the defaults come from the premium cache, if the pool
+        has one.
         """
+        if self.premium_cache is not None and \
+                T is None and r is None and sigma is None:
+            return self.premium_cache.calculate_premiums(date, strikes)
         S = self.csv_processor.get_underlying_price(date)
-        K = strike
-        T = 7.0 / 365.0
-        r = self.csv_processor.get_r(date)
-        sigma = self.csv_processor.get_vol(date)
-        N = norm.cdf
+        if T is None:
+            T = self.tenor
+        if r is None:
+            r = self.csv_processor.get_r(date)
+        if sigma is None:
+            sigma = self.csv_processor.get_vol(date)
+        return calculate_black_scholes_premiums(S, strikes, T, r, sigma)
 
-        d1 = (np.log(S/K) + (r + sigma**2/2)*T) / (sigma*np.sqrt(T))
-        d2 = d1 - sigma * np.sqrt(T)
-        premium = S * N(d1) - K * np.exp(-r*T) * N(d2)
-        return premium
+    def calculate_book_greeks(self, date: datetime) -> Dict[str, float]:
+        """Returns the total delta, gamma, vega and theta of the open options
+        on the date, priced with the same Black-Scholes inputs as their
+        premiums, in a single pass over the option book. Also returns the
+        pool's net delta: the underlying assets locked by the options less
+        the options' total delta.
+        """
+        greeks = calculate_black_scholes_greeks(
+            self.csv_processor.get_underlying_price(date),
+            self.open_strikes,
+            self.tenor,
+            self.csv_processor.get_r(date),
+            self.csv_processor.get_vol(date)
+        )
+        book_greeks = {
+            "book_" + greek: greeks[greek].sum() for greek in GREEKS
+        }
+        book_greeks["net_delta"] = self.total_underlying_asset_locked - \
+            book_greeks["book_delta"]
+        return book_greeks
+
+    def get_snapshot(self) -> PoolSnapshot:
+        return PoolSnapshot(
+            self.total_underlying_asset_unlocked,
+            self.total_underlying_asset_locked,
+            self.total_usdt,
+            len(self.options) + len(self.option_book_purchaser_ids)
+        )
 
     def initialize_epoch_statistics(self, date: datetime) -> None:
-        self.epochs.append(Epoch(
-            str(date.date()),
-            self.csv_processor.get_underlying_price(date),
-            0.0,
-            0.0,
-            0.0
-        ))
+        self.epochs.append(
+            date,
+            self.csv_processor.get_underlying_price(date)
+        )
+
+    def calculate_risk_statistics(self, date: datetime) -> None:
+        """Records the Greeks of the open options (see calculate_book_greeks)
+        in the epoch statistics.
+        """
+        for field, value in self.calculate_book_greeks(date).items():
+            getattr(self.epochs, field)[-1] = value
 
     def calculate_epoch_statistics(self) -> None:
         # Calculate the total value locked in the option pool (USDT)
-        self.epochs[-1].total_value_locked = self.epochs[-1].end_underlying_price * \
+        self.epochs.total_value_locked[-1] = \
+            self.epochs.end_underlying_price[-1] * \
             self.total_underlying_asset_unlocked
 
         # Calculate the total profit of the option pool (USDT)
         if len(self.epochs) == 1:
-            self.epochs[-1].total_profit = self.epochs[-1].total_value_locked
+            self.epochs.total_profit[-1] = self.epochs.total_value_locked[-1]
         else:
-            self.epochs[-1].total_profit = self.epochs[-1].total_value_locked - \
-                self.epochs[-2].total_value_locked
+            self.epochs.total_profit[-1] = self.epochs.total_value_locked[-1] - \
+                self.epochs.total_value_locked[-2]
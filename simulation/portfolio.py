@@ -0,0 +1,465 @@
+from datetime import datetime
+from typing import TYPE_CHECKING, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from data_classes.distribution import Distribution
+from data_classes.epoch import Epoch
+from data_classes.epoch_length import EpochLength
+from data_classes.epoch_table import EpochTable
+from data_classes.option import OptionType
+from data_classes.pool_config import PoolConfig
+from simulation.liquidity_provider import DEPOSIT_RANGE, WITHDRAW_RANGE
+from simulation.option_pool import (EPOCH_TENORS, GREEKS,
+                                    calculate_black_scholes_greeks,
+                                    calculate_black_scholes_premiums)
+from simulation.vectorized_actors import calculate_fills
+from utils.column import Column
+from utils.market_data_panel import MarketDataPanel
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def calculate_sized_fills(
+    unlocked: np.ndarray,
+    sizes: np.ndarray
+) -> np.ndarray:
+    """Returns which of a sequence of purchase attempts are filled, given the
+    unlocked collateral each attempt would see if no purchases had been made
+    before it and the collateral each attempt locks. An attempt is filled if
+    the unlocked collateral minus the collateral locked by earlier fills is
+    > 0 (see calculate_fills, where every fill locks 1).
+    """
+    # The unlocked collateral only changes between runs of attempts (at the
+    # liquidity providers' turns). Within a run the filled attempts are a
+    # prefix, found by searching the cumulative sizes.
+    is_filled = np.zeros(len(unlocked), dtype=bool)
+    if len(unlocked) == 0:
+        return is_filled
+    boundaries = np.concatenate((
+        [0],
+        np.flatnonzero(np.diff(unlocked) != 0) + 1,
+        [len(unlocked)]
+    ))
+    cumulative_sizes = np.concatenate(([0.0], np.cumsum(sizes)))
+    locked = 0.0
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        available = unlocked[start] - locked
+        if available <= 0:
+            continue
+        num_filled = np.searchsorted(
+            cumulative_sizes[start:end],
+            available + cumulative_sizes[start],
+            side='left'
+        )
+        is_filled[start:start + num_filled] = True
+        locked += cumulative_sizes[start + num_filled] - \
+            cumulative_sizes[start]
+    return is_filled
+
+
+def calculate_withdrawals(
+    total: float,
+    values: np.ndarray
+) -> Tuple[np.ndarray, float]:
+    """Attempts the withdrawals from the total in the given order, and returns
+    which of them succeeded and the remaining total (see
+    OptionPool.withdraw_many).
+    """
+    # Every withdrawal before the first failure succeeds
+    previous_values = np.concatenate(([0.0], np.cumsum(values)[:-1]))
+    is_success = total - previous_values >= values
+    num_successes = len(values) if is_success.all() else \
+        np.argmin(is_success)
+    total -= values[:num_successes].sum()
+
+    # Later withdrawals depend on which of the earlier ones failed
+    for i in range(num_successes, len(values)):
+        is_success[i] = total >= values[i]
+        if is_success[i]:
+            total -= values[i]
+    return is_success, total
+
+
+class PortfolioSimulation:
+    """Simulates several option pools side by side over a market data panel:
+    call and put pools on any of the panel's underlying assets, each with its
+    own purchasers, and liquidity providers that split their capital across
+    the pools.
+
+    The pools are held as arrays, so every step of an epoch (pricing, fills,
+    exercises, withdrawals and statistics) is one vectorized pass over all
+    pools, with the market data of every pool looked up as one column of the
+    panel.
+
+    Call pools hold the underlying asset and lock 1 of it per option. Put
+    pools hold USDT and lock the strike price per option; an exercised put
+    pays the strike price for 1 of the underlying asset, which the pool sells
+    at the end price. Liquidity provider i puts the fraction allocation[i, j]
+    of every deposit and withdrawal (in units of the underlying asset, valued
+    in USDT for put pools) into pool j.
+
+    Every epoch draws from the random stream in the same order as
+    Simulation, with the purchasers' strike range values drawn pool by pool,
+    so a single call pool gives the same statistics as Simulation with the
+    vectorized engine. Options are priced with the tenor of the epoch length,
+    as in Simulation.
+    """
+
+    def __init__(
+        self,
+        panel: MarketDataPanel,
+        pool_configs: Sequence[PoolConfig],
+        num_liquidity_providers: int,
+        lp_distribution: Distribution,
+        epoch_dates: List[datetime],
+        allocation: np.ndarray = None,
+        seed: int or np.random.SeedSequence = None,
+        epoch_length: EpochLength = EpochLength.WEEKLY
+    ) -> None:
+        num_pools = len(pool_configs)
+        if allocation is None:
+            allocation = np.full(
+                (num_liquidity_providers, num_pools), 1.0 / num_pools)
+        allocation = np.broadcast_to(
+            np.asarray(allocation, dtype=float),
+            (num_liquidity_providers, num_pools)
+        )
+        if np.any(allocation < 0) or \
+                not np.allclose(allocation.sum(axis=1), 1):
+            raise ValueError(
+                "Allocations must be nonnegative and sum to 1 for each "
+                "liquidity provider")
+
+        self.panel = panel
+        self.pool_configs = tuple(pool_configs)
+        self.num_liquidity_providers = num_liquidity_providers
+        self.lp_distribution = lp_distribution
+        self.epoch_dates = epoch_dates
+        self.allocation = allocation
+        self.tenor = EPOCH_TENORS[epoch_length]
+        self.rng = np.random.default_rng(seed)
+        self.num_epochs_run = 0
+
+        self.pool_assets = panel.get_asset_indices(
+            [config.asset for config in pool_configs])
+        self.is_put = np.array([
+            config.option_type == OptionType.PUT for config in pool_configs
+        ], dtype=bool)
+        self.strike_bands = np.array([
+            config.strike_band for config in pool_configs
+        ], dtype=float)
+        self.purchaser_distributions = [
+            Distribution(config.purchaser_distribution)
+            for config in pool_configs
+        ]
+        self.purchaser_pools = np.repeat(
+            np.arange(num_pools),
+            [config.num_purchasers for config in pool_configs]
+        )
+        self.num_purchasers = len(self.purchaser_pools)
+
+        # Collateral of each pool, in the underlying asset for call pools and
+        # in USDT for put pools
+        self.total_unlocked = np.zeros(num_pools)
+        self.total_locked = np.zeros(num_pools)
+        self.total_usdt = np.zeros(num_pools)
+
+        # Open options of all pools
+        self.option_book_pools = np.empty(0, dtype=np.int64)
+        self.option_book_purchaser_ids = np.empty(0, dtype=np.int64)
+        self.option_book_strikes = np.empty(0)
+
+        # Statistics
+        self.epochs = [EpochTable() for _ in pool_configs]
+        self.purchase_pool_column = Column(dtype=np.int64)
+        self.strike_value_column = Column()
+        self.strike_column = Column()
+        self.premium_column = Column()
+        self.lp_num_underlying_in_pool = np.zeros(
+            (num_liquidity_providers, num_pools))
+        self.lp_profit = np.zeros(num_liquidity_providers)
+        self.lp_num_underlying_deposited = np.zeros(
+            (num_liquidity_providers, num_pools))
+        self.lp_num_underlying_withdrawn = np.zeros(
+            (num_liquidity_providers, num_pools))
+        self.purchaser_profit = np.zeros(self.num_purchasers)
+
+    def run(self) -> List[EpochTable]:
+        for _ in self.iter_epochs():
+            pass
+        return self.epochs
+
+    def iter_epochs(self) -> Iterator[List[Epoch]]:
+        """Runs the remaining epochs one at a time, yielding the finished
+        epoch of every pool as soon as it is done.
+        """
+        while self.num_epochs_run < len(self.epoch_dates) - 1:
+            self.run_epoch(
+                self.epoch_dates[self.num_epochs_run],
+                self.epoch_dates[self.num_epochs_run + 1]
+            )
+            self.num_epochs_run += 1
+            yield [epochs[-1] for epochs in self.epochs]
+
+    def run_epoch(self, start_date: datetime, end_date: datetime) -> None:
+        num_actors = self.num_liquidity_providers + self.num_purchasers
+        start_row = self.panel.get_row(start_date)
+        end_row = self.panel.get_row(end_date)
+        start_prices = self.panel.spot[self.pool_assets, start_row]
+        for epochs, start_price in zip(self.epochs, start_prices):
+            epochs.append(start_date, start_price)
+
+        # Each actor takes an action at the start of the epoch
+        order = self.rng.permutation(num_actors)
+        deposit_values = self.lp_distribution.generate_ranged_values(
+            self.num_liquidity_providers,
+            *DEPOSIT_RANGE,
+            self.rng
+        )
+        strike_range_values = np.concatenate([np.empty(0)] + [
+            distribution.generate_values(config.num_purchasers, self.rng)
+            for distribution, config in zip(
+                self.purchaser_distributions, self.pool_configs)
+        ])
+        self.start_epoch(
+            start_row,
+            order,
+            deposit_values,
+            strike_range_values
+        )
+        self.calculate_risk_statistics(start_row)
+
+        # Each actor takes an action at the end of the epoch
+        order = self.rng.permutation(num_actors)
+        withdraw_values = self.lp_distribution.generate_ranged_values(
+            self.num_liquidity_providers,
+            *WITHDRAW_RANGE,
+            self.rng
+        )
+        self.end_epoch(end_row, order, withdraw_values)
+
+        # Unlock the collateral and convert the USDT of call pools to the
+        # underlying asset
+        end_prices = self.panel.spot[self.pool_assets, end_row]
+        self.total_unlocked += self.total_locked
+        self.total_locked[:] = 0.0
+        self.total_unlocked += np.where(
+            self.is_put, self.total_usdt, self.total_usdt / end_prices)
+        self.total_usdt[:] = 0.0
+
+        # Statistics
+        total_value_locked = np.where(
+            self.is_put,
+            self.total_unlocked,
+            start_prices * self.total_unlocked
+        )
+        for epochs, value in zip(self.epochs, total_value_locked):
+            epochs.total_value_locked[-1] = value
+            if len(epochs) == 1:
+                epochs.total_profit[-1] = value
+            else:
+                epochs.total_profit[-1] = value - epochs.total_value_locked[-2]
+
+    def start_epoch(
+        self,
+        row: int,
+        order: np.ndarray,
+        deposit_values: np.ndarray,
+        strike_range_values: np.ndarray
+    ) -> None:
+        """Each liquidity provider deposits its deposit value across the pools,
+        and each purchaser attempts to purchase an option from its pool with
+        its strike range value, in the given order of actors.
+        """
+        prices = self.panel.spot[self.pool_assets, row]
+        is_lp = order < self.num_liquidity_providers
+
+        # The unlocked collateral of every pool at each purchaser's turn,
+        # before any purchases
+        deposit_units = deposit_values[:, np.newaxis] * self.allocation
+        deposit_collateral = deposit_units * np.where(self.is_put, prices, 1.0)
+        deposits = np.zeros((len(order), len(self.pool_configs)))
+        deposits[is_lp] = deposit_collateral[order[is_lp]]
+        unlocked = self.total_unlocked + np.cumsum(deposits, axis=0)[~is_lp]
+        self.total_unlocked += deposit_collateral.sum(axis=0)
+
+        # Strike prices of every purchaser, and the collateral their options
+        # would lock
+        purchaser_ids = order[~is_lp] - self.num_liquidity_providers
+        pools = self.purchaser_pools[purchaser_ids]
+        lowest = prices - self.strike_bands*prices
+        highest = prices + self.strike_bands*prices
+        strikes = lowest[pools] + (highest[pools] - lowest[pools]) * \
+            strike_range_values[purchaser_ids]
+        sizes = np.where(self.is_put[pools], strikes, 1.0)
+
+        # Purchasers whose turn comes while their pool has collateral left
+        is_filled = np.zeros(len(purchaser_ids), dtype=bool)
+        for pool in range(len(self.pool_configs)):
+            is_pool = pools == pool
+            if self.is_put[pool]:
+                is_filled[is_pool] = calculate_sized_fills(
+                    unlocked[is_pool, pool], sizes[is_pool])
+            else:
+                is_filled[is_pool] = calculate_fills(unlocked[is_pool, pool])
+        purchaser_ids = purchaser_ids[is_filled]
+        pools = pools[is_filled]
+        strikes = strikes[is_filled]
+        sizes = sizes[is_filled]
+
+        # Price the options of all pools in one pass
+        assets = self.pool_assets[pools]
+        premiums = calculate_black_scholes_premiums(
+            prices[pools],
+            strikes,
+            self.tenor,
+            self.panel.r[assets, row],
+            self.panel.vol[assets, row],
+            self.is_put[pools]
+        )
+
+        num_pools = len(self.pool_configs)
+        locked = np.bincount(pools, weights=sizes, minlength=num_pools)
+        pool_premiums = np.bincount(pools, weights=premiums, minlength=num_pools)
+        self.total_unlocked -= locked
+        self.total_locked += locked
+        self.total_usdt += pool_premiums
+
+        self.option_book_pools = np.concatenate(
+            (self.option_book_pools, pools))
+        self.option_book_purchaser_ids = np.concatenate(
+            (self.option_book_purchaser_ids, purchaser_ids))
+        self.option_book_strikes = np.concatenate(
+            (self.option_book_strikes, strikes))
+
+        # Statistics
+        for epochs, pool_premium in zip(self.epochs, pool_premiums):
+            epochs.total_lp_profit[-1] += pool_premium
+        self.purchase_pool_column.extend(pools)
+        self.strike_value_column.extend(strike_range_values[purchaser_ids])
+        self.strike_column.extend(strikes)
+        self.premium_column.extend(premiums)
+        self.lp_profit -= (deposit_units * prices).sum(axis=1)
+        self.lp_num_underlying_in_pool += deposit_units
+        self.lp_num_underlying_deposited += deposit_units
+        self.purchaser_profit[purchaser_ids] -= premiums
+
+    def calculate_risk_statistics(self, row: int) -> None:
+        """Records the total Greeks of every pool's open options in its epoch
+        statistics, priced for all pools in one pass (see
+        OptionPool.calculate_book_greeks). Only call pools lock underlying
+        assets, so a put pool's net delta is minus its book delta.
+        """
+        pools = self.option_book_pools
+        assets = self.pool_assets[pools]
+        greeks = calculate_black_scholes_greeks(
+            self.panel.spot[assets, row],
+            self.option_book_strikes,
+            self.tenor,
+            self.panel.r[assets, row],
+            self.panel.vol[assets, row],
+            self.is_put[pools]
+        )
+        num_pools = len(self.pool_configs)
+        book_greeks = {
+            "book_" + greek: np.bincount(
+                pools, weights=greeks[greek], minlength=num_pools)
+            for greek in GREEKS
+        }
+        book_greeks["net_delta"] = \
+            np.where(self.is_put, 0.0, self.total_locked) - \
+            book_greeks["book_delta"]
+        for field, values in book_greeks.items():
+            for epochs, value in zip(self.epochs, values):
+                getattr(epochs, field)[-1] = value
+
+    def end_epoch(
+        self,
+        row: int,
+        order: np.ndarray,
+        withdraw_values: np.ndarray
+    ) -> None:
+        """Each purchaser exercises its option, and each liquidity provider
+        attempts to withdraw its withdraw value across the pools, in the given
+        order of actors.
+        """
+        prices = self.panel.spot[self.pool_assets, row]
+        num_pools = len(self.pool_configs)
+
+        # Calls are exercised if the strike is at most the price, and puts if
+        # it is at least the price
+        pools = self.option_book_pools
+        book_prices = prices[pools]
+        is_put = self.is_put[pools]
+        is_exercised = np.where(
+            is_put,
+            self.option_book_strikes >= book_prices,
+            self.option_book_strikes <= book_prices
+        )
+        pools = pools[is_exercised]
+        purchaser_ids = self.option_book_purchaser_ids[is_exercised]
+        strikes = self.option_book_strikes[is_exercised]
+        book_prices = book_prices[is_exercised]
+        is_put = is_put[is_exercised]
+
+        # Call pools receive the strike for 1 locked underlying asset, and put
+        # pools pay the strike from their locked USDT for 1 underlying asset
+        # that they sell at the price
+        released = np.where(is_put, strikes, 1.0)
+        received = np.where(is_put, book_prices, strikes)
+        payoffs = np.where(is_put, strikes - book_prices, book_prices - strikes)
+        self.total_locked -= np.bincount(
+            pools, weights=released, minlength=num_pools)
+        self.total_usdt += np.bincount(
+            pools, weights=received, minlength=num_pools)
+        lp_payoffs = np.bincount(pools, weights=payoffs, minlength=num_pools)
+        for epochs, lp_payoff in zip(self.epochs, lp_payoffs):
+            epochs.total_lp_profit[-1] -= lp_payoff
+        self.purchaser_profit[purchaser_ids] += payoffs
+
+        self.option_book_pools = np.empty(0, dtype=np.int64)
+        self.option_book_purchaser_ids = np.empty(0, dtype=np.int64)
+        self.option_book_strikes = np.empty(0)
+
+        # Liquidity providers attempt to withdraw from every pool in the order
+        # of their turns
+        lp_order = order[order < self.num_liquidity_providers]
+        withdraw_units = withdraw_values[:, np.newaxis] * self.allocation
+        for pool in range(num_pools):
+            lp_ids = lp_order[withdraw_units[lp_order, pool] >=
+                              self.lp_num_underlying_in_pool[lp_order, pool]]
+            values = withdraw_units[lp_ids, pool]
+            if self.is_put[pool]:
+                values = values * prices[pool]
+            is_success, self.total_unlocked[pool] = calculate_withdrawals(
+                self.total_unlocked[pool], values)
+            lp_ids = lp_ids[is_success]
+
+            # Statistics
+            self.lp_profit[lp_ids] += prices[pool] * \
+                withdraw_units[lp_ids, pool]
+            self.lp_num_underlying_in_pool[lp_ids, pool] -= \
+                self.allocation[lp_ids, pool]
+            self.lp_num_underlying_withdrawn[lp_ids, pool] += \
+                self.allocation[lp_ids, pool]
+
+    def get_epoch_table(self) -> 'pd.DataFrame':
+        """Returns the epoch statistics of every pool as one table, with the
+        pool's index, underlying asset, option type and purchaser
+        distribution.
+        """
+        import pandas as pd
+
+        tables = []
+        for i, (config, epochs) in enumerate(
+                zip(self.pool_configs, self.epochs)):
+            table = epochs.to_frame()
+            table.insert(0, "purchaser_distribution", Distribution(
+                config.purchaser_distribution).name)
+            table.insert(0, "option_type", config.option_type.name)
+            table.insert(0, "asset", config.asset.name)
+            table.insert(0, "pool", i)
+            tables.append(table)
+        return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,396 @@
+import math
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Iterable, Tuple
+
+import numpy as np
+
+from simulation.option_pool import EPOCH_TENOR, SQRT_2
+from utils.csv_processor import CSVProcessor
+from utils.shared_market_data import attach_shared_memory
+
+# Default bound on the memory of the surfaces held by a PremiumSurfaceCache
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Approximate memory of a surface without a strike grid
+SURFACE_BYTES = 256
+
+# The scalars of a surface, in the order SharedPremiumSurfaces stores them
+SURFACE_SCALARS = (
+    "S",
+    "sigma_sqrt_T",
+    "drift",
+    "discount",
+    "lowest_strike",
+    "highest_strike",
+    "max_error"
+)
+
+
+class PremiumSurface:
+    """The premiums of the call options purchased on one date as a function
+    of the strike price. The spot price, risk free interest rate, vol and
+    tenor are fixed for the date, so the terms of the Black-Scholes formula
+    that only depend on them are computed once.
+
+    With a grid_size, the surface also holds the premiums and their slopes
+    (dC/dK = -exp(-rT)*N(d2)) on a uniform grid of strike prices over the
+    permitted band, and premiums within the band are interpolated with cubic
+    Hermite splines instead of evaluating the formula. The interpolation
+    error is O(h^4) in the grid spacing h; max_error is the largest error at
+    the grid midpoints. Strikes outside the band are priced exactly.
+
+    Without a grid_size, premiums are exactly those of
+    calculate_black_scholes_premiums.
+    """
+
+    def __init__(
+        self,
+        S: float,
+        r: float,
+        sigma: float,
+        T: float,
+        lowest_strike: float,
+        highest_strike: float,
+        grid_size: int = None
+    ) -> None:
+        self.S = S
+        self.sigma_sqrt_T = sigma * np.sqrt(T)
+        self.drift = (r + sigma**2/2)*T
+        self.discount = np.exp(-r*T)
+        self.lowest_strike = lowest_strike
+        self.highest_strike = highest_strike
+        self.grid_size = grid_size
+        self.max_error = 0.0
+        if grid_size is None:
+            return
+        if grid_size < 2:
+            raise ValueError("The strike grid needs at least 2 points")
+
+        self.grid_spacing = (highest_strike - lowest_strike) / (grid_size - 1)
+        grid_strikes = np.linspace(lowest_strike, highest_strike, grid_size)
+        self.grid_premiums, self.grid_slopes = \
+            self.calculate_exact_premiums(grid_strikes, with_slopes=True)
+        self.grid_premiums.flags.writeable = False
+        self.grid_slopes.flags.writeable = False
+
+        midpoints = grid_strikes[:-1] + self.grid_spacing / 2
+        self.max_error = float(np.max(np.abs(
+            self.interpolate_premiums(midpoints) -
+            self.calculate_exact_premiums(midpoints)
+        ), initial=0.0))
+
+    @classmethod
+    def from_arrays(
+        cls,
+        scalars: np.ndarray,
+        grid_premiums: np.ndarray = None,
+        grid_slopes: np.ndarray = None
+    ) -> 'PremiumSurface':
+        """Returns a surface built before from its scalars, in the order of
+        SURFACE_SCALARS, and its strike grid, if it has one, without computing
+        them again. The grid arrays are used as they are, e.g. as views of
+        shared memory.
+        """
+        surface = cls.__new__(cls)
+        for name, value in zip(SURFACE_SCALARS, scalars):
+            setattr(surface, name, float(value))
+        surface.grid_size = None
+        if grid_premiums is not None:
+            surface.grid_size = len(grid_premiums)
+            surface.grid_spacing = \
+                (surface.highest_strike - surface.lowest_strike) / \
+                (surface.grid_size - 1)
+            surface.grid_premiums = grid_premiums
+            surface.grid_slopes = grid_slopes
+        return surface
+
+    @property
+    def nbytes(self) -> int:
+        if self.grid_size is None:
+            return SURFACE_BYTES
+        return SURFACE_BYTES + self.grid_premiums.nbytes + \
+            self.grid_slopes.nbytes
+
+    def calculate_exact_premiums(
+        self,
+        strikes: np.ndarray,
+        with_slopes: bool = False
+    ) -> np.ndarray:
+        from scipy.special import ndtr as N
+
+        d1 = (np.log(self.S/strikes) + self.drift) / self.sigma_sqrt_T
+        d2 = d1 - self.sigma_sqrt_T
+        N_d2 = N(d2)
+        premiums = self.S * N(d1) - strikes * self.discount * N_d2
+        if with_slopes:
+            return premiums, -self.discount * N_d2
+        return premiums
+
+    def calculate_exact_premium(self, strike: float) -> float:
+        """Scalar form of calculate_exact_premiums on Python floats."""
+        d1 = (math.log(self.S/strike) + self.drift) / self.sigma_sqrt_T
+        d2 = d1 - self.sigma_sqrt_T
+        return self.S * 0.5*math.erfc(-d1/SQRT_2) - \
+            strike * self.discount * 0.5*math.erfc(-d2/SQRT_2)
+
+    def interpolate_premiums(self, strikes: np.ndarray) -> np.ndarray:
+        """Returns the premiums of strikes within the band, interpolated from
+        the grid.
+        """
+        position = (strikes - self.lowest_strike) / self.grid_spacing
+        i = np.clip(position.astype(np.intp), 0, self.grid_size - 2)
+        t = position - i
+        premiums = self.grid_premiums[i]
+        return premiums + \
+            t*t*(3 - 2*t) * (self.grid_premiums[i + 1] - premiums) + \
+            self.grid_spacing * t*(1 - t) * \
+            ((1 - t)*self.grid_slopes[i] - t*self.grid_slopes[i + 1])
+
+    def interpolate_premium(self, strike: float) -> float:
+        """Scalar form of interpolate_premiums, with the same operations on
+        Python floats, which avoids NumPy's per-call overhead when options
+        are priced one at a time.
+        """
+        position = (strike - self.lowest_strike) / self.grid_spacing
+        i = min(max(int(position), 0), self.grid_size - 2)
+        t = position - i
+        premium = float(self.grid_premiums[i])
+        return premium + \
+            t*t*(3 - 2*t) * (float(self.grid_premiums[i + 1]) - premium) + \
+            self.grid_spacing * t*(1 - t) * \
+            ((1 - t)*float(self.grid_slopes[i]) -
+             t*float(self.grid_slopes[i + 1]))
+
+    def calculate_premium(self, strike: float) -> float:
+        strike = float(strike)
+        if self.grid_size is not None and \
+                self.lowest_strike <= strike <= self.highest_strike:
+            return self.interpolate_premium(strike)
+        return self.calculate_exact_premium(strike)
+
+    def calculate_premiums(self, strikes: np.ndarray) -> np.ndarray:
+        strikes = np.asarray(strikes, dtype=float)
+        if self.grid_size is None:
+            return self.calculate_exact_premiums(strikes)
+        if strikes.shape == (1,) and \
+                self.lowest_strike <= strikes[0] <= self.highest_strike:
+            return np.array([self.interpolate_premium(float(strikes[0]))])
+
+        is_in_band = (strikes >= self.lowest_strike) & \
+            (strikes <= self.highest_strike)
+        if is_in_band.all():
+            return self.interpolate_premiums(strikes)
+        premiums = self.calculate_exact_premiums(strikes)
+        premiums[is_in_band] = self.interpolate_premiums(strikes[is_in_band])
+        return premiums
+
+
+class PremiumSurfaceCache:
+    """Premium surfaces of an asset's market data by date, shared by every
+    simulation of the asset with the same strike band, so replications and
+    sweep cells on the same dates build each surface once.
+
+    The surfaces price options with the given tenor, that of the epoch length
+    of the simulations.
+
+    Holds the most recently used surfaces up to max_bytes of memory and
+    evicts the least recently used ones beyond it. A surface is never
+    modified once built, so the cache can be filled before starting worker
+    processes (see precompute) and the workers read the same surfaces:
+    forked workers inherit them, and others attach a SharedPremiumSurfaces
+    copy of them.
+    """
+
+    def __init__(
+        self,
+        csv_processor: CSVProcessor,
+        strike_band: float = 0.5,
+        grid_size: int = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        tenor: float = EPOCH_TENOR
+    ) -> None:
+        self.csv_processor = csv_processor
+        self.strike_band = strike_band
+        self.grid_size = grid_size
+        self.tenor = tenor
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def create_surface(self, date: datetime) -> PremiumSurface:
+        S = self.csv_processor.get_underlying_price(date)
+        return PremiumSurface(
+            S,
+            self.csv_processor.get_r(date),
+            self.csv_processor.get_vol(date),
+            self.tenor,
+            S - self.strike_band*S,
+            S + self.strike_band*S,
+            self.grid_size
+        )
+
+    def get_surface(self, date: datetime) -> PremiumSurface:
+        surface = self.surfaces.get(date)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(date)
+            return surface
+
+        self.misses += 1
+        surface = self.create_surface(date)
+        self.add_surface(date, surface)
+        return surface
+
+    def add_surface(self, date: datetime, surface: PremiumSurface) -> None:
+        self.surfaces[date] = surface
+        self.nbytes += surface.nbytes
+        while self.nbytes > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+    def calculate_premium(self, date: datetime, strike: float) -> float:
+        return self.get_surface(date).calculate_premium(strike)
+
+    def calculate_premiums(
+        self,
+        date: datetime,
+        strikes: np.ndarray
+    ) -> np.ndarray:
+        return self.get_surface(date).calculate_premiums(strikes)
+
+    def precompute(self, dates: Iterable[datetime]) -> None:
+        """Builds the surfaces of the dates that are not cached yet, without
+        counting them as lookups.
+        """
+        hits, misses = self.hits, self.misses
+        for date in dates:
+            self.get_surface(date)
+        self.hits, self.misses = hits, misses
+
+    def get_stats(self) -> Dict[str, Any]:
+        num_lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / num_lookups if num_lookups else 0.0,
+            "evictions": self.evictions,
+            "num_surfaces": len(self.surfaces),
+            "nbytes": self.nbytes,
+            "max_error": max(
+                (surface.max_error for surface in self.surfaces.values()),
+                default=0.0
+            )
+        }
+
+
+@dataclass(frozen=True)
+class SharedPremiumSurfacesHandle:
+    name: str  # name of the shared memory block
+    num_surfaces: int
+    grid_size: int  # or None, if the surfaces have no strike grid
+
+
+def get_shared_surface_arrays(
+    shared_memory: SharedMemory,
+    num_surfaces: int,
+    grid_size: int = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the dates, scalars, grid premiums and grid slopes of the
+    surfaces stored back to back in the shared memory block, with a row per
+    surface. The grids have no columns if the surfaces have no strike grid.
+    """
+    grid_size = grid_size or 0
+    dates = np.ndarray(
+        (num_surfaces,), dtype='datetime64[us]', buffer=shared_memory.buf)
+    scalars = np.ndarray(
+        (num_surfaces, len(SURFACE_SCALARS)),
+        dtype=np.float64,
+        buffer=shared_memory.buf,
+        offset=dates.nbytes
+    )
+    grid_premiums, grid_slopes = (
+        np.ndarray(
+            (num_surfaces, grid_size),
+            dtype=np.float64,
+            buffer=shared_memory.buf,
+            offset=dates.nbytes + scalars.nbytes +
+            8 * num_surfaces * grid_size * i
+        ) for i in range(2)
+    )
+    return dates, scalars, grid_premiums, grid_slopes
+
+
+class SharedPremiumSurfaces:
+    """One read-only copy of the surfaces of a premium surface cache in a
+    shared memory block. Worker processes attach to it through its handle
+    (see attach_premium_surfaces) instead of building the surfaces again.
+    The creating process owns the block and must close it (or use it as a
+    context manager).
+    """
+
+    def __init__(self, premium_cache: PremiumSurfaceCache) -> None:
+        num_surfaces = len(premium_cache.surfaces)
+        grid_size = premium_cache.grid_size
+        self.shared_memory = SharedMemory(
+            create=True,
+            size=max(
+                8 * num_surfaces *
+                (1 + len(SURFACE_SCALARS) + 2 * (grid_size or 0)),
+                1
+            )
+        )
+        dates, scalars, grid_premiums, grid_slopes = \
+            get_shared_surface_arrays(
+                self.shared_memory, num_surfaces, grid_size)
+        for i, (date, surface) in enumerate(
+                premium_cache.surfaces.items()):
+            dates[i] = np.datetime64(date, 'us')
+            scalars[i] = [getattr(surface, name) for name in SURFACE_SCALARS]
+            if grid_size is not None:
+                grid_premiums[i] = surface.grid_premiums
+                grid_slopes[i] = surface.grid_slopes
+        self.handle = SharedPremiumSurfacesHandle(
+            self.shared_memory.name, num_surfaces, grid_size)
+
+    def close(self) -> None:
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    def __enter__(self) -> 'SharedPremiumSurfaces':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def attach_premium_surfaces(
+    handle: SharedPremiumSurfacesHandle,
+    premium_cache: PremiumSurfaceCache
+) -> None:
+    """Adds the surfaces of the handle's shared memory block that the cache
+    does not have to it, backed by read-only views of the block, without
+    counting them as lookups.
+    """
+    shared_memory = attach_shared_memory(handle.name)
+    dates, scalars, grid_premiums, grid_slopes = get_shared_surface_arrays(
+        shared_memory, handle.num_surfaces, handle.grid_size)
+    for array in (grid_premiums, grid_slopes):
+        array.flags.writeable = False
+    for i, date in enumerate(dates.tolist()):
+        if date in premium_cache.surfaces:
+            continue
+        if handle.grid_size is None:
+            surface = PremiumSurface.from_arrays(scalars[i])
+        else:
+            surface = PremiumSurface.from_arrays(
+                scalars[i], grid_premiums[i], grid_slopes[i])
+        # Keep the block mapped for as long as the surface is in use
+        surface.shared_memory = shared_memory
+        premium_cache.add_surface(date, surface)
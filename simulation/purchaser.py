@@ -21,12 +21,17 @@ class Purchaser:
         # Statistics
         self.profit = 0
 
-    def start_epoch(self, date: datetime) -> None:
-        """Attempts to purchase a random call option from the option pool."""
+    def start_epoch(self, date: datetime, value: float = None) -> None:
+        """Attempts to purchase a random call option from the option pool. The
+        strike range value is drawn from the distribution unless a pre-drawn
+        value is given.
+        """
+        if value is None:
+            value = self.generate_random_strike_range_value()
         premium = self.option_pool.purchase_call_option(
             date,
             self.id,
-            self.generate_random_strike_range_value()
+            value
         )
         if premium != -1:
             self.profit -= premium
@@ -0,0 +1,506 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from data_classes.distribution import (Distribution, PurchaserDistribution,
+                                       get_frozen_distribution,
+                                       get_inverse_cdf_table)
+from data_classes.replication_result import ReplicationResult
+from data_classes.sampling_method import SamplingMethod
+from data_classes.simulation_config import SimulationConfig
+from data_classes.simulation_engine import SimulationEngine
+from simulation.expected_value import ExpectedValueSimulation
+from simulation.instrumentation import Instrumentation
+from simulation.option_pool import EPOCH_TENORS, OptionPool
+from simulation.premium_surface import (PremiumSurfaceCache,
+                                        SharedPremiumSurfaces,
+                                        SharedPremiumSurfacesHandle,
+                                        attach_premium_surfaces)
+from simulation.simulation import Simulation
+from utils.csv_processor import CSVProcessor
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Epoch statistics collected from every replication
+EPOCH_METRICS = ("total_value_locked", "total_profit", "total_lp_profit")
+
+# Premium surface caches of this process, by premium cache key (see
+# get_premium_cache_key)
+premium_caches = {}
+
+# Handles of the premium surfaces shared with this worker process by the
+# process that started it, by premium cache key. Each cache attaches its
+# surfaces on its next use.
+shared_premium_surface_handles = {}
+
+
+@lru_cache(maxsize=None)
+def load_csv_processor(data_file: str) -> CSVProcessor:
+    """Returns the market data of the file, loaded once per process."""
+    return CSVProcessor(data_file)
+
+
+@lru_cache(maxsize=16)
+def load_epoch_rows(
+    data_file: str,
+    epoch_dates: Tuple[datetime, ...],
+    chunk_size: int
+) -> CSVProcessor:
+    """Returns the market data of the epoch dates' rows of the file, streamed
+    once per process.
+    """
+    return CSVProcessor.from_epoch_rows(data_file, epoch_dates, chunk_size)
+
+
+def load_market_data(config: SimulationConfig) -> CSVProcessor:
+    """Returns the market data of the configuration: the whole data file, or
+    only the rows of its epoch dates if it streams the file in chunks.
+    """
+    if config.market_data_chunk_size is None:
+        return load_csv_processor(config.data_file)
+    return load_epoch_rows(
+        config.data_file,
+        config.epoch_dates,
+        config.market_data_chunk_size
+    )
+
+
+def get_premium_cache_key(config: SimulationConfig) -> tuple:
+    """Returns the key of the premium surface cache of the configuration:
+    its market data, strike band, grid size and epoch length. Market data
+    streamed for the epoch dates only has their rows, so its caches are not
+    shared with configurations of other dates.
+    """
+    return (
+        config.data_file,
+        config.strike_band,
+        config.premium_grid_size,
+        config.epoch_length,
+        config.epoch_dates if config.market_data_chunk_size is not None
+        else None
+    )
+
+
+def get_premium_cache(
+    config: SimulationConfig,
+    csv_processor: CSVProcessor
+) -> PremiumSurfaceCache:
+    """Returns the process's premium surface cache for the configuration,
+    created on first use with the given market data of the configuration.
+    """
+    key = get_premium_cache_key(config)
+    premium_cache = premium_caches.get(key)
+    if premium_cache is None:
+        premium_cache = PremiumSurfaceCache(
+            csv_processor,
+            config.strike_band,
+            config.premium_grid_size,
+            tenor=EPOCH_TENORS[config.epoch_length]
+        )
+        premium_caches[key] = premium_cache
+    handle = shared_premium_surface_handles.pop(key, None)
+    if handle is not None:
+        try:
+            attach_premium_surfaces(handle, premium_cache)
+        except FileNotFoundError:
+            # The owner closed the block before this worker used it, so
+            # the cache builds the surfaces itself
+            pass
+    return premium_cache
+
+
+def set_shared_premium_surfaces(
+    handles: Dict[tuple, SharedPremiumSurfacesHandle]
+) -> None:
+    """Makes the worker's premium caches attach the shared surfaces of the
+    handles, by premium cache key, on their next use. Can be used as the
+    initializer of a process pool.
+    """
+    shared_premium_surface_handles.update(handles)
+
+
+class SharedPremiumCaches:
+    """Shared memory copies of the premium caches of the configurations, as
+    preload_dependencies filled them, for worker processes that do not
+    inherit this process's caches, e.g. spawned ones. Workers attach them
+    through set_shared_premium_surfaces. The creating process owns the
+    blocks and must close them (or use it as a context manager).
+    """
+
+    def __init__(self, configs: Sequence[SimulationConfig]) -> None:
+        self.shared_surfaces = {}
+        try:
+            for config in configs:
+                key = get_premium_cache_key(config)
+                if key not in self.shared_surfaces:
+                    self.shared_surfaces[key] = SharedPremiumSurfaces(
+                        get_premium_cache(config, load_market_data(config)))
+        except BaseException:
+            self.close()
+            raise
+        self.handles = {
+            key: shared_surfaces.handle
+            for key, shared_surfaces in self.shared_surfaces.items()
+        }
+
+    def close(self) -> None:
+        for shared_surfaces in self.shared_surfaces.values():
+            shared_surfaces.close()
+
+    def __enter__(self) -> 'SharedPremiumCaches':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def create_simulation(
+    config: SimulationConfig,
+    csv_processor: CSVProcessor,
+    seed: int or np.random.SeedSequence = None,
+    instrumentation: Instrumentation = None,
+    is_antithetic: bool = False
+) -> Simulation or ExpectedValueSimulation:
+    """Returns the simulation of the configuration. The expected value
+    engine is deterministic, so it ignores the seed and the sampling method,
+    and it has no actors to instrument.
+    """
+    if config.engine == SimulationEngine.EXPECTED_VALUE:
+        return ExpectedValueSimulation(
+            csv_processor,
+            config.num_liquidity_providers,
+            config.num_purchasers,
+            list(config.epoch_dates),
+            Distribution(config.purchaser_distribution),
+            Distribution(config.lp_distribution),
+            config.asset,
+            strike_band=config.strike_band,
+            epoch_length=config.epoch_length
+        )
+    return Simulation(
+        csv_processor,
+        config.num_liquidity_providers,
+        config.num_purchasers,
+        list(config.epoch_dates),
+        Distribution(config.purchaser_distribution),
+        Distribution(config.lp_distribution),
+        config.asset,
+        engine=config.engine,
+        seed=seed,
+        strike_band=config.strike_band,
+        instrumentation=instrumentation,
+        premium_cache=get_premium_cache(config, csv_processor),
+        sampling=config.sampling,
+        is_antithetic=is_antithetic,
+        epoch_length=config.epoch_length
+    )
+
+
+def preload_dependencies(configs: Sequence[SimulationConfig]) -> None:
+    """Imports the dependencies that the simulation core loads on first use
+    and the configurations need, and builds their premium surfaces, so that
+    forked worker processes inherit them instead of each importing or
+    building them again. Other workers get the surfaces through
+    SharedPremiumCaches.
+    """
+    import scipy.special  # noqa: F401
+    for config in configs:
+        if config.purchaser_distribution != PurchaserDistribution.UNIFORM:
+            get_frozen_distribution(config.purchaser_distribution)
+            if config.sampling != SamplingMethod.RANDOM:
+                get_inverse_cdf_table(config.purchaser_distribution)
+        if config.sampling == SamplingMethod.SOBOL:
+            import scipy.stats.qmc  # noqa: F401
+        get_premium_cache(
+            config,
+            load_market_data(config)
+        ).precompute(config.epoch_dates[:-1])
+
+
+def get_epoch_values(option_pool: OptionPool) -> np.ndarray:
+    """Returns the epoch statistics of the option pool as an epoch x metric
+    array.
+    """
+    epoch_columns = option_pool.get_epoch_columns()
+    return np.column_stack([
+        epoch_columns[metric] for metric in EPOCH_METRICS
+    ]).reshape(-1, len(EPOCH_METRICS))
+
+
+def run_replication(
+    config: SimulationConfig,
+    seed: np.random.SeedSequence,
+    is_antithetic: bool = False
+) -> np.ndarray:
+    """Runs one replication of the configuration and returns its epoch x
+    metric statistics.
+    """
+    simulation = create_simulation(
+        config,
+        load_market_data(config),
+        seed,
+        is_antithetic=is_antithetic
+    )
+    return get_epoch_values(simulation.run())
+
+
+def get_independent_samples(
+    values: np.ndarray,
+    is_antithetic: bool = False
+) -> np.ndarray:
+    """Returns the replications' values as independent samples: the values
+    themselves, or the means of the antithetic pairs, which are correlated
+    within a pair.
+    """
+    if is_antithetic:
+        return values.reshape(-1, 2, *values.shape[1:]).mean(axis=1)
+    return values
+
+
+def calculate_half_width(
+    samples: np.ndarray,
+    confidence: float
+) -> np.ndarray:
+    """Returns the half width of the confidence interval of the mean of
+    independent samples.
+    """
+    from scipy.stats import t
+
+    num_samples = samples.shape[0]
+    if num_samples < 2:
+        return np.full(samples.shape[1:], np.nan)
+    return t.ppf((1 + confidence) / 2, num_samples - 1) * \
+        samples.std(axis=0, ddof=1) / np.sqrt(num_samples)
+
+
+def summarize_replications(
+    values: np.ndarray,
+    start_dates: List[str],
+    confidence: float = 0.95,
+    quantiles: Sequence[float] = (0.05, 0.5, 0.95),
+    is_antithetic: bool = False,
+    independent_values: np.ndarray = None
+) -> 'pd.DataFrame':
+    """Returns the per-epoch mean, standard deviation, quantiles and
+    confidence interval of the mean of every metric, as one row per epoch
+    and metric.
+
+    With is_antithetic, consecutive replications are antithetic pairs and
+    the confidence interval comes from the means of the pairs. The
+    variance_reduction column is the variance of the mean of as many
+    independent replications, estimated from independent_values, over the
+    variance of the mean of these replications; it is NaN without
+    independent_values.
+    """
+    import pandas as pd
+
+    num_replications = values.shape[0]
+    mean = values.mean(axis=0)
+    if num_replications > 1:
+        std = values.std(axis=0, ddof=1)
+    else:
+        std = np.full(mean.shape, np.nan)
+    half_width = calculate_half_width(
+        get_independent_samples(values, is_antithetic), confidence)
+    quantile_values = np.quantile(values, quantiles, axis=0)
+
+    variance_reduction = np.full(mean.shape, np.nan)
+    if independent_values is not None and num_replications > 1:
+        samples = get_independent_samples(values, is_antithetic)
+        if len(samples) > 1:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                variance_reduction = \
+                    independent_values.var(axis=0, ddof=1) / \
+                    num_replications / \
+                    (samples.var(axis=0, ddof=1) / len(samples))
+
+    columns = {
+        "start_date": np.repeat(start_dates, len(EPOCH_METRICS)),
+        "metric": np.tile(EPOCH_METRICS, len(start_dates)),
+        "mean": mean.ravel(),
+        "std": std.ravel(),
+        "ci_low": (mean - half_width).ravel(),
+        "ci_high": (mean + half_width).ravel(),
+        "variance_reduction": variance_reduction.ravel(),
+    }
+    for quantile, quantile_value in zip(quantiles, quantile_values):
+        columns["q%g" % (100 * quantile)] = quantile_value.ravel()
+    return pd.DataFrame(columns)
+
+
+def summarize_differences(
+    values: np.ndarray,
+    other_values: np.ndarray,
+    start_dates: List[str],
+    confidence: float = 0.95,
+    is_antithetic: bool = False
+) -> 'pd.DataFrame':
+    """Returns the per-epoch mean difference of every metric between two
+    sets of replications run on the same seeds, e.g. of two purchaser
+    distributions, with the confidence interval of the mean difference, as
+    one row per epoch and metric.
+
+    The variance_reduction column is the variance of the difference of
+    independent runs over that of the paired runs, i.e. the reduction from
+    common random numbers, which is largest when both draw their values
+    through the inverse CDF (any sampling method but RANDOM).
+    """
+    import pandas as pd
+
+    samples = get_independent_samples(values, is_antithetic)
+    other_samples = get_independent_samples(other_values, is_antithetic)
+    differences = samples - other_samples
+    mean = differences.mean(axis=0)
+    half_width = calculate_half_width(differences, confidence)
+    if len(samples) > 1:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance_reduction = (
+                samples.var(axis=0, ddof=1) +
+                other_samples.var(axis=0, ddof=1)
+            ) / differences.var(axis=0, ddof=1)
+    else:
+        variance_reduction = np.full(mean.shape, np.nan)
+
+    return pd.DataFrame({
+        "start_date": np.repeat(start_dates, len(EPOCH_METRICS)),
+        "metric": np.tile(EPOCH_METRICS, len(start_dates)),
+        "mean_difference": mean.ravel(),
+        "ci_low": (mean - half_width).ravel(),
+        "ci_high": (mean + half_width).ravel(),
+        "variance_reduction": variance_reduction.ravel(),
+    })
+
+
+def spawn_seeds(
+    seed: int or np.random.SeedSequence,
+    num_replications: int
+) -> Tuple[np.random.SeedSequence, List[np.random.SeedSequence]]:
+    """Returns the root SeedSequence and one independent child per
+    replication. Replication i always gets child i.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed, seed.spawn(num_replications)
+
+
+def spawn_replication_seeds(
+    seed: int or np.random.SeedSequence,
+    num_replications: int,
+    sampling: SamplingMethod = SamplingMethod.RANDOM
+) -> Tuple[np.random.SeedSequence, List[np.random.SeedSequence], List[bool]]:
+    """Returns the root SeedSequence, and the stream of every replication
+    and whether it mirrors the uniforms of its stream. With antithetic
+    sampling, replications 2k and 2k + 1 share child k and the second
+    mirrors the first; otherwise replication i gets child i.
+    """
+    if sampling != SamplingMethod.ANTITHETIC:
+        root_seed, seeds = spawn_seeds(seed, num_replications)
+        return root_seed, seeds, [False] * num_replications
+    if num_replications % 2:
+        raise ValueError(
+            "Antithetic sampling needs an even number of replications")
+    root_seed, seeds = spawn_seeds(seed, num_replications // 2)
+    return (
+        root_seed,
+        [seed for seed in seeds for _ in range(2)],
+        [False, True] * (num_replications // 2)
+    )
+
+
+def run_replication_values(
+    config: SimulationConfig,
+    seeds: List[np.random.SeedSequence],
+    is_antithetic: List[bool],
+    num_workers: int = 1
+) -> np.ndarray:
+    """Runs a replication of the configuration per seed across a process
+    pool and returns their replication x epoch x metric statistics.
+    """
+    if num_workers > 1:
+        preload_dependencies([config])
+        with SharedPremiumCaches([config]) as shared_premium_caches, \
+                ProcessPoolExecutor(
+                    max_workers=num_workers,
+                    initializer=set_shared_premium_surfaces,
+                    initargs=(shared_premium_caches.handles,)
+                ) as executor:
+            values = list(executor.map(
+                run_replication,
+                [config] * len(seeds),
+                seeds,
+                is_antithetic,
+                chunksize=max(1, len(seeds) // (4 * num_workers))
+            ))
+    else:
+        values = [
+            run_replication(config, seed, is_mirrored)
+            for seed, is_mirrored in zip(seeds, is_antithetic)
+        ]
+    return np.stack(values)
+
+
+def run_replications(
+    config: SimulationConfig,
+    num_replications: int,
+    seed: int or np.random.SeedSequence = None,
+    num_workers: int = 1,
+    confidence: float = 0.95,
+    quantiles: Sequence[float] = (0.05, 0.5, 0.95),
+    num_baseline_replications: int = 0
+) -> ReplicationResult:
+    """Runs replications of the configuration across a process pool and
+    aggregates their epoch statistics.
+
+    Each replication draws from its own stream spawned from the root seed
+    (or shares it with its antithetic pair), so the results for a given
+    root seed are identical for any number of workers.
+
+    The replications of random and inverse CDF sampling are independent, so
+    their variance reduction is 1. For the other sampling methods, it is
+    measured against num_baseline_replications additional independent
+    replications with random sampling, on streams spawned after those of the
+    replications; antithetic sampling estimates it from its own
+    replications without them, and Sobol sampling reports NaN.
+
+    The expected value engine is deterministic, so it runs once whatever
+    the number of replications, without baseline replications.
+    """
+    sampling = config.sampling
+    if config.engine == SimulationEngine.EXPECTED_VALUE:
+        num_replications, num_baseline_replications = 1, 0
+        sampling = SamplingMethod.RANDOM
+    root_seed, seeds, is_antithetic = spawn_replication_seeds(
+        seed, num_replications, sampling)
+    values = run_replication_values(config, seeds, is_antithetic, num_workers)
+
+    if num_baseline_replications > 0:
+        independent_values = run_replication_values(
+            replace(config, sampling=SamplingMethod.RANDOM),
+            root_seed.spawn(num_baseline_replications),
+            [False] * num_baseline_replications,
+            num_workers
+        )
+    elif sampling != SamplingMethod.SOBOL:
+        independent_values = values
+    else:
+        independent_values = None
+
+    start_dates = [str(date.date()) for date in config.epoch_dates[:-1]]
+    return ReplicationResult(
+        config,
+        root_seed.entropy,
+        values,
+        summarize_replications(
+            values,
+            start_dates,
+            confidence,
+            quantiles,
+            sampling == SamplingMethod.ANTITHETIC,
+            independent_values
+        )
+    )
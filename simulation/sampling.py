@@ -0,0 +1,76 @@
+import numpy as np
+
+from data_classes.distribution import Distribution
+from data_classes.sampling_method import SamplingMethod
+
+
+class Sampler:
+    """Draws the values of a simulation's actors from their distributions
+    with a sampling method, from the simulation's random number generator.
+
+    RANDOM draws as the distributions do themselves. The other methods draw
+    one uniform per value and map it through the distribution's inverse CDF,
+    so every distribution consumes the generator identically: simulations of
+    different distributions with the same seed see the same uniforms (common
+    random numbers), which correlates them and reduces the variance of their
+    differences. ANTITHETIC simulations mirror the uniforms of the
+    simulation with the same seed (1 - u), and SOBOL maps the points of a
+    scrambled Sobol sequence, which spread the values of each batch evenly
+    over the distribution.
+    """
+
+    def __init__(
+        self,
+        rng: np.random.Generator,
+        method: SamplingMethod = SamplingMethod.RANDOM,
+        is_antithetic: bool = False
+    ) -> None:
+        if is_antithetic and method != SamplingMethod.ANTITHETIC:
+            raise ValueError("Only antithetic sampling can be mirrored")
+        self.rng = rng
+        self.method = method
+        self.is_antithetic = is_antithetic
+
+    def generate_uniforms(self, n: int) -> np.ndarray:
+        if self.method == SamplingMethod.SOBOL:
+            from scipy.stats import qmc
+
+            # The first n points of a sequence of 2^m, which keep their
+            # balance properties as well as a prefix can. The scrambling is
+            # seeded with a draw from the generator, since a Generator given
+            # to Sobol would be spawned from, which its state (and so a
+            # checkpoint) does not capture.
+            sobol = qmc.Sobol(
+                1, scramble=True, seed=int(self.rng.integers(2**63)))
+            return sobol.random_base2((n - 1).bit_length())[:n, 0]
+        uniforms = self.rng.random(n)
+        if self.is_antithetic:
+            return 1 - uniforms
+        return uniforms
+
+    def generate_values(
+        self,
+        distribution: Distribution,
+        n: int
+    ) -> np.ndarray:
+        """Returns n values in [0, 1] of the purchaser distribution (see
+        Distribution.generate_values).
+        """
+        if self.method == SamplingMethod.RANDOM:
+            return distribution.generate_values(n, self.rng)
+        return distribution.get_values(self.generate_uniforms(n))
+
+    def generate_ranged_values(
+        self,
+        distribution: Distribution,
+        n: int,
+        low: float,
+        high: float
+    ) -> np.ndarray:
+        """Returns n values in [low, high] of the liquidity provider
+        distribution (see Distribution.generate_ranged_values).
+        """
+        if self.method == SamplingMethod.RANDOM:
+            return distribution.generate_ranged_values(n, low, high, self.rng)
+        return distribution.get_ranged_values(
+            self.generate_uniforms(n), low, high)
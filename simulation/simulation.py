@@ -1,16 +1,102 @@
-from datetime import datetime
-import random
-from typing import List
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Iterator, List, Tuple
+
+import numpy as np
 
 from data_classes.distribution import Distribution
+from data_classes.epoch import Epoch
+from data_classes.epoch_length import EpochLength
+from data_classes.pool_snapshot import PoolSnapshot
+from data_classes.sampling_method import SamplingMethod
+from data_classes.simulation_engine import SimulationEngine
 from data_classes.underlying_asset import UnderlyingAsset
-from simulation.liquidity_provider import LiquidityProvider
-from simulation.option_pool import OptionPool
+from simulation.instrumentation import (Instrumentation,
+                                        InstrumentedCSVProcessor,
+                                        InstrumentedOptionPool, null_phase)
+from simulation.liquidity_provider import (DEPOSIT_RANGE, WITHDRAW_RANGE,
+                                           LiquidityProvider)
+from simulation.option_pool import EPOCH_TENORS, OptionPool
 from simulation.purchaser import Purchaser
+from simulation.sampling import Sampler
+from simulation.vectorized_actors import VectorizedActors
 from utils.csv_processor import CSVProcessor
 
+if TYPE_CHECKING:
+    from simulation.premium_surface import PremiumSurfaceCache
+
+# Epoch lengths of a fixed duration; monthly epochs follow the calendar
+EPOCH_TIMEDELTAS = {
+    EpochLength.DAILY: timedelta(days=1),
+    EpochLength.WEEKLY: timedelta(days=7)
+}
+
+
+def add_months(start: datetime, num_months: int) -> datetime:
+    """Returns the date num_months calendar months after start, on the last
+    day of the month if the month is shorter than start's day.
+    """
+    year, month = divmod(start.month - 1 + num_months, 12)
+    year += start.year
+    day = min(start.day, monthrange(year, month + 1)[1])
+    return start.replace(year=year, month=month + 1, day=day)
+
+
+def get_num_epochs_between(
+    start_date: date,
+    end_date: date,
+    epoch_length: EpochLength = EpochLength.WEEKLY
+) -> int:
+    """Returns the number of whole epochs from start_date to end_date."""
+    if epoch_length != EpochLength.MONTHLY:
+        return max((end_date - start_date) // EPOCH_TIMEDELTAS[epoch_length], 0)
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date, datetime.min.time())
+    num_months = (end.year - start.year) * 12 + end.month - start.month
+    if add_months(start, num_months) > end:
+        num_months -= 1
+    return max(num_months, 0)
+
+
+def create_epoch_dates(
+    start_date: date,
+    num_epochs: int,
+    epoch_length: EpochLength or timedelta = EpochLength.WEEKLY
+) -> List[datetime]:
+    """Returns the num_epochs + 1 boundary dates of consecutive epochs."""
+    start = datetime.combine(start_date, datetime.min.time())
+    if epoch_length == EpochLength.MONTHLY:
+        return [add_months(start, i) for i in range(num_epochs + 1)]
+    epoch_length = EPOCH_TIMEDELTAS.get(epoch_length, epoch_length)
+    return [start + epoch_length * i for i in range(num_epochs + 1)]
+
 
 class Simulation:
+    """Simulates liquidity providers and purchasers interacting with an option
+    pool over a sequence of epochs.
+
+    Every epoch draws from the random stream in the same order, regardless of
+    the engine: the order of actors at the start of the epoch, the liquidity
+    providers' deposit values, the purchasers' strike range values, the order
+    of actors at the end of the epoch and the liquidity providers' withdraw
+    values. Both engines therefore produce the same statistics (up to
+    floating-point rounding) for the same seed. The values are drawn with
+    the sampling method (see Sampler); is_antithetic mirrors the uniforms of
+    antithetic sampling.
+
+    If an Instrumentation is given, the simulation records the time spent in
+    each phase of every epoch and counts purchases, exercises, withdrawals and
+    market data lookups in it.
+
+    If a PremiumSurfaceCache is given, the option pool prices its options
+    from the cache's premium surfaces, which may be shared with other
+    simulations of the same market data and strike band.
+
+    The options purchased at the start of an epoch expire at its end, so
+    they are priced with the tenor of the epoch length (see EPOCH_TENORS).
+    The epoch dates must be epoch_length apart (see create_epoch_dates).
+    """
+
     def __init__(
         self,
         csv_processor: CSVProcessor,
@@ -19,15 +105,65 @@ class Simulation:
         epoch_dates: List[datetime],
         purchaser_distribution: Distribution,
         lp_distribution: Distribution,
-        asset: UnderlyingAsset
+        asset: UnderlyingAsset,
+        engine: SimulationEngine = SimulationEngine.OBJECT,
+        seed: int or np.random.SeedSequence = None,
+        strike_band: float = 0.5,
+        instrumentation: Instrumentation = None,
+        premium_cache: 'PremiumSurfaceCache' = None,
+        sampling: SamplingMethod = SamplingMethod.RANDOM,
+        is_antithetic: bool = False,
+        epoch_length: EpochLength = EpochLength.WEEKLY
     ) -> None:
+        if engine == SimulationEngine.EXPECTED_VALUE:
+            raise ValueError(
+                "The expected value engine has no actors to simulate, use "
+                "ExpectedValueSimulation (or create_simulation) instead")
+        if instrumentation is not None:
+            csv_processor = InstrumentedCSVProcessor(
+                csv_processor, instrumentation)
         self.csv_processor = csv_processor
+        self.num_liquidity_providers = num_liquidity_providers
+        self.num_purchasers = num_purchasers
         self.epoch_dates = epoch_dates
         self.purchaser_distribution = purchaser_distribution
         self.lp_distribution = lp_distribution
         self.asset = asset
-        self.option_pool = OptionPool(csv_processor, purchaser_distribution)
+        self.engine = engine
+        self.epoch_length = epoch_length
+        self.rng = np.random.default_rng(seed)
+        self.sampler = Sampler(self.rng, sampling, is_antithetic)
+        self.instrumentation = instrumentation
+        if instrumentation is None:
+            self.option_pool = OptionPool(
+                csv_processor,
+                purchaser_distribution,
+                strike_band,
+                premium_cache,
+                EPOCH_TENORS[epoch_length]
+            )
+        else:
+            self.option_pool = InstrumentedOptionPool(
+                csv_processor,
+                purchaser_distribution,
+                strike_band,
+                instrumentation,
+                premium_cache,
+                EPOCH_TENORS[epoch_length]
+            )
         self.actors = []
+        self.vectorized_actors = None
+        self.num_epochs_run = 0
+
+        if engine == SimulationEngine.VECTORIZED:
+            self.vectorized_actors = VectorizedActors(
+                self.csv_processor,
+                self.option_pool,
+                num_liquidity_providers,
+                num_purchasers,
+                self.asset
+            )
+            return
 
         # Create liquidity providers
         for i in range(num_liquidity_providers):
@@ -49,24 +185,99 @@ class Simulation:
 
     def run(self) -> OptionPool:
         # Run simulation
-        for i in range(0, len(self.epoch_dates) - 1):
-            start_date = self.epoch_dates[i]
-            end_date = self.epoch_dates[i + 1]
+        for _ in self.iter_epochs():
+            pass
+        return self.option_pool
 
+    def extend_epochs(self, epoch_dates: List[datetime]) -> None:
+        """Appends later epoch dates, so that the next run continues from the
+        last epoch run instead of starting over.
+        """
+        if epoch_dates and self.epoch_dates and \
+                epoch_dates[0] <= self.epoch_dates[-1]:
+            raise ValueError("Epoch dates must be after the last epoch date")
+        self.epoch_dates = list(self.epoch_dates) + list(epoch_dates)
+
+    def iter_epochs(self) -> Iterator[Tuple[Epoch, PoolSnapshot]]:
+        """Runs the remaining epochs one at a time, yielding each finished
+        epoch and a snapshot of the option pool as soon as it is done.
+        """
+        while self.num_epochs_run < len(self.epoch_dates) - 1:
+            self.run_epoch(
+                self.epoch_dates[self.num_epochs_run],
+                self.epoch_dates[self.num_epochs_run + 1]
+            )
+            self.num_epochs_run += 1
+            yield self.option_pool.epochs[-1], self.option_pool.get_snapshot()
+
+    def run_epoch(self, start_date: datetime, end_date: datetime) -> None:
+        num_actors = self.num_liquidity_providers + self.num_purchasers
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            phase = null_phase
+        else:
+            phase = instrumentation.phase
+            instrumentation.start_epoch()
+            instrumentation.count("purchases_attempted", self.num_purchasers)
+
+        with phase("statistics"):
             self.option_pool.initialize_epoch_statistics(start_date)
 
-            # Each actor takes an action at the start of the epoch
-            random.shuffle(self.actors)
-            for actor in self.actors:
-                actor.start_epoch(start_date)
+        # Each actor takes an action at the start of the epoch
+        with phase("sampling"):
+            order = self.rng.permutation(num_actors)
+            deposit_values = self.sampler.generate_ranged_values(
+                self.lp_distribution,
+                self.num_liquidity_providers,
+                *DEPOSIT_RANGE
+            )
+            strike_range_values = self.sampler.generate_values(
+                self.purchaser_distribution,
+                self.num_purchasers
+            )
+        with phase("start_epoch"):
+            if self.engine == SimulationEngine.VECTORIZED:
+                self.vectorized_actors.start_epoch(
+                    start_date,
+                    order,
+                    deposit_values,
+                    strike_range_values
+                )
+            else:
+                values = np.concatenate((deposit_values, strike_range_values))
+                for j in order:
+                    self.actors[j].start_epoch(start_date, values[j])
+        with phase("risk"):
+            self.option_pool.calculate_risk_statistics(start_date)
 
-            # Each actor takes an action at the end of the epoch
-            random.shuffle(self.actors)
-            for actor in self.actors:
-                actor.end_epoch(end_date)
+        # Each actor takes an action at the end of the epoch
+        with phase("sampling"):
+            order = self.rng.permutation(num_actors)
+            withdraw_values = self.sampler.generate_ranged_values(
+                self.lp_distribution,
+                self.num_liquidity_providers,
+                *WITHDRAW_RANGE
+            )
+        with phase("end_epoch"):
+            if self.engine == SimulationEngine.VECTORIZED:
+                self.vectorized_actors.end_epoch(
+                    end_date,
+                    order,
+                    withdraw_values
+                )
+            else:
+                for j in order:
+                    if j < self.num_liquidity_providers:
+                        self.actors[j].end_epoch(end_date, withdraw_values[j])
+                    else:
+                        self.actors[j].end_epoch(end_date)
 
+        with phase("unlock_underlying_assets"):
             self.option_pool.unlock_underlying_assets()
+        with phase("convert_usdt_to_underlying_asset"):
             self.option_pool.convert_usdt_to_underlying_asset(end_date)
+        with phase("statistics"):
             self.option_pool.calculate_epoch_statistics()
 
-        return self.option_pool
+        if instrumentation is not None:
+            instrumentation.end_epoch(start_date)
@@ -0,0 +1,228 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import fields, replace
+from enum import Enum
+from itertools import product
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from data_classes.sampling_method import SamplingMethod
+from data_classes.simulation_config import SimulationConfig
+from data_classes.simulation_engine import SimulationEngine
+from simulation.premium_surface import SharedPremiumSurfacesHandle
+from simulation.replication import (EPOCH_METRICS, SharedPremiumCaches,
+                                    create_simulation, get_epoch_values,
+                                    load_csv_processor, load_market_data,
+                                    preload_dependencies,
+                                    set_shared_premium_surfaces, spawn_seeds)
+from simulation.simulation import create_epoch_dates
+from utils.shared_market_data import (SharedMarketData,
+                                      SharedMarketDataHandle,
+                                      attach_market_data)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Market data attached by each sweep worker, by data file
+worker_csv_processors = {}
+
+
+def create_sweep_cells(
+    base_config: SimulationConfig,
+    grid: Dict[str, Sequence[Any]]
+) -> List[Tuple[Dict[str, Any], SimulationConfig]]:
+    """Returns the parameters and configuration of every cell of the
+    cartesian product of the grid. Grid keys are SimulationConfig fields, or
+    first_epoch_date and num_epochs, which replace the base config's epoch
+    dates. Sweeping epoch_length also recreates the epoch dates.
+    """
+    config_fields = {field.name for field in fields(SimulationConfig)}
+    for key in grid:
+        if key not in config_fields | {"first_epoch_date", "num_epochs"}:
+            raise ValueError("Unknown sweep parameter: " + key)
+
+    cells = []
+    for values in product(*grid.values()):
+        parameters = dict(zip(grid.keys(), values))
+        changes = {
+            key: value for key, value in parameters.items()
+            if key in config_fields
+        }
+        if parameters.keys() & {
+                "first_epoch_date", "num_epochs", "epoch_length"}:
+            changes["epoch_dates"] = tuple(create_epoch_dates(
+                parameters.get(
+                    "first_epoch_date", base_config.epoch_dates[0]),
+                parameters.get(
+                    "num_epochs", len(base_config.epoch_dates) - 1),
+                parameters.get("epoch_length", base_config.epoch_length)
+            ))
+        cells.append((parameters, replace(base_config, **changes)))
+    return cells
+
+
+def initialize_worker(
+    handles: Dict[str, SharedMarketDataHandle],
+    premium_surface_handles: Dict[tuple, SharedPremiumSurfacesHandle]
+) -> None:
+    for data_file, handle in handles.items():
+        worker_csv_processors[data_file] = attach_market_data(handle)
+    set_shared_premium_surfaces(premium_surface_handles)
+
+
+def run_cell(
+    cell: int,
+    parameters: Dict[str, Any],
+    config: SimulationConfig,
+    seed: np.random.SeedSequence,
+    is_antithetic: bool = False,
+    replication: int = None
+) -> 'pd.DataFrame':
+    csv_processor = None
+    if config.market_data_chunk_size is None:
+        csv_processor = worker_csv_processors.get(config.data_file)
+    if csv_processor is None:
+        csv_processor = load_market_data(config)
+    return get_cell_table(
+        cell,
+        parameters,
+        config,
+        get_epoch_values(create_simulation(
+            config,
+            csv_processor,
+            seed,
+            is_antithetic=is_antithetic and
+            config.sampling == SamplingMethod.ANTITHETIC
+        ).run()),
+        replication
+    )
+
+
+def get_cell_table(
+    cell: int,
+    parameters: Dict[str, Any],
+    config: SimulationConfig,
+    values: np.ndarray,
+    replication: int = None
+) -> 'pd.DataFrame':
+    """Returns the epoch statistics of a cell as one row per epoch, with a
+    column per sweep parameter, and a replication column if given one.
+    """
+    import pandas as pd
+
+    table = pd.DataFrame(values, columns=EPOCH_METRICS)
+    table.insert(0, "start_date", [
+        str(date.date()) for date in config.epoch_dates[:len(values)]
+    ])
+    for i, (key, value) in enumerate(parameters.items()):
+        if isinstance(value, Enum):
+            value = value.name
+        table.insert(i, key, [value] * len(table))
+    if replication is not None:
+        table.insert(0, "replication", replication)
+    table.insert(0, "cell", cell)
+    return table
+
+
+def iter_sweep(
+    base_config: SimulationConfig,
+    grid: Dict[str, Sequence[Any]],
+    seed: int or np.random.SeedSequence = None,
+    num_workers: int = 1,
+    is_antithetic: bool = False,
+    replications: Sequence[Tuple[np.random.SeedSequence, bool]] = None
+) -> Iterator['pd.DataFrame']:
+    """Runs every cell of the grid over a process pool and yields each cell's
+    table as soon as it finishes. Each data file is parsed once and shared
+    with the workers read-only through shared memory, as are the premium
+    surfaces of the cells. Cell i always uses the i-th stream spawned from
+    the seed, so results do not depend on the number of workers. With
+    is_antithetic, the cells with antithetic sampling mirror the uniforms of
+    their streams.
+
+    Given replications, the (seed, is_antithetic) pairs of the replications
+    of the whole sweep, every cell of every replication runs in the same
+    pool instead, on the streams spawned from the replication's seed, and
+    the tables have a replication column. Cells of the expected value
+    engine are deterministic, so they only run in the first replication.
+    """
+    cells = create_sweep_cells(base_config, grid)
+    tasks = []
+    for replication, (replication_seed, is_mirrored) in enumerate(
+            replications or [(seed, is_antithetic)]):
+        _, seeds = spawn_seeds(replication_seed, len(cells))
+        tasks.extend(
+            (
+                i,
+                parameters,
+                config,
+                cell_seed,
+                is_mirrored,
+                replication if replications is not None else None
+            )
+            for i, ((parameters, config), cell_seed) in enumerate(
+                zip(cells, seeds))
+            if replication == 0 or
+            config.engine != SimulationEngine.EXPECTED_VALUE
+        )
+    if num_workers <= 1:
+        for task in tasks:
+            yield run_cell(*task)
+        return
+
+    # The workers build their tables with pandas
+    import pandas  # noqa: F401
+    preload_dependencies([config for _, config in cells])
+    # Streamed market data only has the rows of a cell's epoch dates, so
+    # each worker streams its own
+    data_files = sorted({
+        config.data_file for _, config in cells
+        if config.market_data_chunk_size is None
+    })
+    shared_market_data = {}
+    shared_premium_caches = None
+    try:
+        for data_file in data_files:
+            shared_market_data[data_file] = SharedMarketData(
+                load_csv_processor(data_file))
+        handles = {
+            data_file: market_data.handle
+            for data_file, market_data in shared_market_data.items()
+        }
+        shared_premium_caches = SharedPremiumCaches(
+            [config for _, config in cells])
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=initialize_worker,
+            initargs=(handles, shared_premium_caches.handles)
+        ) as executor:
+            futures = [executor.submit(run_cell, *task) for task in tasks]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        for market_data in shared_market_data.values():
+            market_data.close()
+        if shared_premium_caches is not None:
+            shared_premium_caches.close()
+
+def run_sweep(
+    base_config: SimulationConfig,
+    grid: Dict[str, Sequence[Any]],
+    seed: int or np.random.SeedSequence = None,
+    num_workers: int = 1,
+    is_antithetic: bool = False,
+    replications: Sequence[Tuple[np.random.SeedSequence, bool]] = None
+) -> 'pd.DataFrame':
+    """Runs every cell of the grid (of every replication, see iter_sweep)
+    and returns one tidy table of the epoch statistics of all cells, ordered
+    by replication and cell.
+    """
+    import pandas as pd
+
+    tables = list(iter_sweep(
+        base_config, grid, seed, num_workers, is_antithetic, replications))
+    order = ["cell", "start_date"]
+    if replications is not None:
+        order.insert(0, "replication")
+    return pd.concat(tables).sort_values(
+        order, kind="stable").reset_index(drop=True)
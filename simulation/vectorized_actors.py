@@ -0,0 +1,135 @@
+from datetime import datetime
+
+import numpy as np
+
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.option_pool import OptionPool
+from utils.csv_processor import CSVProcessor
+
+
+def calculate_fills(unlocked: np.ndarray) -> np.ndarray:
+    """Returns which of a sequence of purchase attempts are filled, given the
+    unlocked underlying assets each attempt would see if no purchases had been
+    made before it. An attempt is filled if the unlocked underlying assets
+    minus the earlier fills are > 0, and each fill locks 1.
+    """
+    # The number of fills up to attempt i can be at most ceil(unlocked[i]) - 1
+    # before attempt i is filled. While the caps are nondecreasing, the number
+    # of fills after attempt j is j + min(0, min over i <= j of (cap_i - i)).
+    caps = np.ceil(unlocked)
+    is_filled = np.zeros(len(caps), dtype=bool)
+    if len(caps) == 0:
+        return is_filled
+    boundaries = np.concatenate((
+        [0],
+        np.flatnonzero(np.diff(caps) < 0) + 1,
+        [len(caps)]
+    ))
+    num_filled = 0
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        turns = np.arange(1, end - start + 1)
+        segment_caps = np.maximum(caps[start:end] - num_filled, 0)
+        segment_filled = turns + np.minimum(
+            np.minimum.accumulate(segment_caps - turns), 0)
+        is_filled[start:end] = np.diff(segment_filled, prepend=0) > 0
+        num_filled += int(segment_filled[-1])
+    return is_filled
+
+
+class VectorizedActors:
+    """The liquidity providers and purchasers of a simulation held as NumPy
+    arrays instead of LiquidityProvider and Purchaser objects. Actor i is
+    liquidity provider i if i < num_liquidity_providers, otherwise purchaser
+    i - num_liquidity_providers. Processing an epoch in a given order of actors
+    has the same effect on the option pool as calling start_epoch/end_epoch on
+    the equivalent objects in that order.
+    """
+
+    def __init__(
+        self,
+        csv_processor: CSVProcessor,
+        option_pool: OptionPool,
+        num_liquidity_providers: int,
+        num_purchasers: int,
+        asset: UnderlyingAsset
+    ) -> None:
+        self.csv_processor = csv_processor
+        self.option_pool = option_pool
+        self.num_liquidity_providers = num_liquidity_providers
+        self.num_purchasers = num_purchasers
+        self.asset = asset
+        self.lp_num_underlying_in_pool = np.zeros(num_liquidity_providers)
+
+        # Statistics
+        self.lp_profit = np.zeros(num_liquidity_providers)
+        self.lp_num_underlying_deposited = np.zeros(num_liquidity_providers)
+        self.lp_num_underlying_withdrawn = np.zeros(num_liquidity_providers)
+        self.purchaser_profit = np.zeros(num_purchasers)
+
+    def start_epoch(
+        self,
+        date: datetime,
+        order: np.ndarray,
+        deposit_values: np.ndarray,
+        strike_range_values: np.ndarray
+    ) -> None:
+        """Each liquidity provider deposits its deposit value, and each
+        purchaser attempts to purchase a call option with its strike range
+        value, in the given order of actors.
+        """
+        is_lp = order < self.num_liquidity_providers
+        underlying_price = self.csv_processor.get_underlying_price(date)
+
+        # The unlocked underlying assets at each purchaser's turn, before any
+        # purchases
+        deposits = np.zeros(len(order))
+        deposits[is_lp] = deposit_values[order[is_lp]]
+        unlocked = self.option_pool.total_underlying_asset_unlocked + \
+            np.cumsum(deposits)[~is_lp]
+        self.option_pool.deposit(deposit_values.sum(), self.asset)
+
+        # Purchasers whose turn comes while there are unlocked assets left
+        is_filled = calculate_fills(unlocked)
+        purchaser_ids = order[~is_lp][is_filled] - \
+            self.num_liquidity_providers
+        premiums = self.option_pool.purchase_call_options(
+            date,
+            purchaser_ids,
+            strike_range_values[purchaser_ids]
+        )
+
+        # Statistics
+        self.lp_profit -= underlying_price * deposit_values
+        self.lp_num_underlying_in_pool += deposit_values
+        self.lp_num_underlying_deposited += deposit_values
+        self.purchaser_profit[purchaser_ids] -= premiums
+
+    def end_epoch(
+        self,
+        date: datetime,
+        order: np.ndarray,
+        withdraw_values: np.ndarray
+    ) -> None:
+        """Each purchaser exercises its call option, and each liquidity provider
+        attempts to withdraw its withdraw value, in the given order of actors.
+        """
+        underlying_price = self.csv_processor.get_underlying_price(date)
+
+        purchaser_ids, strikes = self.option_pool.exercise_call_options(date)
+        self.purchaser_profit[purchaser_ids] -= strikes
+        self.purchaser_profit[purchaser_ids] += underlying_price
+
+        # Liquidity providers attempt to withdraw in the order of their turns
+        lp_ids = order[order < self.num_liquidity_providers]
+        lp_ids = lp_ids[withdraw_values[lp_ids] >=
+                        self.lp_num_underlying_in_pool[lp_ids]]
+        is_success = self.option_pool.withdraw_many(
+            withdraw_values[lp_ids],
+            self.asset
+        )
+        lp_ids = lp_ids[is_success]
+
+        # Statistics
+        self.lp_profit[lp_ids] += underlying_price * withdraw_values[lp_ids]
+        self.lp_num_underlying_in_pool[lp_ids] -= 1
+        self.lp_num_underlying_withdrawn[lp_ids] += 1
@@ -1,15 +1,192 @@
-from datetime import datetime, timedelta
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
 
 import altair as alt
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-from data_classes.distribution import Distribution, LPDistribution, PurchaserDistribution
+from data_classes.distribution import LPDistribution, PurchaserDistribution
+from data_classes.epoch_length import EpochLength
+from data_classes.pool_result import PoolResult
+from data_classes.simulation_config import SimulationConfig
 from data_classes.underlying_asset import UnderlyingAsset
-from simulation.simulation import Simulation
+from simulation.background_run import BackgroundRun
+from simulation.instrumentation import PHASES
+from simulation.replication import create_simulation
+from simulation.simulation import (EPOCH_TIMEDELTAS, add_months,
+                                   create_epoch_dates, get_num_epochs_between)
 from utils.csv_processor import CSVProcessor
 from utils.data_processor import DataProcessor
-from utils.formatter import create_layered_bar_chart, get_dollar_str
+from utils.formatter import (create_layered_bar_chart, create_stacked_chart,
+                             get_dollar_str)
+
+DATA_FILES = {
+    "ETH": "data/eth.csv",
+    "TSLA": "data/tsla.csv"
+}
+
+# CACHING
+
+# Finished simulation results and everything derived from them are keyed by
+# the simulation configurations (one per purchaser distribution) and the seed.
+# Each cache keeps the most recently used entries and evicts the rest.
+MAX_CACHED_RESULTS = 16
+
+# Maximum number of seconds between progress updates while simulations run
+PROGRESS_UPDATE_INTERVAL = 0.5
+
+
+@st.cache_resource
+def get_executor() -> ProcessPoolExecutor:
+    """Returns the worker processes that run the simulations of all
+    sessions. Workers are spawned rather than forked from the server, whose
+    threads could hold locks at the time of the fork.
+    """
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=get_context("spawn")
+    )
+
+
+@st.cache_resource
+def load_csv_processor(data_file: str) -> CSVProcessor:
+    return CSVProcessor(data_file)
+
+
+@st.cache_resource
+def get_pool_result_cache() -> Tuple[OrderedDict, Lock]:
+    """Returns the finished simulation results shared by all sessions, in
+    least recently used order, and the lock that guards them.
+    """
+    return OrderedDict(), Lock()
+
+
+def get_cached_pool_results(
+    configs: Tuple[SimulationConfig, ...],
+    seed: int
+) -> Optional[List[PoolResult]]:
+    pool_result_cache, lock = get_pool_result_cache()
+    with lock:
+        pool_results = pool_result_cache.get((configs, seed))
+        if pool_results is not None:
+            pool_result_cache.move_to_end((configs, seed))
+        return pool_results
+
+
+def cache_pool_results(
+    configs: Tuple[SimulationConfig, ...],
+    seed: int,
+    pool_results: List[PoolResult]
+) -> None:
+    pool_result_cache, lock = get_pool_result_cache()
+    with lock:
+        pool_result_cache[(configs, seed)] = pool_results
+        while len(pool_result_cache) > MAX_CACHED_RESULTS:
+            pool_result_cache.popitem(last=False)
+
+
+def get_pool_results(
+    configs: Tuple[SimulationConfig, ...],
+    seed: int
+) -> List[PoolResult]:
+    pool_results = get_cached_pool_results(configs, seed)
+    if pool_results is None:
+        pool_results = [create_simulation(
+            config,
+            load_csv_processor(config.data_file),
+            seed
+        ).run().get_result() for config in configs]
+        cache_pool_results(configs, seed, pool_results)
+    return pool_results
+
+
+def create_epoch_chart(
+    pool_results: List[PoolResult],
+    underlying_asset: str
+) -> alt.VConcatChart:
+    """Returns the charts of the option pools' epochs, which share one copy
+    of the chart data, so the page carries it once however many charts show
+    it. Long runs are charted in buckets of consecutive epochs.
+    """
+    epochs_per_bar = DataProcessor.get_epochs_per_chart_bar(pool_results)
+    if epochs_per_bar == 1:
+        x_axis_title = "Epoch"
+    else:
+        x_axis_title = "Epochs (%d per bar)" % epochs_per_bar
+    bar_charts = [
+        create_layered_bar_chart(
+            alt.Undefined,
+            "start_date:O",
+            x_axis_title,
+            y_shorthand,
+            y_axis_title,
+            "purchaser_distribution:O",
+            "Purchaser distribution"
+        ).properties(title=title)
+        for title, y_shorthand, y_axis_title in (
+            (
+                "Total value locked in the option pool",
+                "total_value_locked:Q",
+                "Total value locked (USDT)"
+            ),
+            (
+                "Total option pool profit by epoch",
+                "total_profit:Q",
+                "Total profit (USDT)"
+            ),
+            (
+                "Liquidity provider profit by epoch",
+                "total_lp_profit:Q",
+                "Total liquidity provider profit (USDT)"
+            )
+        )
+    ]
+    underlying_price_chart = alt.Chart().mark_line(color="gray").encode(
+        x=alt.X("start_date:O", axis=alt.Axis(title=x_axis_title)),
+        y=alt.Y("end_underlying_price:Q", axis=alt.Axis(format="$.2f",
+                title="USDT"))
+    ).properties(title="Price of " + underlying_asset)
+    return create_stacked_chart(
+        DataProcessor.get_chart_data_by_epoch(pool_results),
+        bar_charts + [underlying_price_chart]
+    )
+
+
+def create_results(
+    pool_results: List[PoolResult],
+    underlying_asset: str
+) -> Dict[str, Any]:
+    """Returns the chart data and charts of the option pools."""
+    return {
+        "total_lp_profit_data": DataProcessor.get_total_lp_profit(
+            pool_results),
+        "epoch_chart": create_epoch_chart(pool_results, underlying_asset),
+        "strike_values_chart": create_layered_bar_chart(
+            DataProcessor.get_strike_values_data(pool_results),
+            "value:O",
+            "Value",
+            "frequency:Q",
+            "Frequency",
+            "distribution:O",
+            "Purchaser strike price distribution",
+            y_axis_format=""
+        )
+    }
+
+
+@st.cache_resource(max_entries=MAX_CACHED_RESULTS)
+def get_results(
+    configs: Tuple[SimulationConfig, ...],
+    seed: int,
+    underlying_asset: str
+) -> Dict[str, Any]:
+    return create_results(get_pool_results(configs, seed), underlying_asset)
 
 
 # PAGE CONFIGURATION
@@ -28,15 +205,25 @@ with st.sidebar:
         "Underlying asset",
         ["ETH", "TSLA"]
     )
-    if underlying_asset == "ETH":
-        csv_processor = CSVProcessor("data/eth.csv")
-    elif underlying_asset == "TSLA":
-        csv_processor = CSVProcessor("data/tsla.csv")
+    csv_processor = load_csv_processor(DATA_FILES[underlying_asset])
 
+    epoch_length_selection = st.selectbox(
+        "Epoch length",
+        ["Daily", "Weekly", "Monthly"],
+        index=1
+    )
+    epoch_length = EpochLength[epoch_length_selection.upper()]
+
+    # The first epoch must end within the market data
+    last_date = csv_processor.get_last_date().date()
+    if epoch_length == EpochLength.MONTHLY:
+        max_start_date = add_months(last_date, -1)
+    else:
+        max_start_date = last_date - EPOCH_TIMEDELTAS[epoch_length]
     start_date = st.date_input(
         "Start date",
         min_value=csv_processor.get_first_date(),
-        max_value=csv_processor.get_last_date() - timedelta(days=7),
+        max_value=max_start_date,
         value=csv_processor.get_first_date()
     )
 
@@ -44,8 +231,8 @@ with st.sidebar:
         num_epochs = st.number_input(
             "Number of epochs",
             min_value=1,
-            max_value=csv_processor.get_num_weeks_after_date(
-                start_date)
+            max_value=get_num_epochs_between(
+                start_date, last_date, epoch_length)
         )
         num_purchasers = st.number_input(
             "Number of option purchasers",
@@ -72,25 +259,37 @@ with st.sidebar:
             "Liquidity Provider Distribution",
             ["Uniform", "Normal"]
         )
+        seed = st.number_input(
+            "Random seed",
+            min_value=0,
+            value=0
+        )
+        diagnostics = st.checkbox(
+            "Collect diagnostics",
+            help="Time each phase of the simulations and count purchases, "
+            "exercises, withdrawals and market data lookups"
+        )
 
         submitted = st.form_submit_button("Run")
 
+    # Clicking the button interrupts the script following a running
+    # simulation with a rerun, which cancels it
+    cancelled = st.button("Cancel run")
+
 # RESULTS
 
+progress_container = st.empty()
 tvl_container = st.empty()
-option_pool_profit_container = st.empty()
 lp_profit_container = st.empty()
-underlying_price_container = st.empty()
+epoch_chart_container = st.empty()
 purchaser_strike_value_container = st.empty()
+diagnostics_container = st.empty()
 
 if submitted:
 
     # SIMULATION
 
-    epoch_dates = [
-        datetime.combine(start_date + timedelta(7 * i), datetime.min.time())
-        for i in range(num_epochs + 1)
-    ]
+    epoch_dates = create_epoch_dates(start_date, num_epochs, epoch_length)
 
     if underlying_asset == "ETH":
         asset = UnderlyingAsset.ETH
@@ -116,29 +315,142 @@ if submitted:
     elif lp_distribution_selection == "Normal":
         lp_distribution = LPDistribution.NORMAL
 
-    simulations = [Simulation(
-        csv_processor,
+    configs = tuple(SimulationConfig(
+        DATA_FILES[underlying_asset],
         num_liquidity_providers,
         num_purchasers,
-        epoch_dates,
-        Distribution(purchaser_distribution),
-        Distribution(lp_distribution),
-        asset
-    ) for purchaser_distribution in purchaser_distributions]
-    option_pools = [simulation.run() for simulation in simulations]
+        tuple(epoch_dates),
+        purchaser_distribution,
+        lp_distribution,
+        asset,
+        epoch_length=epoch_length
+    ) for purchaser_distribution in purchaser_distributions)
+
+    # A new submission cancels the simulations of the last one that are
+    # still running
+    if "run" in st.session_state:
+        st.session_state.run.cancel()
+        st.session_state.run.close()
+        del st.session_state.run
+
+    # Keep showing the results of the last submitted form on later reruns
+    st.session_state.simulation_parameters = (
+        underlying_asset, configs, int(seed), diagnostics)
+    st.session_state.is_cancelled = False
+    st.session_state.pop("partial_pool_results", None)
+
+if cancelled and "simulation_parameters" in st.session_state:
+    st.session_state.is_cancelled = True
+    if "run" in st.session_state:
+        st.session_state.run.cancel()
+
+if "simulation_parameters" in st.session_state:
+    underlying_asset, configs, seed, diagnostics = \
+        st.session_state.simulation_parameters
+    pool_results = get_cached_pool_results(configs, seed)
+
+    # Diagnostics are collected by running the simulations again, once per
+    # submission
+    needs_diagnostics = diagnostics and \
+        st.session_state.get("diagnostics_parameters") != \
+        st.session_state.simulation_parameters
+    if "run" not in st.session_state and \
+            (pool_results is None or needs_diagnostics) and \
+            not st.session_state.is_cancelled:
+        # The simulations run concurrently in the worker processes. The run
+        # is kept in the session, so the rerun of a cancellation (or of any
+        # other interaction) picks it up where this one left it.
+        st.session_state.run = BackgroundRun(
+            get_executor(), configs, seed, diagnostics)
+
+    if "run" in st.session_state:
+        # Follow the run until every simulation has finished or stopped,
+        # showing each simulation's progress and charting the epochs the
+        # simulations have finished as they come in
+        run = st.session_state.run
+        charted_epochs_run = None
+        while True:
+            is_done = run.is_done()
+            epochs_run = run.epochs_run
+            with progress_container.container():
+                for config, num_epochs_run, num_epochs in zip(
+                        run.configs, epochs_run, run.num_epochs):
+                    st.progress(
+                        min(num_epochs_run / num_epochs, 1.0),
+                        text="%s: simulated %d of %d epochs" % (
+                            config.purchaser_distribution.name,
+                            num_epochs_run,
+                            num_epochs
+                        )
+                    )
+            if epochs_run.any() and \
+                    not np.array_equal(epochs_run, charted_epochs_run):
+                epoch_chart_container.altair_chart(
+                    create_epoch_chart(
+                        [
+                            pool_result
+                            for pool_result in run.get_partial_results()
+                            if pool_result.num_epochs
+                        ],
+                        underlying_asset
+                    ),
+                    use_container_width=True
+                )
+                charted_epochs_run = epochs_run
+            if is_done:
+                break
+            run.wait(PROGRESS_UPDATE_INTERVAL)
+
+        results = run.get_results()
+        is_complete = all(
+            result is not None and result[0].num_epochs == num_epochs
+            for result, num_epochs in zip(results, run.num_epochs)
+        )
+        run.close()
+        del st.session_state.run
+        progress_container.empty()
+        if is_complete:
+            pool_results = [pool_result for pool_result, _ in results]
+            cache_pool_results(configs, seed, pool_results)
+            if diagnostics:
+                st.session_state.diagnostics_parameters = \
+                    st.session_state.simulation_parameters
+                st.session_state.diagnostics = {
+                    pool_result.purchaser_distribution.name: report
+                    for pool_result, report in results
+                }
+        else:
+            # Keep the epochs the cancelled simulations finished
+            st.session_state.partial_pool_results = [
+                result[0] for result in results
+                if result is not None and result[0].num_epochs
+            ]
 
-    epoch_data = DataProcessor.get_data_by_epoch(option_pools)
-    strike_values_data = DataProcessor.get_strike_values_data(option_pools)
-    total_lp_profit_data = DataProcessor.get_total_lp_profit(option_pools)
+    if pool_results is None:
+        # The run was cancelled, possibly before it finished any epochs, or
+        # before it started
+        pool_results = st.session_state.get("partial_pool_results")
+        if not pool_results:
+            progress_container.info(
+                "The simulations were cancelled and have no results to "
+                "show. Run them again to see their results.")
+            st.stop()
+        results = create_results(pool_results, underlying_asset)
+        progress_container.warning(
+            "The simulations were cancelled. Showing the epochs they "
+            "finished.")
+    else:
+        results = get_results(configs, seed, underlying_asset)
+    total_lp_profit_data = results["total_lp_profit_data"]
 
     # OUTPUT
 
     # Ensures that the graphs re-render with the new data
     tvl_container.empty()
-    option_pool_profit_container.empty()
     purchaser_strike_value_container.empty()
     lp_profit_container.empty()
-    underlying_price_container.empty()
+    epoch_chart_container.empty()
+    diagnostics_container.empty()
 
     with tvl_container.container():
         st.subheader("Total value locked in the option pool")
@@ -148,38 +460,16 @@ if submitted:
 
         st.table(pd.DataFrame(
             [[
-                option_pool.purchaser_distribution.name,
-                get_dollar_str(option_pool.epochs[-1].total_value_locked)
-            ] for option_pool in option_pools],
+                pool_result.purchaser_distribution.name,
+                get_dollar_str(
+                    pool_result.epoch_columns["total_value_locked"][-1])
+            ] for pool_result in pool_results],
             columns=(
                 "Purchaser distribution",
                 "Final TVL of the option pool"
             ),
         ))
 
-        st.altair_chart(create_layered_bar_chart(
-            epoch_data,
-            "start_date:O",
-            "Epoch",
-            "total_value_locked:Q",
-            "Total value locked (USDT)",
-            "purchaser_distribution:O",
-            "Purchaser distribution"
-        ), use_container_width=True)
-
-    with option_pool_profit_container.container():
-        st.subheader("Total option pool profit by epoch")
-
-        st.altair_chart(create_layered_bar_chart(
-            epoch_data,
-            "start_date:O",
-            "Epoch",
-            "total_profit:Q",
-            "Total profit (USDT)",
-            "purchaser_distribution:O",
-            "Purchaser distribution"
-        ), use_container_width=True)
-
     with lp_profit_container.container():
         st.subheader("Liquidity provider profit by epoch")
 
@@ -190,65 +480,65 @@ if submitted:
             \text{LP profit over an epoch} = \sum_{\text{purchased options}} \text{premium} + \sum_{\text{exercised options}} \left(\text{strike} - \text{price of the underlying asset in USD}\right)
         """)
 
-        st.table(pd.DataFrame(
-            [[
-                data.distribution,
-                get_dollar_str(data.value)
-            ] for data in total_lp_profit_data],
-            columns=("Purchaser distribution", "Total LP profit"),
-        ))
+        st.table(pd.DataFrame({
+            "Purchaser distribution": total_lp_profit_data["distribution"],
+            "Total LP profit":
+                total_lp_profit_data["value"].map(get_dollar_str)
+        }))
 
         if len(total_lp_profit_data) > 1:
-            most_profitable = total_lp_profit_data[0]
-            for i in range(1, len(total_lp_profit_data)):
-                if total_lp_profit_data[i].value > most_profitable.value:
-                    most_profitable = total_lp_profit_data[i]
+            most_profitable = total_lp_profit_data.loc[
+                total_lp_profit_data["value"].idxmax()]
             st.markdown(
                 "LPs will profit most when purchaser strikes are **" +
-                most_profitable.distribution.lower() + "**."
+                most_profitable["distribution"].lower() + "**."
             )
 
         if len(total_lp_profit_data) > 1:
-            least_profitable = total_lp_profit_data[0]
-            for i in range(1, len(total_lp_profit_data)):
-                if total_lp_profit_data[i].value < least_profitable.value:
-                    least_profitable = total_lp_profit_data[i]
+            least_profitable = total_lp_profit_data.loc[
+                total_lp_profit_data["value"].idxmin()]
             st.markdown(
                 "LPs will profit least when purchaser strikes are **" +
-                least_profitable.distribution.lower() + "**."
+                least_profitable["distribution"].lower() + "**."
             )
 
-        st.altair_chart(create_layered_bar_chart(
-            epoch_data,
-            "start_date:O",
-            "Epoch",
-            "total_lp_profit:Q",
-            "Total liquidity provider profit (USDT)",
-            "purchaser_distribution:O",
-            "Purchaser distribution"
-        ), use_container_width=True)
-
-    with underlying_price_container.container():
-        st.subheader("Price of " + underlying_asset)
+    with epoch_chart_container.container():
+        st.subheader("Results by epoch")
 
-        st.altair_chart(alt.Chart(epoch_data).mark_line(
-            color="gray"
-        ).encode(
-            x=alt.X("start_date:O", axis=alt.Axis(title="Epoch")),
-            y=alt.Y("end_underlying_price:Q", axis=alt.Axis(format="$.2f",
-                    title="USDT"))
-        ), use_container_width=True)
+        st.altair_chart(
+            results["epoch_chart"],
+            use_container_width=True
+        )
 
     with purchaser_strike_value_container.container():
         st.subheader("Purchaser strike price selection distribution")
 
-        st.altair_chart(create_layered_bar_chart(
-            strike_values_data,
-            "value:O",
-            "Value",
-            "frequency:Q",
-            "Frequency",
-            "distribution:O",
-            "Purchaser strike price distribution",
-            y_axis_format=""
-        ), use_container_width=True)
+        st.altair_chart(
+            results["strike_values_chart"],
+            use_container_width=True
+        )
+
+    if diagnostics and st.session_state.get("diagnostics_parameters") == \
+            st.session_state.simulation_parameters:
+        with diagnostics_container.container():
+            st.subheader("Diagnostics")
+
+            reports = st.session_state.diagnostics
+            st.markdown("Seconds spent in each phase of the simulations. "
+                        "Premium pricing is part of the start of the epoch, "
+                        "and exercising options is part of the end of the "
+                        "epoch.")
+            st.table(pd.DataFrame({
+                distribution: report["run"]["timers"]
+                for distribution, report in reports.items()
+            }).reindex(PHASES))
+            st.table(pd.DataFrame({
+                distribution: report["run"]["counters"]
+                for distribution, report in reports.items()
+            }))
+            st.download_button(
+                "Download diagnostics (JSON)",
+                json.dumps(reports, indent=2),
+                file_name="diagnostics.json",
+                mime="application/json"
+            )
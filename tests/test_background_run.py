@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+import pytest
+
+from data_classes.distribution import LPDistribution, PurchaserDistribution
+from data_classes.simulation_config import SimulationConfig
+from data_classes.simulation_engine import SimulationEngine
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.background_run import BackgroundRun
+from simulation.simulation import create_epoch_dates
+
+
+@pytest.fixture(scope="module")
+def executor():
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+def test_partial_results_are_the_finished_epochs(executor):
+    configs = [
+        SimulationConfig(
+            "data/eth.csv",
+            5,
+            50,
+            tuple(create_epoch_dates(date(2020, 6, 3), num_epochs)),
+            purchaser_distribution,
+            LPDistribution.NORMAL,
+            UnderlyingAsset.ETH,
+            engine
+        ) for purchaser_distribution, num_epochs, engine in (
+            (PurchaserDistribution.UNIFORM, 6, SimulationEngine.OBJECT),
+            (PurchaserDistribution.SKEWIN, 4, SimulationEngine.VECTORIZED),
+            (PurchaserDistribution.NORMAL, 5, SimulationEngine.EXPECTED_VALUE)
+        )
+    ]
+    run = BackgroundRun(executor, configs, 7)
+    try:
+        while not run.is_done():
+            for pool_result, num_epochs_run in zip(
+                    run.get_partial_results(), run.epochs_run):
+                assert pool_result.num_epochs <= num_epochs_run
+            run.wait(0.1)
+
+        np.testing.assert_array_equal(run.epochs_run, [6, 4, 5])
+        for pool_result, (result, _) in zip(
+                run.get_partial_results(), run.get_results()):
+            assert pool_result.purchaser_distribution.name == \
+                result.purchaser_distribution.name
+            for field, values in result.epoch_columns.items():
+                np.testing.assert_array_equal(
+                    pool_result.epoch_columns[field], values, err_msg=field)
+    finally:
+        run.close()
@@ -0,0 +1,80 @@
+import io
+from dataclasses import fields
+from datetime import date
+
+import numpy as np
+import pytest
+
+from data_classes.distribution import (Distribution, LPDistribution,
+                                       PurchaserDistribution)
+from data_classes.epoch import Epoch
+from data_classes.sampling_method import SamplingMethod
+from data_classes.simulation_engine import SimulationEngine
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.checkpoint import load_checkpoint, save_checkpoint
+from simulation.premium_surface import PremiumSurfaceCache
+from simulation.simulation import Simulation, create_epoch_dates
+from utils.csv_processor import CSVProcessor
+
+
+def create_simulation(csv_processor, epoch_dates, engine, **kwargs):
+    return Simulation(
+        csv_processor,
+        5,
+        20,
+        epoch_dates,
+        Distribution(PurchaserDistribution.SKEWIN),
+        Distribution(LPDistribution.NORMAL),
+        UnderlyingAsset.ETH,
+        engine=engine,
+        seed=7,
+        **kwargs
+    )
+
+
+def get_epoch_statistics(option_pool):
+    return {
+        field.name: [
+            getattr(epoch, field.name) for epoch in option_pool.epochs
+        ]
+        for field in fields(Epoch)
+    }
+
+
+@pytest.mark.parametrize("premium_grid_size", [None, 257])
+@pytest.mark.parametrize("sampling", list(SamplingMethod))
+@pytest.mark.parametrize(
+    "engine", [SimulationEngine.OBJECT, SimulationEngine.VECTORIZED])
+def test_resumed_run_is_identical_to_an_uninterrupted_one(
+    engine,
+    sampling,
+    premium_grid_size
+):
+    csv_processor = CSVProcessor("data/eth.csv")
+    epoch_dates = create_epoch_dates(date(2020, 6, 3), 15)
+    kwargs = {"sampling": sampling}
+    if premium_grid_size is not None:
+        kwargs["premium_cache"] = PremiumSurfaceCache(
+            csv_processor, grid_size=premium_grid_size)
+    option_pool = create_simulation(
+        csv_processor, epoch_dates, engine, **kwargs).run()
+
+    simulation = create_simulation(
+        csv_processor, epoch_dates[:11], engine, **kwargs)
+    simulation.run()
+    checkpoint = io.BytesIO()
+    save_checkpoint(simulation, checkpoint)
+    checkpoint.seek(0)
+    simulation = load_checkpoint(checkpoint, csv_processor)
+    simulation.extend_epochs(epoch_dates[11:])
+    resumed_option_pool = simulation.run()
+
+    statistics = get_epoch_statistics(option_pool)
+    resumed_statistics = get_epoch_statistics(resumed_option_pool)
+    for field, values in statistics.items():
+        np.testing.assert_array_equal(
+            values, resumed_statistics[field], err_msg=field)
+    for field in ("strike_values", "strikes", "premiums"):
+        np.testing.assert_array_equal(
+            getattr(option_pool, field), getattr(resumed_option_pool, field),
+            err_msg=field)
@@ -0,0 +1,28 @@
+from dataclasses import fields
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from data_classes.distribution import (Distribution, LPDistribution,
+                                       PurchaserDistribution)
+from data_classes.epoch import Epoch
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.expected_value import ExpectedValueSimulation
+from utils.csv_processor import CSVProcessor
+
+
+def test_no_liquidity_providers():
+    option_pool = ExpectedValueSimulation(
+        CSVProcessor("data/eth.csv"),
+        0,
+        200,
+        [datetime(2020, 6, 3) + timedelta(weeks=i) for i in range(5)],
+        Distribution(PurchaserDistribution.UNIFORM),
+        Distribution(LPDistribution.NORMAL),
+        UnderlyingAsset.ETH
+    ).run()
+
+    assert len(option_pool.epochs) == 4
+    for field in fields(Epoch)[1:]:
+        values = [getattr(epoch, field.name) for epoch in option_pool.epochs]
+        assert np.isfinite(values).all(), field.name
@@ -0,0 +1,7 @@
+from benchmarks.import_time import IMPORT_TIME_BUDGET, measure_import
+
+
+def test_core_imports_within_budget_without_lazy_modules():
+    measurement = measure_import(repeat=3)
+    assert measurement["loaded"] == []
+    assert measurement["seconds"] <= IMPORT_TIME_BUDGET
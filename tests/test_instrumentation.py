@@ -0,0 +1,43 @@
+from datetime import date
+
+import pytest
+
+from data_classes.distribution import (Distribution, LPDistribution,
+                                       PurchaserDistribution)
+from data_classes.simulation_engine import SimulationEngine
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.instrumentation import Instrumentation
+from simulation.premium_surface import PremiumSurfaceCache
+from simulation.simulation import Simulation, create_epoch_dates
+from utils.csv_processor import CSVProcessor
+
+
+@pytest.mark.parametrize(
+    "engine", [SimulationEngine.OBJECT, SimulationEngine.VECTORIZED])
+def test_premium_pricing_is_timed_and_counted(engine):
+    csv_processor = CSVProcessor("data/eth.csv")
+    instrumentation = Instrumentation()
+    Simulation(
+        csv_processor,
+        10,
+        200,
+        create_epoch_dates(date(2020, 6, 3), 4),
+        Distribution(PurchaserDistribution.UNIFORM),
+        Distribution(LPDistribution.NORMAL),
+        UnderlyingAsset.ETH,
+        engine=engine,
+        seed=7,
+        instrumentation=instrumentation,
+        premium_cache=PremiumSurfaceCache(csv_processor)
+    ).run()
+
+    for epoch in instrumentation.get_report()["epochs"]:
+        counters = epoch["counters"]
+        assert epoch["timers"]["premium_pricing"] > 0
+        assert counters["purchases_filled"] > 0
+        assert counters["premium_cache_misses"] == 1
+        if engine == SimulationEngine.OBJECT:
+            assert counters["premium_cache_hits"] == \
+                counters["purchases_filled"] - 1
+        else:
+            assert counters["premium_cache_hits"] == 0
@@ -0,0 +1,128 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from data_classes.distribution import Distribution, PurchaserDistribution
+from data_classes.epoch import Epoch
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.option_pool import OptionPool
+from utils.csv_processor import CSVProcessor
+
+
+@pytest.fixture
+def option_pool():
+    option_pool = OptionPool(
+        CSVProcessor("data/eth.csv"),
+        Distribution(PurchaserDistribution.UNIFORM)
+    )
+    option_pool.initialize_epoch_statistics(datetime(2020, 6, 3))
+    option_pool.initialize_epoch_statistics(datetime(2020, 6, 10))
+    return option_pool
+
+
+def test_statistics_are_stored_as_columns(option_pool):
+    option_pool.deposit(1.0, UnderlyingAsset.ETH)
+    premium = option_pool.purchase_call_option(datetime(2020, 6, 10), 0, 0.5)
+
+    columns = option_pool.get_epoch_columns()
+    assert columns["start_date"].tolist() == [
+        datetime(2020, 6, 3), datetime(2020, 6, 10)]
+    assert columns["end_underlying_price"][0] == \
+        option_pool.csv_processor.get_underlying_price(datetime(2020, 6, 3))
+    assert columns["total_lp_profit"].tolist() == [0.0, premium]
+    assert option_pool.epochs.to_frame().shape[0] == 2
+
+    purchase_columns = option_pool.get_purchase_columns()
+    assert purchase_columns["strike_value"].tolist() == [0.5]
+    assert purchase_columns["premium"].tolist() == [premium]
+
+
+def test_epochs_read_as_epochs(option_pool):
+    epoch = option_pool.epochs[-1]
+    assert isinstance(epoch, Epoch)
+    assert epoch.start_date == "2020-06-10"
+    assert epoch.end_underlying_price == \
+        option_pool.csv_processor.get_underlying_price(datetime(2020, 6, 10))
+    assert [epoch.start_date for epoch in option_pool.epochs] == \
+        ["2020-06-03", "2020-06-10"]
+    assert [epoch.start_date for epoch in option_pool.epochs[1:]] == \
+        ["2020-06-10"]
+    with pytest.raises(IndexError):
+        option_pool.epochs[2]
+
+
+def test_epoch_writes_go_through_to_the_columns(option_pool):
+    option_pool.epochs[-1].total_value_locked = 100.0
+    option_pool.epochs[0].total_lp_profit += 5.0
+    option_pool.epochs[0].start_date = "2020-06-04"
+
+    columns = option_pool.get_epoch_columns()
+    assert columns["total_value_locked"].tolist() == [0.0, 100.0]
+    assert columns["total_lp_profit"].tolist() == [5.0, 0.0]
+    assert option_pool.epochs[0].start_date == "2020-06-04"
+
+
+def test_epoch_views_see_later_writes(option_pool):
+    epoch = option_pool.epochs[-1]
+    option_pool.epochs.total_profit[-1] = 7.0
+    assert epoch.total_profit == 7.0
+
+
+def test_purchase_statistics_append_like_lists(option_pool):
+    option_pool.deposit(1.0, UnderlyingAsset.ETH)
+    option_pool.purchase_call_option(datetime(2020, 6, 10), 0, 0.5)
+    option_pool.strike_values.append(0.25)
+    option_pool.strikes.append(200.0)
+    option_pool.premiums.extend([1.0])
+
+    assert option_pool.strike_values.tolist() == [0.5, 0.25]
+    assert list(option_pool.strikes)[1] == 200.0
+    assert len(option_pool.premiums) == 2
+    assert np.asarray(option_pool.strike_values).dtype == np.float64
+    assert option_pool.get_purchase_columns()["strike"][1] == 200.0
+
+
+def calculate_baseline_premiums(option_pool, date, strikes):
+    """The Black-Scholes formula the option pool priced options with before
+    its premiums were vectorized, with the 7 day tenor of weekly epochs.
+    """
+    from scipy.stats import norm
+
+    S = option_pool.csv_processor.get_underlying_price(date)
+    T = 7.0 / 365.0
+    r = option_pool.csv_processor.get_r(date)
+    sigma = option_pool.csv_processor.get_vol(date)
+    d1 = (np.log(S/strikes) + (r + sigma**2/2)*T) / (sigma*np.sqrt(T))
+    d2 = d1 - sigma * np.sqrt(T)
+    return S * norm.cdf(d1) - strikes * np.exp(-r*T) * norm.cdf(d2)
+
+
+@pytest.mark.parametrize("date", [datetime(2020, 6, 3), datetime(2021, 5, 19)])
+def test_batch_and_scalar_premiums_match_the_baseline(option_pool, date):
+    strikes = option_pool.calculate_strike_prices(np.linspace(0, 1, 101), date)
+    expected = calculate_baseline_premiums(option_pool, date, strikes)
+
+    np.testing.assert_allclose(
+        option_pool.calculate_premiums(date, strikes), expected,
+        rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(
+        [option_pool.calculate_premium(date, strike) for strike in strikes],
+        expected, rtol=1e-12, atol=1e-9)
+
+
+def test_cached_scalar_premiums_match_the_batch(option_pool):
+    from simulation.premium_surface import PremiumSurfaceCache
+
+    date = datetime(2020, 6, 3)
+    strikes = option_pool.calculate_strike_prices(np.linspace(0, 1, 101), date)
+    for grid_size in (None, 64):
+        option_pool.premium_cache = PremiumSurfaceCache(
+            option_pool.csv_processor, grid_size=grid_size)
+        premiums = [
+            option_pool.calculate_premium(date, strike) for strike in strikes
+        ]
+        np.testing.assert_allclose(
+            premiums,
+            option_pool.calculate_premiums(date, strikes),
+            rtol=1e-12, atol=1e-9)
@@ -0,0 +1,58 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from data_classes.distribution import (Distribution, LPDistribution,
+                                       PurchaserDistribution)
+from data_classes.option import OptionType
+from data_classes.pool_config import PoolConfig
+from data_classes.simulation_engine import SimulationEngine
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.portfolio import PortfolioSimulation
+from simulation.simulation import Simulation, create_epoch_dates
+from utils.market_data_panel import MarketDataPanel
+
+
+@pytest.mark.parametrize("purchaser_distribution", list(PurchaserDistribution))
+def test_single_call_pool_matches_simulation(purchaser_distribution):
+    panel = MarketDataPanel.from_files({
+        UnderlyingAsset.ETH: "data/eth.csv",
+        UnderlyingAsset.TSLA: "data/tsla.csv"
+    })
+    epoch_dates = create_epoch_dates(date(2020, 6, 3), 20)
+    portfolio = PortfolioSimulation(
+        panel,
+        [PoolConfig(
+            UnderlyingAsset.ETH, OptionType.CALL, purchaser_distribution, 30)],
+        5,
+        Distribution(LPDistribution.NORMAL),
+        epoch_dates,
+        seed=3
+    )
+    portfolio.run()
+    option_pool = Simulation(
+        panel.get_csv_processor(UnderlyingAsset.ETH),
+        5,
+        30,
+        epoch_dates,
+        Distribution(purchaser_distribution),
+        Distribution(LPDistribution.NORMAL),
+        UnderlyingAsset.ETH,
+        engine=SimulationEngine.VECTORIZED,
+        seed=3
+    ).run()
+
+    columns = portfolio.epochs[0].get_columns()
+    expected_columns = option_pool.get_epoch_columns()
+    assert columns.keys() == expected_columns.keys()
+    np.testing.assert_array_equal(
+        columns.pop("start_date"), expected_columns.pop("start_date"))
+    for field, values in columns.items():
+        np.testing.assert_allclose(
+            values, expected_columns[field], rtol=1e-9, atol=1e-6,
+            err_msg=field)
+    np.testing.assert_allclose(
+        portfolio.premium_column.values,
+        option_pool.get_purchase_columns()["premium"],
+        rtol=1e-9)
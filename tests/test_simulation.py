@@ -0,0 +1,69 @@
+from dataclasses import fields
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from data_classes.distribution import (Distribution, LPDistribution,
+                                       PurchaserDistribution)
+from data_classes.epoch import Epoch
+from data_classes.sampling_method import SamplingMethod
+from data_classes.simulation_engine import SimulationEngine
+from data_classes.underlying_asset import UnderlyingAsset
+from simulation.simulation import Simulation
+from utils.csv_processor import CSVProcessor
+
+
+def run_simulation(engine, purchaser_distribution, sampling):
+    return Simulation(
+        CSVProcessor("data/eth.csv"),
+        10,
+        200,
+        [datetime(2020, 6, 3) + timedelta(weeks=i) for i in range(13)],
+        Distribution(purchaser_distribution),
+        Distribution(LPDistribution.NORMAL),
+        UnderlyingAsset.ETH,
+        engine=engine,
+        seed=7,
+        sampling=sampling
+    ).run()
+
+
+def get_epoch_statistics(option_pool):
+    return {
+        field.name: [
+            getattr(epoch, field.name) for epoch in option_pool.epochs
+        ]
+        for field in fields(Epoch)
+    }
+
+
+@pytest.mark.parametrize("sampling", list(SamplingMethod))
+@pytest.mark.parametrize("purchaser_distribution", list(PurchaserDistribution))
+def test_engines_give_the_same_statistics(purchaser_distribution, sampling):
+    object_pool = run_simulation(
+        SimulationEngine.OBJECT, purchaser_distribution, sampling)
+    vectorized_pool = run_simulation(
+        SimulationEngine.VECTORIZED, purchaser_distribution, sampling)
+
+    statistics = get_epoch_statistics(object_pool)
+    vectorized_statistics = get_epoch_statistics(vectorized_pool)
+    assert statistics.pop("start_date") == \
+        vectorized_statistics.pop("start_date")
+    for field, values in statistics.items():
+        np.testing.assert_allclose(
+            values, vectorized_statistics[field], rtol=1e-9, atol=1e-6,
+            err_msg=field)
+    for field in ("strike_values", "strikes", "premiums"):
+        np.testing.assert_allclose(
+            getattr(object_pool, field), getattr(vectorized_pool, field),
+            rtol=1e-9, err_msg=field)
+
+
+def test_expected_value_engine_is_rejected():
+    with pytest.raises(ValueError):
+        run_simulation(
+            SimulationEngine.EXPECTED_VALUE,
+            PurchaserDistribution.UNIFORM,
+            SamplingMethod.RANDOM
+        )
@@ -0,0 +1,79 @@
+from typing import Dict, Iterator
+
+import numpy as np
+
+
+class Column:
+    """A growable column of values backed by a preallocated NumPy array. The
+    capacity doubles whenever it is full, so appends cost amortized O(1) and
+    the values stay contiguous.
+
+    A column can be used like a list (append, extend, len, indexing and
+    iteration) and like an array: NumPy functions read its values.
+    """
+
+    def __init__(self, dtype: np.dtype = np.float64, capacity: int = 16) -> None:
+        self.buffer = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    @property
+    def values(self) -> np.ndarray:
+        """Returns a view of the values (no copy)."""
+        return self.buffer[:self.size]
+
+    def reserve(self, capacity: int) -> None:
+        if capacity > len(self.buffer):
+            buffer = np.empty(
+                max(capacity, 2 * len(self.buffer)), dtype=self.buffer.dtype)
+            buffer[:self.size] = self.values
+            self.buffer = buffer
+
+    def append(self, value) -> None:
+        self.reserve(self.size + 1)
+        self.buffer[self.size] = value
+        self.size += 1
+
+    def extend(self, values: np.ndarray) -> None:
+        values = np.asarray(values)
+        self.reserve(self.size + len(values))
+        self.buffer[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __setitem__(self, key, value) -> None:
+        self.values[key] = value
+
+    def __iter__(self) -> Iterator:
+        return iter(self.values)
+
+    def __array__(self, dtype: np.dtype = None, copy: bool = None) -> np.ndarray:
+        if copy:
+            return np.array(self.values, dtype=dtype)
+        return np.asarray(self.values, dtype=dtype)
+
+    def tolist(self) -> list:
+        return self.values.tolist()
+
+
+def to_arrow_table(columns: Dict[str, np.ndarray]):
+    """Returns the columns as a pyarrow Table. Numeric columns without nulls
+    are wrapped without copying.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError as error:
+        raise ImportError(
+            "pyarrow is required to export to Arrow or Parquet") from error
+    return pa.table({
+        name: pa.array(values) for name, values in columns.items()
+    })
+
+
+def write_parquet(columns: Dict[str, np.ndarray], file_name: str) -> None:
+    import pyarrow.parquet as pq
+    pq.write_table(to_arrow_table(columns), file_name)
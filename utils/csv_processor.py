@@ -1,31 +1,207 @@
 from datetime import date, datetime
 from math import floor
+from typing import TYPE_CHECKING, List, Tuple
 
-import pandas as pd
+import numpy as np
+
+from utils.market_data_cache import (read_market_data_cache,
+                                     write_market_data_cache)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Rows per chunk of market data files streamed by CSVProcessor.from_epoch_rows
+DEFAULT_CHUNK_SIZE = 1000000
+
+
+def read_csv(
+    file_name: str
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the dates, risk free rate, vol and spot price columns of a
+    market data CSV.
+    """
+    import pandas as pd
+    data = pd.read_csv(
+        file_name,
+        index_col='Date',
+        parse_dates=['Date']
+    )
+    return (
+        data.index.values,
+        data.iloc[:, 0].to_numpy(),
+        data.iloc[:, 1].to_numpy(),
+        data.iloc[:, 2].to_numpy()
+    )
 
 
 class CSVProcessor:
-    def __init__(self, file_name: str) -> None:
-        self.data = pd.read_csv(
+    """Market data for one underlying asset, stored as contiguous float64
+    arrays (risk free rate, vol and spot price) indexed by row.
+
+    Dates that are not in the file (e.g. weekends and holidays in stock data)
+    resolve to the most recent earlier row (as-of lookup). Dates before the
+    first row or after the last row raise a KeyError.
+
+    With use_cache, the file is parsed once into a binary cache next to it
+    (see utils.market_data_cache), and the arrays are memory mapped from the
+    cache without parsing or copying. If the cache cannot be written, the
+    file is parsed every time.
+
+    pandas is only imported to read the file or build DataFrames and
+    Timestamps, so market data created from arrays or a cache does not need
+    it.
+    """
+
+    def __init__(self, file_name: str, use_cache: bool = True) -> None:
+        arrays = read_market_data_cache(file_name) if use_cache else None
+        if arrays is None:
+            arrays = read_csv(file_name)
+            if use_cache:
+                try:
+                    write_market_data_cache(file_name, *arrays)
+                except OSError:
+                    pass
+        self.set_arrays(*arrays)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        dates: np.ndarray,
+        r: np.ndarray,
+        vol: np.ndarray,
+        spot: np.ndarray
+    ) -> 'CSVProcessor':
+        """Returns market data backed by the given arrays. Contiguous float64
+        arrays are used without copying, e.g. views into shared memory.
+        """
+        csv_processor = cls.__new__(cls)
+        csv_processor.set_arrays(dates, r, vol, spot)
+        return csv_processor
+
+    @classmethod
+    def from_epoch_rows(
+        cls,
+        file_name: str,
+        dates: List[datetime],
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> 'CSVProcessor':
+        """Returns market data of only the rows that the dates resolve to,
+        so its memory scales with the number of dates rather than the rows of
+        the file. The file is streamed in chunks of chunk_size rows, or the
+        rows are picked from its binary cache if it has a valid one.
+
+        Lookups of the dates give the same values as with the whole file,
+        but the first and last dates are those of the rows kept. Dates out of
+        the range of the file raise a KeyError.
+        """
+        dates = np.sort(np.asarray(dates, dtype='datetime64[ns]'))
+        arrays = read_market_data_cache(file_name)
+        if arrays is not None:
+            rows = np.unique(cls.from_arrays(*arrays).get_rows(dates))
+            return cls.from_arrays(*(array[rows] for array in arrays))
+
+        import pandas as pd
+        row_dates = np.full(len(dates), np.datetime64('NaT'), 'datetime64[ns]')
+        r, vol, spot = np.full((3, len(dates)), np.nan)
+        last_date = None
+        for chunk in pd.read_csv(
             file_name,
             index_col='Date',
-            parse_dates=['Date']
-        )
+            parse_dates=['Date'],
+            chunksize=chunk_size
+        ):
+            # Rows of later chunks are later, so they replace those found in
+            # earlier chunks
+            chunk_dates = chunk.index.values
+            rows = np.searchsorted(chunk_dates, dates, side='right') - 1
+            is_in_chunk = rows >= 0
+            rows = rows[is_in_chunk]
+            row_dates[is_in_chunk] = chunk_dates[rows]
+            for array, column in zip((r, vol, spot), range(3)):
+                array[is_in_chunk] = chunk.iloc[:, column].to_numpy()[rows]
+            if len(chunk_dates):
+                last_date = chunk_dates[-1]
+        if last_date is None or np.isnat(row_dates).any() or \
+                dates[-1] > last_date:
+            raise KeyError("Date out of the range of the market data")
+
+        row_dates, rows = np.unique(row_dates, return_index=True)
+        return cls.from_arrays(row_dates, r[rows], vol[rows], spot[rows])
+
+    def set_arrays(
+        self,
+        dates: np.ndarray,
+        r: np.ndarray,
+        vol: np.ndarray,
+        spot: np.ndarray
+    ) -> None:
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.r = np.ascontiguousarray(r, dtype=np.float64)
+        self.vol = np.ascontiguousarray(vol, dtype=np.float64)
+        self.spot = np.ascontiguousarray(spot, dtype=np.float64)
+        # Built on the first lookup of a single date, since building it for
+        # long intraday files costs more than opening them
+        self.row_by_date = None
+        # The market data as a DataFrame, built on first access of data
+        self.data_frame = None
+
+    @property
+    def data(self) -> 'pd.DataFrame':
+        if self.data_frame is None:
+            import pandas as pd
+            self.data_frame = pd.DataFrame(
+                {'Rrate': self.r, 'vol': self.vol, 'spot': self.spot},
+                index=pd.DatetimeIndex(self.dates, name='Date')
+            )
+        return self.data_frame
+
+    def get_row(self, date: datetime) -> int:
+        """Returns the row of the date, or of the most recent earlier date if
+        the date is not in the file.
+        """
+        if self.row_by_date is None:
+            self.row_by_date = {
+                date: row for row, date in enumerate(
+                    self.dates.astype('datetime64[us]').tolist())
+            }
+        row = self.row_by_date.get(date)
+        if row is None:
+            row = self.get_rows([date])[0]
+        return row
+
+    def get_rows(self, dates: List[datetime]) -> np.ndarray:
+        """Returns the rows of the dates. See get_row."""
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        rows = np.searchsorted(self.dates, dates, side='right') - 1
+        if np.any(rows < 0) or np.any(dates > self.dates[-1]):
+            raise KeyError("Date out of the range of the market data")
+        return rows
 
     def get_underlying_price(self, date: datetime) -> float:
-        return self.data.loc[date][2]
+        return self.spot[self.get_row(date)]
 
     def get_vol(self, date: datetime) -> float:
-        return self.data.loc[date][1]
+        return self.vol[self.get_row(date)]
 
     def get_r(self, date: datetime) -> float:
-        return self.data.loc[date][0]
+        return self.r[self.get_row(date)]
+
+    def get_underlying_price_many(self, dates: List[datetime]) -> np.ndarray:
+        return self.spot[self.get_rows(dates)]
+
+    def get_vol_many(self, dates: List[datetime]) -> np.ndarray:
+        return self.vol[self.get_rows(dates)]
+
+    def get_r_many(self, dates: List[datetime]) -> np.ndarray:
+        return self.r[self.get_rows(dates)]
 
     def get_first_date(self) -> datetime:
-        return self.data.index[0]
+        import pandas as pd
+        return pd.Timestamp(self.dates[0])
 
     def get_last_date(self) -> datetime:
-        return self.data.index[-1]
+        import pandas as pd
+        return pd.Timestamp(self.dates[-1])
 
     def get_num_weeks_after_date(self, date: date) -> int:
         return floor((self.get_last_date().date() - date).days / 7)
@@ -1,51 +1,143 @@
-from dataclasses import dataclass
+from dataclasses import fields
 from typing import List
 
-import altair as alt
 import numpy as np
+import pandas as pd
 
+from data_classes.epoch import Epoch
+from data_classes.pool_result import PoolResult
 from simulation.option_pool import OptionPool
 
+# Right edges of the bins of purchaser strike range values. A value falls in
+# the first bin whose edge is >= the value.
+STRIKE_VALUE_BIN_EDGES = np.around(np.arange(0.05, 1.05, 0.05), 2)
 
-@dataclass
-class DataValue:
-    distribution: str
-    value: float
+# Maximum number of bars of each option pool in the epoch charts. Runs with
+# more epochs are charted in buckets of consecutive epochs, so the chart data
+# stays the same size however long the run is.
+MAX_CHART_EPOCHS = 200
+
+# The charted columns of the epochs, and how the epochs of a bucket are
+# aggregated: amounts over an epoch are summed, and amounts at the end of an
+# epoch are those of the bucket's last epoch
+CHART_EPOCH_AGGREGATIONS = {
+    "end_underlying_price": "last",
+    "total_value_locked": "last",
+    "total_profit": "sum",
+    "total_lp_profit": "sum"
+}
 
 
 class DataProcessor:
-    def get_data_by_epoch(option_pools: List[OptionPool]) -> alt.Data:
-        return alt.Data(values=[dict(
-            epoch.__dict__,
-            purchaser_distribution=option_pool.purchaser_distribution.name
-        ) for option_pool in option_pools for epoch in option_pool.epochs])
-
-    def get_strike_values_data(option_pools: List[OptionPool]) -> alt.Data:
-        data = []
-        for option_pool in option_pools:
-            option_pool_data = [
-                {
-                    'value': np.around(i, 2),
-                    'frequency': 0,
-                    'distribution': option_pool.purchaser_distribution.name
-                }
-                for i in np.arange(0.05, 1.05, 0.05)]
-            for strike_value in option_pool.strike_values:
-                for i in range(len(option_pool_data)):
-                    if option_pool_data[i]['value'] >= strike_value:
-                        option_pool_data[i]['frequency'] += 1
-                        break
-            data.extend(option_pool_data)
-        return alt.Data(values=data)
-
-    def get_total_lp_profit(option_pools: List[OptionPool]) -> List[DataValue]:
-        data = []
-        for option_pool in option_pools:
-            option_pool_data = DataValue(
-                option_pool.purchaser_distribution.name,
-                0.0
-            )
-            for epoch in option_pool.epochs:
-                option_pool_data.value += epoch.total_lp_profit
-            data.append(option_pool_data)
-        return data
+    def get_epoch_table(
+        option_pools: List[OptionPool or PoolResult]
+    ) -> pd.DataFrame:
+        """Returns one table of the epochs of all option pools, with the
+        option pool's index and purchaser distribution name.
+        """
+        if not option_pools:
+            return pd.DataFrame(columns=[
+                field.name for field in fields(Epoch)
+            ] + ["pool", "purchaser_distribution"])
+        tables = []
+        for i, option_pool in enumerate(option_pools):
+            columns = option_pool.get_epoch_columns()
+            table = pd.DataFrame(columns)
+            table["start_date"] = np.datetime_as_string(
+                columns["start_date"], unit="D")
+            table["pool"] = i
+            table["purchaser_distribution"] = \
+                option_pool.purchaser_distribution.name
+            tables.append(table)
+        return pd.concat(tables, ignore_index=True)
+
+    def get_data_by_epoch(
+        option_pools: List[OptionPool or PoolResult]
+    ) -> pd.DataFrame:
+        return DataProcessor.get_epoch_table(option_pools).drop(
+            columns="pool")
+
+    def get_epochs_per_chart_bar(
+        option_pools: List[OptionPool or PoolResult],
+        max_epochs: int = MAX_CHART_EPOCHS
+    ) -> int:
+        """Returns the number of consecutive epochs aggregated into each bar
+        of the epoch charts, so that no option pool has more than max_epochs
+        bars.
+        """
+        num_epochs = max(
+            (
+                len(option_pool.get_epoch_columns()["start_date"])
+                for option_pool in option_pools
+            ),
+            default=0
+        )
+        return max(-(-num_epochs // max_epochs), 1)
+
+    def get_chart_data_by_epoch(
+        option_pools: List[OptionPool or PoolResult],
+        max_epochs: int = MAX_CHART_EPOCHS
+    ) -> pd.DataFrame:
+        """Returns the charted columns of the epochs of all option pools,
+        with the purchaser distribution name, and at most max_epochs rows per
+        option pool. The epochs of longer runs are aggregated into buckets of
+        get_epochs_per_chart_bar consecutive epochs, the same for every option
+        pool, each labelled by the start date of its first epoch.
+        """
+        epoch_table = DataProcessor.get_epoch_table(option_pools)
+        columns = ["start_date", "purchaser_distribution"] + \
+            list(CHART_EPOCH_AGGREGATIONS)
+        epochs_per_bar = DataProcessor.get_epochs_per_chart_bar(
+            option_pools, max_epochs)
+        if epochs_per_bar == 1:
+            return epoch_table[columns]
+
+        bucket = epoch_table.groupby("pool").cumcount() // epochs_per_bar
+        chart_data = epoch_table.groupby(
+            [epoch_table["pool"], bucket], sort=True
+        ).agg(
+            start_date=("start_date", "first"),
+            purchaser_distribution=("purchaser_distribution", "first"),
+            **{
+                column: (column, aggregation)
+                for column, aggregation in CHART_EPOCH_AGGREGATIONS.items()
+            }
+        )
+        return chart_data.reset_index(drop=True)[columns]
+
+    def get_strike_values_data(
+        option_pools: List[OptionPool or PoolResult],
+        bin_edges: np.ndarray = STRIKE_VALUE_BIN_EDGES
+    ) -> pd.DataFrame:
+        """Returns the number of purchaser strike range values in each bin, by
+        purchaser distribution. Values above the last edge are not counted.
+        """
+        frequencies = [
+            np.bincount(
+                np.searchsorted(bin_edges, option_pool.strike_values),
+                minlength=len(bin_edges) + 1
+            )[:len(bin_edges)]
+            for option_pool in option_pools
+        ]
+        return pd.DataFrame({
+            "value": np.tile(bin_edges, len(option_pools)),
+            "frequency": np.concatenate(frequencies)
+            if frequencies else np.empty(0, dtype=int),
+            "distribution": np.repeat([
+                option_pool.purchaser_distribution.name
+                for option_pool in option_pools
+            ], len(bin_edges))
+        })
+
+    def get_total_lp_profit(
+        option_pools: List[OptionPool or PoolResult]
+    ) -> pd.DataFrame:
+        """Returns the total LP profit over all epochs of each option pool,
+        with its purchaser distribution name.
+        """
+        epoch_table = DataProcessor.get_epoch_table(option_pools)
+        total_lp_profit = epoch_table.groupby("pool", sort=True).agg(
+            distribution=("purchaser_distribution", "first"),
+            value=("total_lp_profit", "sum")
+        )
+        return total_lp_profit.reset_index(drop=True)
@@ -1,8 +1,11 @@
+from typing import Sequence
+
 import altair as alt
+import pandas as pd
 
 
 def create_layered_bar_chart(
-    data: alt.Data,
+    data: alt.Data or pd.DataFrame,
     x_shorthand: str,
     x_axis_title: str,
     y_shorthand: str,
@@ -33,6 +36,17 @@ def create_layered_bar_chart(
     )
 
 
+def create_stacked_chart(
+    data: pd.DataFrame,
+    charts: Sequence[alt.Chart]
+) -> alt.VConcatChart:
+    """Returns the charts stacked vertically over one copy of data, which
+    the charts, created without data, share instead of each embedding their
+    own.
+    """
+    return alt.vconcat(*charts, data=data)
+
+
 def get_dollar_str(value: float) -> str:
     if value < 0:
         dollar_str = "-"
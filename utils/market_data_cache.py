@@ -0,0 +1,131 @@
+"""A binary columnar cache of a market data CSV, written next to it, so that
+processes open the market data by memory mapping instead of parsing the CSV.
+
+The cache file is a fixed size header followed by the columns back to back:
+
+    magic          8 bytes
+    version        uint64
+    num_rows       uint64
+    source size    int64, bytes
+    source mtime   int64, nanoseconds
+    source hash    32 bytes, SHA-256 of the CSV
+    dates          int64 x num_rows, nanoseconds since the epoch
+    r, vol, spot   float64 x num_rows each
+
+in native byte order. A cache is used if the CSV's size and mtime match its
+header, or else if the CSV's hash does (e.g. after a checkout that touched
+the file), and is rebuilt otherwise.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from typing import Tuple
+
+import numpy as np
+
+CACHE_MAGIC = b"OPMDATA\0"
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".cache"
+HEADER = struct.Struct("=8sQQqq32s")
+
+MarketDataArrays = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def get_cache_file_name(file_name: str) -> str:
+    return file_name + CACHE_SUFFIX
+
+
+def hash_file(file_name: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def read_market_data_cache(file_name: str) -> MarketDataArrays or None:
+    """Returns the dates, r, vol and spot arrays of the CSV's cache as
+    read-only views of a memory mapping of the cache file, or None if there
+    is no valid cache. Processes that map the same cache share its pages.
+    """
+    try:
+        source = os.stat(file_name)
+        with open(get_cache_file_name(file_name), "rb") as file:
+            if os.fstat(file.fileno()).st_size < HEADER.size:
+                return None
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError:
+        return None
+
+    magic, version, num_rows, size, mtime, source_hash = \
+        HEADER.unpack_from(buffer)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION or \
+            len(buffer) != HEADER.size + 32 * num_rows:
+        return None
+    is_stale = (size, mtime) != (source.st_size, source.st_mtime_ns)
+    if is_stale and hash_file(file_name) != source_hash:
+        return None
+
+    dates = np.frombuffer(
+        buffer, dtype=np.int64, count=num_rows, offset=HEADER.size)
+    r, vol, spot = (
+        np.frombuffer(
+            buffer,
+            dtype=np.float64,
+            count=num_rows,
+            offset=HEADER.size + 8 * num_rows * i
+        ) for i in range(1, 4)
+    )
+    arrays = dates.view('datetime64[ns]'), r, vol, spot
+    if is_stale:
+        # Record the new mtime, so that later reads skip hashing
+        try:
+            write_market_data_cache(file_name, *arrays, source_hash)
+        except OSError:
+            pass
+    return arrays
+
+
+def write_market_data_cache(
+    file_name: str,
+    dates: np.ndarray,
+    r: np.ndarray,
+    vol: np.ndarray,
+    spot: np.ndarray,
+    source_hash: bytes = None
+) -> None:
+    """Writes the cache of the CSV's arrays next to it. The cache is written
+    to a temporary file that replaces the old cache, so processes that have
+    the old one mapped keep reading it unchanged.
+    """
+    source = os.stat(file_name)
+    if source_hash is None:
+        source_hash = hash_file(file_name)
+    header = HEADER.pack(
+        CACHE_MAGIC,
+        CACHE_VERSION,
+        len(dates),
+        source.st_size,
+        source.st_mtime_ns,
+        source_hash
+    )
+    cache_file_name = get_cache_file_name(file_name)
+    descriptor, temporary_file_name = tempfile.mkstemp(
+        dir=os.path.dirname(cache_file_name) or ".",
+        prefix=os.path.basename(cache_file_name) + "."
+    )
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(header)
+            file.write(np.ascontiguousarray(
+                dates, dtype='datetime64[ns]').view(np.int64).tobytes())
+            for array in (r, vol, spot):
+                file.write(np.ascontiguousarray(
+                    array, dtype=np.float64).tobytes())
+        os.chmod(temporary_file_name, 0o644)
+        os.replace(temporary_file_name, cache_file_name)
+    except BaseException:
+        os.unlink(temporary_file_name)
+        raise
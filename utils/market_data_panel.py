@@ -0,0 +1,100 @@
+from datetime import datetime
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from data_classes.underlying_asset import UnderlyingAsset
+from utils.csv_processor import CSVProcessor
+
+
+class MarketDataPanel:
+    """Market data of several underlying assets aligned on one date index.
+    The risk free rate, vol and spot price are stored as asset x date float64
+    arrays, so the market data of every asset on a date is one column lookup.
+
+    The date index is the union of the assets' dates over the range that all
+    assets cover. An asset without a row on one of these dates takes its most
+    recent earlier row, and lookups resolve dates that are not in the index
+    the same way (see CSVProcessor).
+    """
+
+    def __init__(
+        self,
+        csv_processors: Dict[UnderlyingAsset, CSVProcessor]
+    ) -> None:
+        self.assets = tuple(csv_processors)
+        first_date = max(
+            csv_processor.dates[0] for csv_processor in csv_processors.values())
+        last_date = min(
+            csv_processor.dates[-1] for csv_processor in csv_processors.values())
+        if first_date > last_date:
+            raise ValueError("The market data of the assets do not overlap")
+
+        dates = np.unique(np.concatenate([
+            csv_processor.dates for csv_processor in csv_processors.values()
+        ]))
+        self.dates = dates[(dates >= first_date) & (dates <= last_date)]
+        rows = [
+            csv_processor.get_rows(self.dates)
+            for csv_processor in csv_processors.values()
+        ]
+        self.r = np.stack([
+            csv_processor.r[asset_rows] for csv_processor, asset_rows in zip(
+                csv_processors.values(), rows)
+        ])
+        self.vol = np.stack([
+            csv_processor.vol[asset_rows] for csv_processor, asset_rows in zip(
+                csv_processors.values(), rows)
+        ])
+        self.spot = np.stack([
+            csv_processor.spot[asset_rows] for csv_processor, asset_rows in zip(
+                csv_processors.values(), rows)
+        ])
+        self.row_by_date = {
+            date: row for row, date in enumerate(
+                self.dates.astype('datetime64[us]').tolist())
+        }
+
+    @classmethod
+    def from_files(
+        cls,
+        data_files: Dict[UnderlyingAsset, str]
+    ) -> 'MarketDataPanel':
+        return cls({
+            asset: CSVProcessor(data_file)
+            for asset, data_file in data_files.items()
+        })
+
+    def get_asset_indices(self, assets: Sequence[UnderlyingAsset]) -> np.ndarray:
+        """Returns the rows of the assets in the asset x date arrays."""
+        return np.array([self.assets.index(asset) for asset in assets])
+
+    def get_row(self, date: datetime) -> int:
+        """Returns the column of the date in the asset x date arrays, or of the
+        most recent earlier date if the date is not in the index.
+        """
+        row = self.row_by_date.get(date)
+        if row is None:
+            row = self.get_rows([date])[0]
+        return row
+
+    def get_rows(self, dates: List[datetime]) -> np.ndarray:
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        rows = np.searchsorted(self.dates, dates, side='right') - 1
+        if np.any(rows < 0) or np.any(dates > self.dates[-1]):
+            raise KeyError("Date out of the range of the market data")
+        return rows
+
+    def get_csv_processor(self, asset: UnderlyingAsset) -> CSVProcessor:
+        """Returns the aligned market data of one asset, backed by views of
+        the panel's arrays.
+        """
+        i = self.assets.index(asset)
+        return CSVProcessor.from_arrays(
+            self.dates, self.r[i], self.vol[i], self.spot[i])
+
+    def get_first_date(self) -> datetime:
+        return self.dates[0].astype('datetime64[us]').item()
+
+    def get_last_date(self) -> datetime:
+        return self.dates[-1].astype('datetime64[us]').item()
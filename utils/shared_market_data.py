@@ -0,0 +1,100 @@
+import multiprocessing
+import sys
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from utils.csv_processor import CSVProcessor
+
+
+@dataclass(frozen=True)
+class SharedMarketDataHandle:
+    name: str  # name of the shared memory block
+    num_rows: int
+
+
+def get_shared_arrays(shared_memory: SharedMemory, num_rows: int) -> tuple:
+    """Returns the dates, r, vol and spot arrays stored back to back in the
+    shared memory block.
+    """
+    dates = np.ndarray(
+        (num_rows,), dtype='datetime64[ns]', buffer=shared_memory.buf)
+    r, vol, spot = (
+        np.ndarray(
+            (num_rows,),
+            dtype=np.float64,
+            buffer=shared_memory.buf,
+            offset=8 * num_rows * i
+        ) for i in range(1, 4)
+    )
+    return dates, r, vol, spot
+
+
+class SharedMarketData:
+    """One read-only copy of the market data in a shared memory block. Worker
+    processes attach to it through its handle instead of parsing the CSV or
+    unpickling the data. The creating process owns the block and must close
+    it (or use it as a context manager).
+    """
+
+    def __init__(self, csv_processor: CSVProcessor) -> None:
+        num_rows = len(csv_processor.dates)
+        self.shared_memory = SharedMemory(create=True, size=32 * num_rows)
+        for array, values in zip(
+            get_shared_arrays(self.shared_memory, num_rows),
+            (
+                csv_processor.dates,
+                csv_processor.r,
+                csv_processor.vol,
+                csv_processor.spot
+            )
+        ):
+            array[:] = values
+        self.handle = SharedMarketDataHandle(
+            self.shared_memory.name, num_rows)
+
+    def close(self) -> None:
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    def __enter__(self) -> 'SharedMarketData':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def attach_shared_memory(name: str) -> SharedMemory:
+    """Attaches to a shared memory block that another process created and
+    unlinks, without this process's resource tracker unlinking it too.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    shared_memory = SharedMemory(name=name)
+    # Before Python 3.13, attaching registers the block with the process's
+    # resource tracker, which unlinks the blocks still registered once the
+    # processes using it have exited. Unregistering the block through the
+    # module's unregister after attaching is the usual workaround. Worker
+    # processes started by multiprocessing share the tracker of the process
+    # that started them though, where the creator's registration of the
+    # block is the same entry, so they keep it: unregistering it there would
+    # make the creator's unlink fail.
+    if multiprocessing.parent_process() is None:
+        resource_tracker.unregister(shared_memory._name, "shared_memory")
+    return shared_memory
+
+
+def attach_market_data(handle: SharedMarketDataHandle) -> CSVProcessor:
+    """Returns market data backed by read-only views of the shared memory
+    block of the handle.
+    """
+    shared_memory = attach_shared_memory(handle.name)
+    arrays = get_shared_arrays(shared_memory, handle.num_rows)
+    for array in arrays:
+        array.flags.writeable = False
+    csv_processor = CSVProcessor.from_arrays(*arrays)
+    # Keep the block mapped for as long as the market data is in use
+    csv_processor.shared_memory = shared_memory
+    return csv_processor